@@ -0,0 +1,122 @@
+import json
+from json_salvage import remaining_tail, title_pattern
+
+# Completions that stop for this reason were cut off at max_tokens
+TRUNCATED_FINISH_REASON = "length"
+
+
+# Rough characters per token for English menu text and compact JSON
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def serialize_record(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def serialize_payload(payload):
+    """
+    Render a chunk payload (list of OCR records or plain text) as prompt text.
+    Records are written as a JSON array with one compact record per line.
+    """
+    if isinstance(payload, list):
+        return "[\n" + ",\n".join(serialize_record(r) for r in payload) + "\n]"
+    return payload
+
+
+def text_payload_size(payload):
+    return len(serialize_payload(payload))
+
+
+def split_payload(payload):
+    """
+    Split a chunk payload into two halves: by OCR records for structured input,
+    by lines for plain text. Returns None if the payload cannot be split further.
+    """
+    if isinstance(payload, list):
+        if len(payload) < 2:
+            return None
+        mid = len(payload) // 2
+        return [payload[:mid], payload[mid:]]
+    lines = payload.splitlines(keepends=True)
+    if len(lines) < 2:
+        return None
+    mid = len(lines) // 2
+    return [''.join(lines[:mid]), ''.join(lines[mid:])]
+
+
+def payload_tail(payload, last_item_title):
+    """
+    Return the part of a payload after the record/line holding the last item the
+    model finished. The result is empty when nothing follows that item and None
+    when it cannot be located.
+    """
+    if not last_item_title or not last_item_title.strip():
+        return None
+    if isinstance(payload, list):
+        pattern = title_pattern(last_item_title)
+        for idx in range(len(payload) - 1, -1, -1):
+            if pattern.search(json.dumps(payload[idx], ensure_ascii=False)):
+                return payload[idx + 1:]
+        return None
+    return remaining_tail(payload, last_item_title)
+
+
+def chunk_ocr_records(records, max_length=2000):
+    """
+    Pack consecutive OCR records into chunks whose serialized size stays under
+    max_length, never splitting a record across chunks.
+    """
+    chunks = []
+    current = []
+    current_size = 0
+    for record in records:
+        size = len(serialize_record(record)) + 2
+        if current and current_size + size > max_length:
+            chunks.append(current)
+            current = []
+            current_size = 0
+        current.append(record)
+        current_size += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ChunkSizer:
+    """
+    Per-menu chunk size limit learned from truncated completions.
+    Every truncation lowers the limit to what the model managed to finish, so
+    the chunks that follow are split up front instead of being retried.
+    """
+
+    def __init__(self, max_size, size_fn=text_payload_size, split_fn=split_payload, min_size=1):
+        self.max_size = max_size
+        self.min_size = min_size
+        self.size_fn = size_fn
+        self.split_fn = split_fn
+        self.truncations = 0
+
+    def fit(self, payload):
+        """Split payload until every piece is within the learned limit."""
+        if self.size_fn(payload) <= self.max_size:
+            return [payload]
+        halves = self.split_fn(payload)
+        if not halves:
+            return [payload]
+        pieces = []
+        for half in halves:
+            pieces.extend(self.fit(half))
+        return pieces
+
+    def observe_truncation(self, payload_size, completed_size=None):
+        """Record that a payload of payload_size was cut off after completed_size."""
+        self.truncations += 1
+        learned = completed_size if completed_size else payload_size // 2
+        new_limit = max(self.min_size, min(self.max_size, int(learned * 0.9)))
+        if new_limit < self.max_size:
+            print(f"Chunk limit lowered from {self.max_size} to {new_limit} after truncation")
+        self.max_size = new_limit
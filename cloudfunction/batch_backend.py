@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import uuid
+
+# One line of a batch input file: an OpenAI Batch API request
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def batch_request(custom_id, body):
+    return {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body}
+
+
+def read_results(lines):
+    """{custom_id: chat completion body, or None for a failed request} from batch output lines."""
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        ok = not record.get("error") and response.get("status_code", 200) == 200
+        results[record["custom_id"]] = response.get("body") if ok else None
+    return results
+
+
+class BatchBackend:
+    """
+    Submits JSONL files of chat completion requests for asynchronous execution
+    and returns their results once done. Batch ids are plain strings, so a
+    run can be resumed from another process.
+    """
+    name = None
+
+    def submit(self, requests_path):
+        """Submit a JSONL request file; returns the batch id."""
+        raise NotImplementedError
+
+    def status(self, batch_id):
+        """PENDING, COMPLETED or FAILED."""
+        raise NotImplementedError
+
+    def results(self, batch_id):
+        """{custom_id: chat completion body or None} of a completed batch."""
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """The OpenAI Batch API (24h completion window, lower price than interactive calls)."""
+    name = "openai"
+
+    def __init__(self, client=None, completion_window="24h"):
+        if client is None:
+            import openai
+            client = openai
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, requests_path):
+        with open(requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return COMPLETED
+        if batch.status in ("failed", "expired", "cancelled"):
+            return FAILED
+        return PENDING
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.update(read_results(self.client.files.content(file_id).text.splitlines()))
+        return results
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for tests and dry runs. A submitted file is copied to
+    <directory>/<batch_id>.input.jsonl; the batch completes when
+    <batch_id>.output.jsonl (Batch API output format) appears next to it. With
+    a responder (request body -> chat completion body), the output is written
+    at submit time.
+    """
+    name = "local"
+
+    def __init__(self, directory, responder=None):
+        self.directory = directory
+        self.responder = responder
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id, kind):
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, requests_path):
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(requests_path, self._path(batch_id, "input"))
+        if self.responder is not None:
+            with open(requests_path, "r", encoding="utf-8") as src, \
+                    open(self._path(batch_id, "output"), "w", encoding="utf-8") as out:
+                for line in src:
+                    if not line.strip():
+                        continue
+                    request = json.loads(line)
+                    body = self.responder(request["body"])
+                    out.write(json.dumps({
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": body},
+                        "error": None,
+                    }, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def status(self, batch_id):
+        return COMPLETED if os.path.exists(self._path(batch_id, "output")) else PENDING
+
+    def results(self, batch_id):
+        with open(self._path(batch_id, "output"), "r", encoding="utf-8") as f:
+            return read_results(f)
+
+
+def get_backend(name, local_dir=None):
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(local_dir or os.path.join(os.getcwd(), "batches"))
+    raise ValueError(f"Unknown batch backend: {name}")
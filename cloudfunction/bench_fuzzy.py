@@ -0,0 +1,103 @@
+"""
+Benchmark FuzzyMatcher against difflib.get_close_matches, the matching path
+used by canonicalize_subcat and merge_menu_json before the trigram index.
+
+    python bench_fuzzy.py --sizes 10,100,1000,5000 --queries 2000
+"""
+import argparse
+import random
+import string
+import time
+from difflib import get_close_matches
+
+from fuzzy_match import FuzzyMatcher
+
+WORDS = (
+    "chef specials house grilled fried fresh garden seasonal classic signature kids "
+    "lunch dinner breakfast brunch dessert drinks beverages wines beers cocktails "
+    "appetizers starters salads soups sandwiches burgers pizza pasta seafood steaks "
+    "sides sauces vegan vegetarian gluten free hot cold coffee tea smoothies"
+).split()
+
+
+def vocabulary(size, rng):
+    """Distinct subcategory-like titles of one to three words."""
+    titles = set()
+    while len(titles) < size:
+        titles.add(" ".join(rng.sample(WORDS, rng.randint(1, 3))))
+    return sorted(titles)
+
+
+def typo(text, rng):
+    """OCR-style noise: a dropped, swapped or replaced character, or none."""
+    if len(text) < 3:
+        return text
+    i = rng.randrange(len(text) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return text[:i] + text[i + 1:]
+    if kind == 1:
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    if kind == 2:
+        return text[:i] + rng.choice(string.ascii_lowercase) + text[i + 1:]
+    return text
+
+
+def queries(vocab, count, rng):
+    """Mostly noisy vocabulary titles, plus unrelated titles that should not match."""
+    out = []
+    for _ in range(count):
+        if rng.random() < 0.8:
+            out.append(typo(rng.choice(vocab), rng))
+        else:
+            out.append("".join(rng.choice(string.ascii_lowercase + " ") for _ in range(rng.randint(4, 20))).strip())
+    return out
+
+
+def bench(size, query_count, cutoff, seed):
+    rng = random.Random(seed)
+    vocab = vocabulary(size, rng)
+    qs = queries(vocab, query_count, rng)
+
+    start = time.perf_counter()
+    expected = [(get_close_matches(q, vocab, n=1, cutoff=cutoff) or [None])[0] for q in qs]
+    difflib_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = FuzzyMatcher(vocab)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cold = [matcher.best_match(q, cutoff) for q in qs]
+    cold_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for q in qs:
+        matcher.best_match(q, cutoff)
+    warm_s = time.perf_counter() - start
+
+    agree = sum(1 for a, b in zip(expected, cold) if a == b) / len(qs)
+    return {
+        "size": size, "queries": len(qs), "difflib_ms": difflib_s * 1000,
+        "build_ms": build_s * 1000, "index_ms": cold_s * 1000, "cached_ms": warm_s * 1000,
+        "speedup": difflib_s / cold_s if cold_s else float("inf"), "agreement": agree,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FuzzyMatcher vs difflib.get_close_matches")
+    parser.add_argument("--sizes", default="10,100,1000,5000", help="comma-separated vocabulary sizes")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--cutoff", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'vocab':>6} {'queries':>7} {'difflib ms':>11} {'build ms':>9} {'index ms':>9} {'cached ms':>10} {'speedup':>8} {'agree':>7}")
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        r = bench(size, args.queries, args.cutoff, args.seed)
+        print(f"{r['size']:>6} {r['queries']:>7} {r['difflib_ms']:>11.1f} {r['build_ms']:>9.1f} {r['index_ms']:>9.1f} "
+              f"{r['cached_ms']:>10.1f} {r['speedup']:>7.1f}x {r['agreement']:>7.2%}")
+
+
+if __name__ == "__main__":
+    main()
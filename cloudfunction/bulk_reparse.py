@@ -0,0 +1,408 @@
+"""
+Offline bulk re-parse of stored menus through a batch LLM API.
+
+`submit` collects the chunk prompts of every menu, exactly as parse_menu
+would send them, into JSONL batch files and submits them. `resume` picks
+the run up from its work directory once the batch is done: it merges the
+chunks, sends the vision refinements still needed as a second batch, and
+finally post-processes and stores each menu with store_menu_json. Chunks
+whose batch output is truncated or unparseable are re-run interactively.
+
+    python bulk_reparse.py submit --collection menus_langchain_vision --work-dir runs/prompts-v7
+    python bulk_reparse.py submit --manifest menus.jsonl --work-dir runs/prompts-v7 --backend local
+    python bulk_reparse.py resume --work-dir runs/prompts-v7 --wait 600
+
+Manifest lines are {"docId", "collection", "sourceFilePath", "ocr_data"}.
+Without ocr_data (and for --collection), the OCR is read back from the
+request artifact in the document's debugRawTextPath.
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+
+from firebase_admin import firestore
+
+import metrics
+import settings
+from adaptive_chunking import TRUNCATED_FINISH_REASON, ChunkSizer, serialize_payload
+from batch_backend import COMPLETED, FAILED, batch_request, get_backend
+from file_utils import download_file_from_firebase, extract_data_from_excel, file_content_hash, get_storage_bucket
+from firebase_utils import init_firebase, store_menu_json
+from json_salvage import parse_model_json
+from langchain_pipeline import chunk_messages, menu_payloads, merged_menu, parse_chunk_cascade, rule_based_result
+from menu_model import menu_to_json
+from menu_parser_with_file import (
+    apply_refinement, encode_image, merge_page_results, pdf_page_count, pdf_text_pages, pdf_to_images,
+    refine_messages, refine_output_json, refinement_plan, reindex_menu_ids, split_menu_by_subcats,
+)
+from result_index import pipeline_version, record_result, result_key
+
+TEXT_COLLECTION = "menus_langchain"
+VISION_COLLECTION = "menus_langchain_vision"
+# Batch API limits per input file
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = 180 * 1024 * 1024
+
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def chat_body(messages, model):
+    """Chat completion request body with the interactive pipeline's sampling settings."""
+    return {"model": model, "messages": messages, "max_tokens": 4096, "temperature": 0, "top_p": 1}
+
+
+def openai_messages(messages):
+    """LangChain chat messages as OpenAI message dicts."""
+    return [{"role": ROLES.get(m.type, m.type), "content": m.content} for m in messages]
+
+
+# --- Jobs and units -------------------------------------------------------
+
+def debug_ocr(debug_path):
+    """The OCR/menu text a document was parsed from, read from its request debug artifact."""
+    data = get_storage_bucket().blob(debug_path).download_as_bytes()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    for line in data.decode("utf-8").splitlines():
+        record = json.loads(line)
+        if record.get("kind") == "request":
+            return record.get("content")
+    return None
+
+
+def collection_jobs(collection):
+    """One job per stored document of a menu collection."""
+    jobs = []
+    for doc_ref in init_firebase().collection(collection).list_documents():
+        doc = doc_ref.get().to_dict() or {}
+        jobs.append({
+            "docId": doc_ref.id, "collection": collection,
+            "sourceFilePath": doc.get("sourceFilePath"), "debugRawTextPath": doc.get("debugRawTextPath"),
+        })
+    return jobs
+
+
+def manifest_jobs(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def job_units(job):
+    """
+    Split a job into parse units the way parse_menu_with_file routes its input:
+    one per menu, image or PDF page. Units with "page" (or "image") get a
+    vision refinement of their text parse.
+    """
+    path = job.get("sourceFilePath") or ""
+    lower = path.lower()
+    ocr = job.get("ocr_data")
+    if job["collection"] == TEXT_COLLECTION:
+        return [{"ocr": ocr}]
+    if ocr and lower.endswith((".png", ".jpg", ".jpeg")):
+        return [{"ocr": ocr, "image": True}]
+    if lower.endswith(".pdf"):
+        file_bytes = download_file_from_firebase(path)
+        page_ocr = json.loads(ocr) if isinstance(ocr, str) else ocr
+        page_count = pdf_page_count(file_bytes)
+        if page_ocr and not (isinstance(page_ocr, list) and len(page_ocr) == page_count):
+            return [{"ocr": page_ocr, "page": 1}]
+        page_ocr = page_ocr or [None] * page_count
+        units = []
+        for page, words in enumerate(pdf_text_pages(file_bytes, 1, page_count), start=1):
+            if words:
+                units.append({"ocr": words})
+            elif page_ocr[page - 1]:
+                units.append({"ocr": page_ocr[page - 1], "page": page})
+            else:
+                # Reparsing without this page would replace a complete menu with a partial one
+                raise ValueError(f"no text layer or OCR data for page {page}")
+        return units
+    if ocr:
+        return [{"ocr": ocr}]
+    if lower.endswith((".xls", ".xlsx")):
+        return [{"ocr": extract_data_from_excel(download_file_from_firebase(path))}]
+    raise ValueError("no OCR data for this menu")
+
+
+def unit_image(job, unit):
+    """The unit's page image, from the source file."""
+    file_bytes = download_file_from_firebase(job["sourceFilePath"])
+    if unit.get("page"):
+        return pdf_to_images(file_bytes, unit["page"], unit["page"])[0]
+    return file_bytes
+
+
+# --- Work directory -------------------------------------------------------
+
+def load_state(work_dir):
+    with open(os.path.join(work_dir, "state.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(work_dir, state):
+    path = os.path.join(work_dir, "state.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def write_batch_files(work_dir, phase, requests):
+    """Write requests as JSONL files within the Batch API limits; returns their paths."""
+    paths, lines, size = [], [], 0
+
+    def flush():
+        path = os.path.join(work_dir, f"{phase}.{len(paths)}.requests.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        paths.append(path)
+
+    for request in requests:
+        line = json.dumps(request, ensure_ascii=False) + "\n"
+        if lines and (len(lines) >= BATCH_MAX_REQUESTS or size + len(line) > BATCH_MAX_BYTES):
+            flush()
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line)
+    if lines:
+        flush()
+    return paths
+
+
+def submit_phase(backend, work_dir, state, phase, requests):
+    paths = write_batch_files(work_dir, phase, requests)
+    state["phase"] = phase
+    state["batches"] = [backend.submit(path) for path in paths]
+    print(f"Submitted {len(requests)} {phase} requests as {len(paths)} batches: {', '.join(state['batches'])}")
+    save_state(work_dir, state)
+
+
+def backend_for(state):
+    return get_backend(state["backend"], local_dir=state["localDir"])
+
+
+def collect_results(backend, state):
+    """Results of the current phase's batches, or None while any is still running."""
+    statuses = [backend.status(batch_id) for batch_id in state["batches"]]
+    if any(status == FAILED for status in statuses):
+        print("Batch failed; the affected requests are re-run interactively.")
+    if any(status not in (COMPLETED, FAILED) for status in statuses):
+        return None
+    results = {}
+    for batch_id, status in zip(state["batches"], statuses):
+        if status == COMPLETED:
+            results.update(backend.results(batch_id))
+    return results
+
+
+# --- Phases ---------------------------------------------------------------
+
+def prepare_chunks(state):
+    """Build each unit's chunks; returns the batch requests for those the rule-based parser does not take."""
+    requests = []
+    for job in state["jobs"]:
+        for unit in job.get("units", []):
+            sizer = ChunkSizer(settings.CHUNK_MAX_CHARS, min_size=settings.CHUNK_MIN_CHARS)
+            unit["chunks"] = []
+            for payload in menu_payloads(unit["ocr"]):
+                for piece in sizer.fit(payload):
+                    chunk_id = f"{unit['id']}/{len(unit['chunks'])}"
+                    result = rule_based_result(piece, label=chunk_id)
+                    unit["chunks"].append({"id": chunk_id, "payload": piece, "result": result})
+                    if result is None:
+                        messages = openai_messages(chunk_messages(serialize_payload(piece)))
+                        requests.append(batch_request(chunk_id, chat_body(messages, state["model"])))
+    return requests
+
+
+def chunk_output(body):
+    """Parsed chunk result from a batch response, or None when it must be re-run (failed, truncated, unparseable)."""
+    if not body:
+        return None
+    metrics.record_token_usage("batch_chunk", body.get("usage"))
+    choice = body["choices"][0]
+    if choice.get("finish_reason") == TRUNCATED_FINISH_REASON:
+        return None
+    try:
+        parsed, report = parse_model_json((choice["message"].get("content") or "").strip())
+    except ValueError:
+        return None
+    if report is not None and report["truncated"]:
+        return None
+    return parsed
+
+
+def finish_chunks(state, results):
+    """Merge each unit's chunk results; returns the refinement batch requests still needed."""
+    requests = []
+    for job in state["jobs"]:
+        for unit in job.get("units", []):
+            if unit.get("error"):
+                continue
+            try:
+                sizer = ChunkSizer(settings.CHUNK_MAX_CHARS, min_size=settings.CHUNK_MIN_CHARS)
+                chunk_results = []
+                for chunk in unit.pop("chunks"):
+                    if chunk["result"] is not None:
+                        chunk_results.append(chunk["result"])
+                        continue
+                    parsed = chunk_output(results.get(chunk["id"]))
+                    if parsed is None:
+                        metrics.incr("bulk_chunks_rerun")
+                        chunk_results.extend(parse_chunk_cascade(chunk["payload"], sizer, label=chunk["id"]))
+                    else:
+                        chunk_results.append(parsed)
+                initial_json = merged_menu(chunk_results, label=unit["id"])
+                if not (unit.get("page") or unit.get("image")):
+                    unit["final"] = reindex_menu_ids(initial_json)
+                    continue
+                plan, subcat_ids, _ = refinement_plan(initial_json, unit["ocr"])
+                metrics.incr(f"vision_refine_{plan}")
+                if plan == "skip":
+                    unit["final"] = reindex_menu_ids(initial_json)
+                    continue
+                kept, target = split_menu_by_subcats(initial_json, subcat_ids) if plan == "partial" else (None, initial_json)
+                unit["initial"], unit["kept"] = initial_json, kept
+                image_url = encode_image(unit_image(job, unit))
+                requests.append(batch_request(f"{unit['id']}/refine", chat_body(refine_messages(target, image_url), "gpt-4.1-mini")))
+            except Exception as e:
+                print(f"Unit {unit['id']} failed:", e)
+                unit["error"] = str(e)
+    return requests
+
+
+def finish_refinements(state, results):
+    for job in state["jobs"]:
+        for unit in job.get("units", []):
+            if unit.get("error") or "initial" not in unit:
+                continue
+            body = results.get(f"{unit['id']}/refine")
+            if body:
+                metrics.record_token_usage("batch_refine", body.get("usage"))
+                output = refine_output_json(body["choices"][0]["message"].get("content") or "")
+                unit["final"] = apply_refinement(unit.pop("initial"), unit.pop("kept"), output)
+            else:
+                print(f"No refinement for {unit['id']}; keeping the text parse.")
+                unit["final"] = reindex_menu_ids(unit.pop("initial"))
+                unit.pop("kept")
+
+
+def store_jobs(state):
+    """Merge each job's units and store the menu in its document, replacing the previous parse."""
+    stored = failed = 0
+    for job in state["jobs"]:
+        units = job.get("units") or []
+        errors = [u["error"] for u in units if u.get("error")] + ([job["error"]] if job.get("error") else [])
+        if errors or not units:
+            print(f"Not storing {job['collection']}/{job['docId']}:", "; ".join(errors) or "nothing parsed")
+            failed += 1
+            continue
+        finals = [u["final"] for u in units]
+        menu = finals[0] if len(finals) == 1 else merge_page_results(finals)
+        doc_ref = init_firebase().collection(job["collection"]).document(job["docId"])
+        previous = doc_ref.get()
+        previous = previous.to_dict() if previous.exists else {}
+        store_menu_json(job["docId"], {
+            "menu": [menu],
+            "sourceFilePath": job.get("sourceFilePath"),
+            "source": "langchain",
+            "createdAt": previous.get("createdAt", firestore.SERVER_TIMESTAMP),
+            "reparsedAt": firestore.SERVER_TIMESTAMP,
+            "pipelineVersion": pipeline_version(),
+            "debugRawTextPath": job.get("debugRawTextPath") or previous.get("debugRawTextPath"),
+        }, collection_name=job["collection"])
+        if settings.RESULT_DEDUPE and job.get("sourceFilePath"):
+            file_hash = file_content_hash(job["sourceFilePath"]) if job["collection"] == VISION_COLLECTION else None
+            record_result(result_key(job["collection"], job.get("ocr_data"), file_hash), job["collection"], job["docId"])
+        stored += 1
+    print(f"Stored {stored} menus; {failed} not stored")
+
+
+# --- Commands -------------------------------------------------------------
+
+def submit(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    jobs = manifest_jobs(args.manifest) if args.manifest else collection_jobs(args.collection)
+    for n, job in enumerate(jobs):
+        job.setdefault("collection", args.collection or TEXT_COLLECTION)
+        try:
+            if job.get("ocr_data") is None and job.get("debugRawTextPath"):
+                job["ocr_data"] = debug_ocr(job["debugRawTextPath"])
+            job["units"] = job_units(job)
+            for k, unit in enumerate(job["units"]):
+                unit["id"] = f"{n}.{k}"
+        except Exception as e:
+            print(f"Skipping {job['collection']}/{job.get('docId')}:", e)
+            job["error"] = str(e)
+    state = {
+        "backend": args.backend,
+        "localDir": args.local_dir or os.path.join(args.work_dir, "batches"),
+        "model": args.model,
+        "jobs": jobs,
+    }
+    backend = backend_for(state)
+    requests = prepare_chunks(state)
+    print(f"{len(jobs)} menus, {sum(len(j.get('units', [])) for j in jobs)} parse units, {len(requests)} chunk prompts")
+    if requests:
+        submit_phase(backend, args.work_dir, state, "chunks", requests)
+    else:
+        state["phase"], state["batches"] = "chunks", []
+        save_state(args.work_dir, state)
+
+
+def resume(args):
+    state = load_state(args.work_dir)
+    backend = backend_for(state)
+    deadline = time.monotonic() + (args.wait or 0)
+    while state["phase"] != "done":
+        results = collect_results(backend, state)
+        if results is None:
+            if time.monotonic() >= deadline:
+                print(f"Batches for phase {state['phase']!r} still running; resume later.")
+                return
+            time.sleep(min(30, max(1, deadline - time.monotonic())))
+            continue
+        if state["phase"] == "chunks":
+            requests = finish_chunks(state, results)
+            if requests:
+                submit_phase(backend, args.work_dir, state, "refine", requests)
+                continue
+        else:
+            finish_refinements(state, results)
+        for job in state["jobs"]:
+            for unit in job.get("units", []):
+                if "final" in unit:
+                    unit["final"] = menu_to_json(unit["final"])
+        state["phase"] = "store"
+        save_state(args.work_dir, state)
+        store_jobs(state)
+        state["phase"] = "done"
+        save_state(args.work_dir, state)
+    print("Bulk re-parse complete:", json.dumps(metrics.snapshot()["counters"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-parse stored menus through a batch LLM API")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="collect chunk prompts and submit the first batch")
+    source = submit_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="JSONL file of {docId, collection, sourceFilePath, ocr_data}")
+    source.add_argument("--collection", choices=[TEXT_COLLECTION, VISION_COLLECTION], help="re-parse every document of a collection")
+    submit_parser.add_argument("--work-dir", required=True, help="directory holding the run's state and batch files")
+    submit_parser.add_argument("--backend", choices=["openai", "local"], default="openai")
+    submit_parser.add_argument("--local-dir", help="local backend: where batch input/output files are exchanged")
+    submit_parser.add_argument("--model", default=(settings.CHUNK_MODELS or ["gpt-4.1-mini"])[-1], help="chunk model (default: last of CHUNK_MODELS)")
+    submit_parser.add_argument("--wait", type=int, default=0, help="seconds to wait for batches to finish")
+    resume_parser = commands.add_parser("resume", help="continue a run whose batches have finished")
+    resume_parser.add_argument("--work-dir", required=True)
+    resume_parser.add_argument("--wait", type=int, default=0, help="seconds to wait for batches to finish")
+    args = parser.parse_args()
+    if args.command == "submit":
+        submit(args)
+    # After submitting, finishes right away when the batches are already done
+    resume(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import settings
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared process pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                print(f"Starting CPU process pool with {settings.CPU_POOL_WORKERS} workers")
+                # spawn: the server process is multi-threaded, so forking it is unsafe
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.CPU_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def run_cpu(fn, *args, **kwargs):
+    """
+    Run a CPU-bound function in the process pool and wait for its result.
+    The calling request thread blocks without holding the GIL, so other
+    requests keep being served. fn and its arguments must be picklable
+    (module-level functions, plain data). Runs inline when the pool is disabled.
+    """
+    if settings.CPU_POOL_WORKERS <= 0:
+        return fn(*args, **kwargs)
+    try:
+        return get_pool().submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        print(f"CPU process pool broke while running {fn.__name__}: {e}; running inline")
+        shutdown_pool(wait=False)
+        return fn(*args, **kwargs)
+
+
+def shutdown_pool(wait=True):
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
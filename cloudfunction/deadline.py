@@ -0,0 +1,140 @@
+import contextvars
+import threading
+import time
+import openai
+import requests
+import metrics
+import settings
+
+# Deadline of the request being handled; None outside a request or when disabled
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+# The OpenAI client's own per-call timeout, used when there is no deadline
+DEFAULT_CALL_TIMEOUT = 600.0
+
+# Client timeouts of outbound calls (LLM calls, remote shards), whose timeout
+# is the time left (see call_timeout)
+CLIENT_TIMEOUTS = (openai.APITimeoutError, requests.Timeout, TimeoutError)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before the work could start or finish."""
+
+
+class RequestDeadline:
+    """
+    Expiry time of one request (monotonic clock) and the sections it left
+    unparsed. Shared by the request's worker threads through the copied context.
+    """
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+        self.missing = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def note_missing(self, section):
+        with self._lock:
+            self.missing.append(section)
+
+    def missing_sections(self):
+        with self._lock:
+            return list(self.missing)
+
+
+def start_request(seconds=None):
+    """
+    Start the current request's deadline: `seconds` from now, or
+    REQUEST_DEADLINE_SECONDS when None (0 disables). Returns a token for
+    finish_request.
+    """
+    if seconds is None:
+        seconds = settings.REQUEST_DEADLINE_SECONDS or None
+    return _current.set(RequestDeadline(seconds) if seconds is not None else None)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def remaining():
+    """Seconds left for the current request, or None without a deadline."""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def expired():
+    """True when less than DEADLINE_MIN_CALL_SECONDS are left, too little to start an LLM call."""
+    left = remaining()
+    return left is not None and left < settings.DEADLINE_MIN_CALL_SECONDS
+
+
+def call_timeout(label="LLM call"):
+    """
+    Timeout for one outbound call: the time left, or DEFAULT_CALL_TIMEOUT
+    without a deadline. Raises DeadlineExceeded when too little is left to
+    start the call.
+    """
+    left = remaining()
+    if left is None:
+        return DEFAULT_CALL_TIMEOUT
+    if left < settings.DEADLINE_MIN_CALL_SECONDS:
+        metrics.incr("deadline_exceeded")
+        raise DeadlineExceeded(f"Request deadline reached before {label}")
+    return min(left, DEFAULT_CALL_TIMEOUT)
+
+
+def call_retries(default):
+    """
+    Client retries for one outbound call: none while a deadline is active,
+    since each retry restarts the call timeout and could run the request far
+    past its deadline; `default` otherwise.
+    """
+    return 0 if remaining() is not None else default
+
+
+def timed_out(error):
+    """
+    True when error ended work because the deadline ran out: DeadlineExceeded,
+    or a client timeout of a call cut short by the deadline. Any other failure
+    is a real error, however little time is left.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return True
+    return isinstance(error, CLIENT_TIMEOUTS) and expired()
+
+
+def note_missing(section):
+    """Record a section of the current request's input as left unparsed."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.note_missing(section)
+    print(f"Request deadline reached; {section} left unparsed")
+    metrics.incr("deadline_missing_sections")
+
+
+def missing_sections():
+    """Sections of the current request left unparsed so far."""
+    deadline = _current.get()
+    return deadline.missing_sections() if deadline is not None else []
+
+
+def run_section(section, fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) for one section of the request's input. When the
+    deadline runs out before or during the call, the section is recorded as
+    missing and None is returned instead of failing the whole request.
+    """
+    if expired():
+        note_missing(section)
+        return None
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        if not timed_out(e):
+            raise
+        print(f"{section} stopped by the request deadline:", e)
+        note_missing(section)
+        return None
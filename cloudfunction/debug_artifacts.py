@@ -0,0 +1,141 @@
+import contextvars
+import gzip
+import json
+import queue
+import threading
+import time
+import metrics
+import settings
+
+# Artifacts of the request being handled; None when capture is off for it
+_current = contextvars.ContextVar("debug_artifacts", default=None)
+
+
+class ArtifactBuffer:
+    """Prompts, raw model outputs and intermediate JSON of one request, in capture order."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.records = []
+        self.size = 0
+        self.dropped = 0
+        self._lock = threading.Lock()  # PDF shards capture from worker threads
+
+    def add(self, kind, label, content):
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False, default=str)
+        with self._lock:
+            if self.size + len(content) > self.max_bytes:
+                self.dropped += 1
+                return
+            self.size += len(content)
+            self.records.append({"t": round(time.time(), 3), "kind": kind, "label": label, "content": content})
+
+    def to_gzip(self):
+        lines = [json.dumps(r, ensure_ascii=False) for r in self.records]
+        if self.dropped:
+            lines.append(json.dumps({"kind": "truncated", "label": f"{self.dropped} artifacts over {self.max_bytes} bytes dropped"}))
+        return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), compresslevel=6)
+
+
+class ArtifactWriter:
+    """
+    Background uploader. Finished request buffers go into a bounded queue that
+    a daemon thread drains in batches, compressing and uploading each buffer.
+    Submitting never blocks: when the queue is full the buffer is dropped.
+    """
+
+    def __init__(self, upload_fn, max_queue, batch_size, flush_seconds):
+        self.upload_fn = upload_fn
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, buffer):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(buffer)
+            return True
+        except queue.Full:
+            metrics.incr("debug_artifacts_dropped")
+            return False
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="debug-artifact-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            for buffer in batch:
+                try:
+                    self.upload_fn(buffer.path, buffer.to_gzip())
+                    metrics.incr("debug_artifacts_uploaded")
+                except Exception as e:
+                    print(f"Debug artifact upload to {buffer.path} failed:", e)
+                    metrics.incr("debug_artifacts_failed")
+                finally:
+                    self._queue.task_done()
+
+    def flush(self, timeout=10.0):
+        """Wait up to timeout seconds for queued buffers to be uploaded."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def _upload(path, data):
+    from file_utils import upload_bytes_to_storage
+    upload_bytes_to_storage(path, data, content_type="text/plain; charset=utf-8", content_encoding="gzip")
+
+
+writer = ArtifactWriter(
+    _upload,
+    max_queue=settings.DEBUG_ARTIFACT_QUEUE_SIZE,
+    batch_size=settings.DEBUG_ARTIFACT_BATCH_SIZE,
+    flush_seconds=settings.DEBUG_ARTIFACT_FLUSH_SECONDS,
+)
+
+
+def start_capture(path):
+    """Begin capturing artifacts for the current request, to be uploaded to path. Returns a token for finish_capture."""
+    if not settings.DEBUG_ARTIFACTS or not path:
+        return None
+    return _current.set(ArtifactBuffer(path, settings.DEBUG_ARTIFACT_MAX_BYTES))
+
+
+def finish_capture(token):
+    """Stop capturing and hand the request's artifacts to the background writer."""
+    if token is None:
+        return
+    buffer = _current.get()
+    _current.reset(token)
+    if buffer is not None and buffer.records:
+        writer.submit(buffer)
+
+
+def capture(kind, label, content):
+    """Record one artifact (prompt, raw output, intermediate JSON) for the current request, if capturing."""
+    buffer = _current.get()
+    if buffer is not None:
+        buffer.add(kind, label, content)
+
+
+def capturing():
+    """True when the current request captures artifacts (skip building expensive content otherwise)."""
+    return _current.get() is not None
@@ -1,27 +1,194 @@
 import io
+import hashlib
+import tempfile
+import threading
 from firebase_admin import storage
 import pandas as pd
+import pdfplumber
 from firebase_utils import init_firebase  # Ensure Firebase is initialized
 import os
+import settings
 
-def download_file_from_firebase(source_path):
+# Striped locks so concurrent requests for the same blob download it once
+_download_locks = [threading.Lock() for _ in range(64)]
+
+def get_storage_bucket():
     init_firebase()  # Ensure Firebase app is initialized before using storage
     bucket_name = os.getenv('FIREBASE_STORAGE_BUCKET')
     if not bucket_name:
         raise RuntimeError("FIREBASE_STORAGE_BUCKET environment variable not set")
-    bucket = storage.bucket(bucket_name)
+    # Honors STORAGE_EMULATOR_HOST, so the cache can be exercised against the Storage emulator
+    return storage.bucket(bucket_name)
+
+def _cache_key(source_path, blob):
+    identity = f"{source_path}\0{blob.generation}\0{blob.md5_hash}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+def _key_lock(key):
+    return _download_locks[int(key[:8], 16) % len(_download_locks)]
+
+def evict_file_cache(cache_dir, max_bytes, keep=None):
+    """
+    Delete least recently used cache files until the cache fits in max_bytes.
+    The entry at `keep` (the one just returned to a caller) is never deleted.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith(".part"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        total += stat.st_size
+        if path != keep:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+def open_cached_file(source_path, bucket=None):
+    """
+    Open the current content of a Storage blob for reading.
+    Files are cached on disk keyed by blob path + generation + md5, so retries and
+    repeat parses of an unchanged file skip the download; a new upload to the same
+    path gets a new generation and a new entry. Downloads stream to disk in chunks.
+    The cache is bounded by FILE_CACHE_MAX_BYTES with least-recently-used eviction;
+    the entry is opened before the cache is trimmed and is never the one trimmed.
+    A blob larger than the whole cache streams to an unnamed temporary file instead.
+    `bucket` can be any object with the google.cloud.storage Bucket interface
+    (e.g. a local fake in tests); it defaults to the Firebase bucket.
+    """
+    bucket = bucket or get_storage_bucket()
+    blob = bucket.blob(source_path)
+    blob.reload()  # metadata only: generation, md5 and size
+    cache_dir = settings.FILE_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    blob.chunk_size = settings.FILE_DOWNLOAD_CHUNK_BYTES
+    size = getattr(blob, "size", None)
+    if size is not None and size > settings.FILE_CACHE_MAX_BYTES:
+        print(f"{source_path} ({size} bytes) is larger than the file cache; not cached")
+        f = tempfile.TemporaryFile(dir=cache_dir)
+        try:
+            blob.download_to_file(f)
+        except Exception:
+            f.close()
+            raise
+        f.seek(0)
+        return f
+    key = _cache_key(source_path, blob)
+    path = os.path.join(cache_dir, key)
+    with _key_lock(key):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            f = None  # not cached, or evicted by a concurrent request
+        if f is not None:
+            os.utime(f.fileno())  # mark as recently used
+            print(f"File cache hit for {source_path}")
+            return f
+        tmp = tempfile.NamedTemporaryFile(dir=cache_dir, prefix=key, suffix=".part", delete=False)
+        try:
+            with tmp:
+                blob.download_to_file(tmp)
+            os.replace(tmp.name, path)
+        except Exception:
+            os.unlink(tmp.name)
+            raise
+        f = open(path, "rb")
+    evict_file_cache(cache_dir, settings.FILE_CACHE_MAX_BYTES, keep=path)
+    return f
+
+def file_size(source_path, bucket=None):
+    """Size in bytes of a Storage blob, from its metadata (nothing is downloaded)."""
+    bucket = bucket or get_storage_bucket()
     blob = bucket.blob(source_path)
-    file_bytes = blob.download_as_bytes()
-    return file_bytes
+    blob.reload()
+    return blob.size
+
+def download_file_from_firebase(source_path, bucket=None):
+    if settings.FILE_CACHE_MAX_BYTES <= 0:
+        bucket = bucket or get_storage_bucket()
+        return bucket.blob(source_path).download_as_bytes()
+    with open_cached_file(source_path, bucket) as f:
+        return f.read()
+
+def file_content_hash(source_path, bucket=None):
+    """sha256 hex digest of a Storage file's bytes, streamed from the local file cache when enabled."""
+    digest = hashlib.sha256()
+    if settings.FILE_CACHE_MAX_BYTES <= 0:
+        digest.update(download_file_from_firebase(source_path, bucket))
+        return digest.hexdigest()
+    with open_cached_file(source_path, bucket) as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def upload_bytes_to_storage(dest_path, data, content_type="application/octet-stream", content_encoding=None, bucket=None):
+    """Write bytes to a Storage object. With content_encoding="gzip", readers get the decompressed text."""
+    bucket = bucket or get_storage_bucket()
+    blob = bucket.blob(dest_path)
+    if content_encoding:
+        blob.content_encoding = content_encoding
+    blob.upload_from_string(data, content_type=content_type)
 
 def extract_text_from_image(image_bytes):
     # TODO: Implement OCR extraction (e.g., with pytesseract)
     return "[Extracted text from image placeholder]"
 
-def extract_text_from_pdf(pdf_bytes):
-    # TODO: Implement PDF text extraction (e.g., with pdfplumber)
-    return "[Extracted text from PDF placeholder]"
+# PDF points -> pixels of the 200 dpi pages pdf2image renders, so text-layer
+# coordinates line up with client OCR of the same page
+PDF_TEXT_SCALE = 200 / 72
+
+def extract_text_from_pdf(pdf_bytes, first_page=None, last_page=None):
+    """
+    Extract the embedded text layer of a PDF as positioned words, one list per
+    page (1-based first_page/last_page, inclusive). Records use the client OCR
+    shape plus sizes: {"text", "x", "y", "width", "height"}. Pages without a
+    text layer come back as empty lists.
+    """
+    pages = []
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        first = (first_page or 1) - 1
+        last = last_page or len(pdf.pages)
+        for page in pdf.pages[first:last]:
+            words = page.extract_words(keep_blank_chars=False, use_text_flow=False)
+            pages.append([
+                {
+                    "text": w["text"],
+                    "x": round(w["x0"] * PDF_TEXT_SCALE),
+                    "y": round(w["top"] * PDF_TEXT_SCALE),
+                    "width": round((w["x1"] - w["x0"]) * PDF_TEXT_SCALE),
+                    "height": round((w["bottom"] - w["top"]) * PDF_TEXT_SCALE),
+                }
+                for w in words if w["text"].strip()
+            ])
+            page.close()
+    return pages
+
+def has_text_layer(page_words, min_words=None):
+    """
+    True if a page's extracted words are usable instead of OCR: enough words,
+    and few of them are unmapped glyphs ("(cid:12)") or control characters from
+    fonts without a Unicode map.
+    """
+    if min_words is None:
+        min_words = settings.PDF_TEXT_MIN_WORDS
+    if len(page_words) < min_words:
+        return False
+    garbled = sum(
+        1 for w in page_words
+        if "(cid:" in w["text"] or sum(not c.isprintable() for c in w["text"]) * 2 > len(w["text"])
+    )
+    return garbled <= len(page_words) * 0.1
 
 def extract_data_from_excel(excel_bytes):
     df = pd.read_excel(io.BytesIO(excel_bytes))
-    return df.to_dict(orient='records') 
\ No newline at end of file
+    return df.to_dict(orient='records') 
@@ -3,10 +3,22 @@ from firebase_admin import credentials, firestore
 import os
 import tempfile
 import json
+import threading
+from menu_model import menu_to_json
+import settings
 # Initialize Firebase Admin SDK
 firebase_app = None
+# Concurrent first requests must not both call initialize_app (the second raises)
+_init_lock = threading.Lock()
 
 def init_firebase():
+    if not firebase_app:
+        with _init_lock:
+            if not firebase_app:
+                _initialize_app()
+    return firestore.client()
+
+def _initialize_app():
     global firebase_app
     if not firebase_app:
         print("Initializing Firebase app...")
@@ -36,9 +48,209 @@ def init_firebase():
         except Exception as e:
             print("Error initializing Firebase app:", e)
             raise
-    return firestore.client()
+
+# Menu sections split into subcollection pages, in stored order
+MENU_SECTIONS = ("category", "sub_category", "items")
+# Firestore limits: 500 writes and 10 MiB per batch commit, 1 MiB per document
+BATCH_MAX_WRITES = 500
+BATCH_MAX_BYTES = 8 * 1024 * 1024
 
 def store_menu_json(doc_id, menu_json, collection_name='menus_langchain'):
+    """
+    Store a parse result. Menus are kept inline in the document's "menu" field;
+    a document that would exceed MENU_INLINE_MAX_BYTES (see firestore_size),
+    or every menu with MENU_STORAGE_LAYOUT=paged, keeps only metadata and its
+    categories, subcategories and items go to pages of the "pages" subcollection.
+    """
+    # Compact Menu models are serialized to the stored JSON shape only here
+    if isinstance(menu_json.get("menu"), list):
+        menu_json = {**menu_json, "menu": [menu_to_json(m) for m in menu_json["menu"]]}
     db = init_firebase()
     doc_ref = db.collection(collection_name).document(doc_id)
-    doc_ref.set(menu_json) 
\ No newline at end of file
+    if not _use_paged_layout(menu_json):
+        doc_ref.set(menu_json)
+        _delete_pages(db, doc_ref, keep=set())
+        return
+    menus = menu_json["menu"]
+    pages = list(_menu_pages(menus))
+    metadata = {k: v for k, v in menu_json.items() if k != "menu"}
+    metadata["layout"] = "paged"
+    metadata["menuPages"] = [
+        {section: sum(1 for p in pages if p["menuIndex"] == i and p["section"] == section) for section in MENU_SECTIONS}
+        for i in range(len(menus))
+    ]
+    metadata["menuCounts"] = [
+        {section: len(m.get("data", m).get(section, [])) for section in MENU_SECTIONS}
+        for m in menus
+    ]
+    # Pages first and the parent last, so readers never see metadata pointing at missing pages
+    pages_ref = doc_ref.collection("pages")
+    _write_batched(db, ((pages_ref.document(page_id(p["menuIndex"], p["section"], p["page"])), p) for p in pages))
+    _delete_pages(db, doc_ref, keep={page_id(p["menuIndex"], p["section"], p["page"]) for p in pages})
+    doc_ref.set(metadata)
+    print(f"Stored {collection_name}/{doc_id} as {len(pages)} pages")
+
+def page_id(menu_index, section, page):
+    return f"m{menu_index}-{section}-{page:05d}"
+
+def _use_paged_layout(menu_json):
+    layout = settings.MENU_STORAGE_LAYOUT
+    if layout == "inline" or not isinstance(menu_json.get("menu"), list):
+        return False
+    if layout == "paged":
+        return True
+    return firestore_size(menu_json) > settings.MENU_INLINE_MAX_BYTES
+
+def firestore_size(value):
+    """
+    Storage size of a field value by Firestore's rules (strings: UTF-8 length
+    + 1, numbers and timestamps: 8, maps: keys + values), which counts numbers
+    larger than their JSON text does.
+    """
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, dict):
+        return sum(firestore_size(str(k)) + firestore_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(firestore_size(v) for v in value)
+    if isinstance(value, bytes):
+        return len(value)
+    return 8
+
+def _menu_pages(menus):
+    """Yield page documents: at most MENU_PAGE_SIZE records and MENU_PAGE_MAX_BYTES of JSON each."""
+    for menu_index, menu in enumerate(menus):
+        data = menu.get("data", menu)
+        for section in MENU_SECTIONS:
+            page, records, size = 0, [], 0
+            for record in data.get(section, []):
+                record_size = len(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8"))
+                if records and (len(records) >= settings.MENU_PAGE_SIZE or size + record_size > settings.MENU_PAGE_MAX_BYTES):
+                    yield _page_doc(menu_index, section, page, records)
+                    page, records, size = page + 1, [], 0
+                records.append(record)
+                size += record_size
+            if records:
+                yield _page_doc(menu_index, section, page, records)
+
+def _page_doc(menu_index, section, page, records):
+    doc = {"menuIndex": menu_index, "section": section, "page": page, "records": records}
+    if section == "items":
+        # Lets a reader fetch only the pages holding one subcategory's items
+        doc["subCatIds"] = sorted({r.get("subCatId") for r in records if isinstance(r.get("subCatId"), int)})
+    return doc
+
+def _write_batched(db, writes):
+    """Commit (document_ref, data) sets in batches within Firestore's per-commit limits."""
+    batch, count, size = db.batch(), 0, 0
+    for ref, data in writes:
+        data_size = len(json.dumps(data, ensure_ascii=False, default=str))
+        if count and (count >= BATCH_MAX_WRITES or size + data_size > BATCH_MAX_BYTES):
+            batch.commit()
+            batch, count, size = db.batch(), 0, 0
+        batch.set(ref, data)
+        count += 1
+        size += data_size
+    if count:
+        batch.commit()
+
+def _delete_pages(db, doc_ref, keep):
+    """Delete pages left over from an earlier, larger version of the document."""
+    stale = [ref for ref in doc_ref.collection("pages").list_documents() if ref.id not in keep]
+    for start in range(0, len(stale), BATCH_MAX_WRITES):
+        batch = db.batch()
+        for ref in stale[start:start + BATCH_MAX_WRITES]:
+            batch.delete(ref)
+        batch.commit()
+
+def read_menu_metadata(doc_id, collection_name='menus_langchain'):
+    """
+    Return a stored menu's metadata with per-menu record and page counts, for
+    both layouts, or None if the document does not exist.
+    """
+    snapshot = init_firebase().collection(collection_name).document(doc_id).get()
+    if not snapshot.exists:
+        return None
+    doc = snapshot.to_dict()
+    if doc.get("layout") == "paged":
+        return doc
+    menus = doc.pop("menu", None) or []
+    page_size = settings.MENU_PAGE_SIZE
+    doc["layout"] = "inline"
+    doc["menuCounts"] = [
+        {section: len(m.get("data", m).get(section, [])) for section in MENU_SECTIONS} for m in menus
+    ]
+    doc["menuPages"] = [
+        {section: -(-count // page_size) for section, count in counts.items()} for counts in doc["menuCounts"]
+    ]
+    return doc
+
+def read_menu_page(doc_id, section, page=0, menu_index=0, collection_name='menus_langchain'):
+    """
+    Return one page of a stored menu section: {"records", "page", "pageCount"},
+    or None if the document does not exist. Inline documents are paged on read
+    with MENU_PAGE_SIZE records per page.
+    """
+    db = init_firebase()
+    doc_ref = db.collection(collection_name).document(doc_id)
+    snapshot = doc_ref.get()
+    if not snapshot.exists:
+        return None
+    doc = snapshot.to_dict()
+    if doc.get("layout") == "paged":
+        page_count = doc["menuPages"][menu_index][section] if menu_index < len(doc["menuPages"]) else 0
+        page_snapshot = doc_ref.collection("pages").document(page_id(menu_index, section, page)).get()
+        records = page_snapshot.to_dict()["records"] if page_snapshot.exists else []
+        return {"records": records, "page": page, "pageCount": page_count}
+    menus = doc.get("menu") or []
+    if menu_index >= len(menus):
+        return {"records": [], "page": page, "pageCount": 0}
+    records = menus[menu_index].get("data", menus[menu_index]).get(section, [])
+    page_size = settings.MENU_PAGE_SIZE
+    return {
+        "records": records[page * page_size:(page + 1) * page_size],
+        "page": page,
+        "pageCount": -(-len(records) // page_size),
+    }
+
+def read_subcategory_items(doc_id, sub_cat_id, menu_index=0, collection_name='menus_langchain'):
+    """Return the items of one subcategory, reading only the pages that hold them."""
+    db = init_firebase()
+    doc_ref = db.collection(collection_name).document(doc_id)
+    snapshot = doc_ref.get()
+    if not snapshot.exists:
+        return None
+    doc = snapshot.to_dict()
+    if doc.get("layout") == "paged":
+        query = doc_ref.collection("pages").where("subCatIds", "array_contains", sub_cat_id)
+        pages = sorted(
+            (p.to_dict() for p in query.stream()),
+            key=lambda p: p["page"],
+        )
+        records = [r for p in pages if p["menuIndex"] == menu_index for r in p["records"]]
+    else:
+        menus = doc.get("menu") or []
+        records = menus[menu_index].get("data", menus[menu_index]).get("items", []) if menu_index < len(menus) else []
+    return [r for r in records if r.get("subCatId") == sub_cat_id]
+
+def copy_menu_document(collection_name, source_id, dest_id, overrides=None):
+    """Copy a stored menu (both layouts, including its pages) to another document. Returns False if the source is gone."""
+    db = init_firebase()
+    collection = db.collection(collection_name)
+    source_ref = collection.document(source_id)
+    snapshot = source_ref.get()
+    if not snapshot.exists:
+        return False
+    doc = {**snapshot.to_dict(), **(overrides or {})}
+    dest_ref = collection.document(dest_id)
+    if doc.get("layout") == "paged":
+        pages = list(source_ref.collection("pages").stream())
+        dest_pages = dest_ref.collection("pages")
+        _write_batched(db, ((dest_pages.document(p.id), p.to_dict()) for p in pages))
+        _delete_pages(db, dest_ref, keep={p.id for p in pages})
+    else:
+        _delete_pages(db, dest_ref, keep=set())
+    dest_ref.set(doc)
+    return True
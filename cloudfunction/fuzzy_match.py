@@ -0,0 +1,134 @@
+import json
+import math
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from difflib import SequenceMatcher
+
+
+def trigrams(text):
+    """Character trigrams of text, padded so short strings and word starts still share grams."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyMatcher:
+    """
+    Closest-match lookup over a growing set of choices, with the same results as
+    difflib.get_close_matches(query, choices, n=1, cutoff) (SequenceMatcher ratio,
+    ties going to the greater string). Only choices that can reach the cutoff
+    are scored: their length must be within the range the ratio allows, and,
+    where the bound is informative, they must share enough trigrams with the
+    query (see candidates). Results are cached until the choices change.
+    """
+
+    def __init__(self, choices=(), cache_size=4096):
+        self._choices = []
+        self._positions = {}
+        self._index = defaultdict(set)
+        self._by_length = defaultdict(list)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        for choice in choices:
+            self.add(choice)
+
+    def __len__(self):
+        return len(self._choices)
+
+    def __contains__(self, choice):
+        return choice in self._positions
+
+    def add(self, choice):
+        with self._lock:
+            if choice in self._positions:
+                return
+            position = len(self._choices)
+            self._choices.append(choice)
+            self._positions[choice] = position
+            for gram in trigrams(choice):
+                self._index[gram].add(position)
+            self._by_length[len(choice)].append(position)
+            self._cache.clear()
+
+    def candidates(self, query, cutoff=0.0):
+        """
+        Choices that can reach ratio >= cutoff with query. With a = len(query)
+        and b = len(choice), ratio = 2M / (a + b) where M <= min(a, b) counts the
+        matched characters, so b lies in [a*c/(2-c), a*(2-c)/c]. The matching
+        blocks are a common subsequence, so an edit script of d = a + b - 2M
+        <= (a + b)(1 - c) insertions and deletions turns query into choice;
+        each edit touches at most 3 of the query's padded trigrams, so the
+        choice holds at least len(trigrams(query)) - 3d of them. When that bound
+        is not positive for the longest possible choice, every choice of a
+        possible length is returned.
+        """
+        if cutoff <= 0:
+            return list(self._choices)
+        a = len(query)
+        # Rounded outwards: a candidate too many is only scored, one too few is a wrong result
+        lo = math.floor(a * cutoff / (2 - cutoff) - 1e-9)
+        hi = math.ceil(a * (2 - cutoff) / cutoff + 1e-9)
+
+        def max_edits(b):
+            return math.floor((a + b) * (1 - cutoff) + 1e-9)
+
+        query_grams = trigrams(query)
+        if len(query_grams) - 3 * max_edits(hi) < 1:
+            return [self._choices[p] for b in range(lo, hi + 1) for p in self._by_length.get(b, ())]
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._index.get(gram, ()))
+        result = []
+        for p, count in shared.items():
+            b = len(self._choices[p])
+            if lo <= b <= hi and count >= len(query_grams) - 3 * max_edits(b):
+                result.append(self._choices[p])
+        return result
+
+    def best_match(self, query, cutoff=0.6):
+        """Return the best choice with ratio >= cutoff, or None."""
+        key = (query, cutoff)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        if query in self._positions:
+            result = query
+        else:
+            result = self._score(query, cutoff)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _score(self, query, cutoff):
+        matcher = SequenceMatcher()
+        matcher.set_seq2(query)
+        best = None
+        for choice in self.candidates(query, cutoff):
+            matcher.set_seq1(choice)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff and (best is None or (score, choice) > best):
+                    best = (score, choice)
+        return best[1] if best else None
+
+
+def load_vocabulary(path):
+    """
+    Load a canonical vocabulary from a JSON file, either {"variant": "Canonical"}
+    or {"Canonical": ["variant", ...]}. Returns {lowercase variant: canonical};
+    each canonical title also maps to itself.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    vocabulary = {}
+    for key, value in raw.items():
+        if isinstance(value, list):
+            vocabulary[key.strip().lower()] = key.strip()
+            for alias in value:
+                vocabulary[str(alias).strip().lower()] = key.strip()
+        else:
+            vocabulary[key.strip().lower()] = str(value).strip()
+    return vocabulary
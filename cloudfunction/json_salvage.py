@@ -0,0 +1,282 @@
+import json
+import re
+
+# Top-level menu arrays whose elements are salvaged one by one
+MENU_SECTIONS = ("category", "sub_category", "items")
+
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|```\s*$', flags=re.MULTILINE)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_LITERALS = {
+    "true": True, "false": False, "null": None,
+    "True": True, "False": False, "None": None,
+}
+
+
+class _PartialDict(dict):
+    """Object whose closing brace never arrived."""
+
+
+class _PartialList(list):
+    """Array whose closing bracket never arrived."""
+
+
+class _Truncated(Exception):
+    """Raised internally when the input ends in the middle of a scalar."""
+
+
+def strip_code_fences(text):
+    """Remove markdown code block markers and any prose before the first brace."""
+    cleaned = _FENCE_RE.sub('', text.strip()).strip()
+    start = min((i for i in (cleaned.find('{'), cleaned.find('[')) if i >= 0), default=-1)
+    if start > 0:
+        cleaned = cleaned[start:]
+    return cleaned
+
+
+class TolerantJSONParser:
+    """
+    Single-pass, forgiving JSON parser for LLM output.
+    Accepts trailing commas, missing commas, Python literals and junk after the
+    document. When the input stops early, containers opened so far are returned
+    as partial values and the unfinished scalar at the end is dropped, so every
+    element that was fully emitted survives.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.errors = []
+
+    def parse(self):
+        self._skip_ws()
+        if self.pos >= len(self.text):
+            raise ValueError("Empty model output")
+        try:
+            return self._value()
+        except _Truncated:
+            return None
+
+    def _skip_ws(self):
+        text = self.text
+        while self.pos < len(text) and text[self.pos] in ' \t\r\n':
+            self.pos += 1
+
+    def _at_end(self):
+        self._skip_ws()
+        return self.pos >= len(self.text)
+
+    def _value(self):
+        if self._at_end():
+            raise _Truncated()
+        ch = self.text[self.pos]
+        if ch == '{':
+            return self._object()
+        if ch == '[':
+            return self._array()
+        if ch in '"\'':
+            return self._string()
+        m = _NUMBER_RE.match(self.text, self.pos)
+        if m:
+            self.pos = m.end()
+            if self.pos >= len(self.text):
+                # A number at the very end may have lost digits
+                raise _Truncated()
+            num = m.group(0)
+            return float(num) if any(c in num for c in '.eE') else int(num)
+        for literal, value in _LITERALS.items():
+            if self.text.startswith(literal, self.pos):
+                self.pos += len(literal)
+                return value
+            if literal.startswith(self.text[self.pos:]):
+                raise _Truncated()
+        raise ValueError(f"Unexpected character {ch!r} at offset {self.pos}")
+
+    def _string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        out = []
+        text = self.text
+        while self.pos < len(text):
+            ch = text[self.pos]
+            if ch == quote:
+                self.pos += 1
+                return ''.join(out)
+            if ch == '\\':
+                if self.pos + 1 >= len(text):
+                    break
+                esc = text[self.pos + 1]
+                if esc == 'u':
+                    hex_digits = text[self.pos + 2:self.pos + 6]
+                    if len(hex_digits) < 4:
+                        break
+                    try:
+                        out.append(chr(int(hex_digits, 16)))
+                    except ValueError:
+                        out.append(hex_digits)
+                    self.pos += 6
+                    continue
+                out.append({'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}.get(esc, esc))
+                self.pos += 2
+                continue
+            out.append(ch)
+            self.pos += 1
+        raise _Truncated()
+
+    def _object(self):
+        self.pos += 1
+        obj = {}
+        while True:
+            if self._at_end():
+                return _PartialDict(obj)
+            ch = self.text[self.pos]
+            if ch == '}':
+                self.pos += 1
+                return obj
+            if ch == ',':
+                self.pos += 1
+                continue
+            if ch not in '"\'':
+                # Unquoted key or stray token: skip to the next separator
+                m = re.match(r'[A-Za-z_$][\w$]*', self.text[self.pos:])
+                if not m:
+                    self.errors.append(f"Skipped unexpected {ch!r} at offset {self.pos}")
+                    self.pos += 1
+                    continue
+                key = m.group(0)
+                self.pos += len(key)
+            else:
+                try:
+                    key = self._string()
+                except _Truncated:
+                    return _PartialDict(obj)
+            if self._at_end():
+                return _PartialDict(obj)
+            if self.text[self.pos] != ':':
+                self.errors.append(f"Missing ':' after key {key!r}")
+            else:
+                self.pos += 1
+            try:
+                value = self._value()
+            except _Truncated:
+                return _PartialDict(obj)
+            obj[key] = value
+            if isinstance(value, (_PartialDict, _PartialList)):
+                return _PartialDict(obj)
+
+    def _array(self):
+        self.pos += 1
+        arr = []
+        while True:
+            if self._at_end():
+                return _PartialList(arr)
+            ch = self.text[self.pos]
+            if ch == ']':
+                self.pos += 1
+                return arr
+            if ch == ',':
+                self.pos += 1
+                continue
+            try:
+                value = self._value()
+            except _Truncated:
+                return _PartialList(arr)
+            arr.append(value)
+            if isinstance(value, (_PartialDict, _PartialList)):
+                return _PartialList(arr)
+
+
+def _plain(value):
+    """Convert partial containers back into ordinary dicts and lists."""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+def salvage_menu_json(text):
+    """
+    Parse possibly truncated or slightly broken menu JSON from a model response.
+    Returns (menu_json, report). menu_json keeps every category, subcategory and
+    item that was emitted completely; report describes what was recovered and lost:
+      {
+        "truncated": bool,          # output ended before the document closed
+        "recovered": {section: n},  # complete elements kept per section
+        "dropped": {section: n},    # incomplete trailing elements discarded
+        "last_item_title": str,     # title of the last complete item, if any
+        "errors": [...],            # tolerated syntax problems
+      }
+    Raises ValueError if nothing resembling a JSON document can be recovered.
+    """
+    cleaned = strip_code_fences(text)
+    parser = TolerantJSONParser(cleaned)
+    root = parser.parse()
+    if not isinstance(root, dict):
+        raise ValueError("Model output does not contain a JSON object")
+    truncated = isinstance(root, _PartialDict)
+    data = root.get("data", root)
+    if not isinstance(data, dict):
+        raise ValueError("Model output 'data' is not an object")
+    truncated = truncated or isinstance(data, _PartialDict)
+
+    salvaged = {}
+    recovered = {}
+    dropped = {}
+    for section in MENU_SECTIONS:
+        entries = data.get(section, [])
+        if not isinstance(entries, list):
+            entries = []
+        complete = [e for e in entries if isinstance(e, dict) and not isinstance(e, _PartialDict)]
+        dropped[section] = len(entries) - len(complete)
+        if isinstance(entries, _PartialList):
+            truncated = True
+        salvaged[section] = _plain(complete)
+        recovered[section] = len(complete)
+
+    last_item_title = None
+    if salvaged["items"]:
+        last_item_title = salvaged["items"][-1].get("title")
+    report = {
+        "truncated": truncated,
+        "recovered": recovered,
+        "dropped": dropped,
+        "last_item_title": last_item_title,
+        "errors": parser.errors,
+    }
+    return {"data": salvaged}, report
+
+
+def parse_model_json(text):
+    """
+    Strict parse first, tolerant salvage second.
+    Returns (parsed_json, report); report is None when the output was valid JSON.
+    """
+    cleaned = strip_code_fences(text)
+    try:
+        return json.loads(cleaned), None
+    except Exception:
+        pass
+    return salvage_menu_json(cleaned)
+
+
+def title_pattern(title):
+    """Case-insensitive regex matching title as a whole phrase (so 'Item 1' skips 'Item 10')."""
+    return re.compile(r'(?<!\w)' + re.escape(title.strip()) + r'(?!\w)', re.I)
+
+
+def remaining_tail(chunk_text, last_item_title):
+    """
+    Return the part of a chunk that follows the line holding the last recovered
+    item title, i.e. the input the truncated response never got to.
+    Returns '' when nothing follows it and None when the title cannot be located.
+    """
+    if not last_item_title or not last_item_title.strip():
+        return None
+    matches = list(title_pattern(last_item_title).finditer(chunk_text))
+    if not matches:
+        return None
+    line_end = chunk_text.find('\n', matches[-1].start())
+    if line_end < 0:
+        return ''
+    tail = chunk_text[line_end + 1:]
+    return tail if tail.strip() else ''
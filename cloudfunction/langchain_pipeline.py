@@ -1,55 +1,51 @@
-from langchain.chains import MapReduceDocumentsChain, LLMChain, StuffDocumentsChain
-from langchain.prompts import PromptTemplate
+from langchain.prompts import ChatPromptTemplate
 from langchain_community.chat_models import ChatOpenAI
-from langchain_core.documents import Document
-import os
 import json
-import re
-from jsonschema import validate, ValidationError
-from difflib import get_close_matches
-
-# Load system and user prompts from external files for easy editing
-PROMPT_DIR = os.path.dirname(os.path.abspath(__file__))
-SYSTEM_PROMPT_PATH = os.path.join(PROMPT_DIR, 'system_prompts.txt')
-USER_PROMPT_PATH = os.path.join(PROMPT_DIR, 'user_prompts.txt')
-
-
-
-with open(SYSTEM_PROMPT_PATH, 'r', encoding='utf-8') as f:
-    SYSTEM_PROMPT = f.read()
-with open(USER_PROMPT_PATH, 'r', encoding='utf-8') as f:
-    USER_PROMPT = f.read()
-
-
-
-# 1. Define the prompt template
-prompt = PromptTemplate(
-    template=SYSTEM_PROMPT + USER_PROMPT,
-    input_variables=["chunk"]
+import threading
+from fuzzy_match import FuzzyMatcher, load_vocabulary
+import settings
+from json_salvage import parse_model_json
+from prompts import SYSTEM_PROMPT, USER_PROMPT
+from ocr_layout import column_layout, merge_ocr_lines
+import metrics
+import debug_artifacts
+import deadline
+from llm_scheduler import llm_slot
+from reconciliation import chunk_confidence
+from rule_parser import rule_based_parse
+from menu_model import Category, Item, Menu, SubCategory
+from adaptive_chunking import (
+    TRUNCATED_FINISH_REASON, ChunkSizer, chunk_ocr_records, payload_tail,
+    serialize_payload, split_payload,
 )
 
+# 1. Define the prompt template: the static instructions are the leading system
+# message, identical on every call (prefix-cacheable); only the user turn with
+# the chunk changes
+prompt = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", USER_PROMPT),
+])
+
 # 2. Define the LLM (no output parser)
 llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0, top_p=1, max_tokens=4096)
 
-# 3. Define the mapping chain (for each chunk)
-mapping_chain = LLMChain(
-    llm=llm,
-    prompt=prompt
-)
-
-# 4. Define a simple reduce chain (just concatenate results)
-reduce_chain = StuffDocumentsChain(
-    llm_chain=mapping_chain,
-    document_variable_name="chunk"
-)
+# Chat models for the chunk cascade (settings.CHUNK_MODELS), created on first use
+_llms = {(llm.model_name, llm.max_retries): llm}
+_llms_lock = threading.Lock()
 
-# 5. Define the MapReduce chain
-menu_parsing_chain = MapReduceDocumentsChain(
-    llm_chain=mapping_chain,
-    reduce_documents_chain=reduce_chain,
-    document_variable_name="chunk",
-    return_intermediate_steps=True
-)
+def get_llm(model=None, max_retries=None):
+    """
+    The chat model named `model` (default: the module llm) with the mapping
+    settings and `max_retries` client retries (default: the client's own).
+    """
+    if not model and max_retries is None:
+        return llm
+    key = (model or llm.model_name, llm.max_retries if max_retries is None else max_retries)
+    with _llms_lock:
+        if key not in _llms:
+            _llms[key] = ChatOpenAI(model=key[0], temperature=0, top_p=1, max_tokens=4096, max_retries=key[1])
+        return _llms[key]
 
 # Canonical subcategory mapping
 CANONICAL_SUBCATS = {
@@ -63,14 +59,19 @@ CANONICAL_SUBCATS = {
     "chef's specials": "Chef's Specials"
 }
 
+# Extra variants from CANONICAL_SUBCATS_PATH extend (or override) the defaults
+if settings.CANONICAL_SUBCATS_PATH:
+    CANONICAL_SUBCATS.update(load_vocabulary(settings.CANONICAL_SUBCATS_PATH))
+_canonical_subcat_matcher = FuzzyMatcher(CANONICAL_SUBCATS.keys())
+
 def canonicalize_subcat(title):
     title_lc = title.strip().lower()
     # Only map if it's a known variant, otherwise return the original
     if title_lc in CANONICAL_SUBCATS:
         return CANONICAL_SUBCATS[title_lc]
-    match = get_close_matches(title_lc, CANONICAL_SUBCATS.keys(), n=1, cutoff=0.85)
+    match = _canonical_subcat_matcher.best_match(title_lc, cutoff=0.85)
     if match:
-        return CANONICAL_SUBCATS[match[0]]
+        return CANONICAL_SUBCATS[match]
     # If not found, return the original title (preserve new/unknown subcategories)
     return title.strip()
 
@@ -89,11 +90,218 @@ def chunk_menu_text(menu_text, max_length=2000):
         start = end
     return chunks
 
-def parse_menu(menu_ocr):
-    print("parse_menu called")
+def chunk_messages(chunk_text):
+    """The mapping prompt's chat messages for one serialized chunk."""
+    return prompt.format_prompt(chunk=chunk_text).to_messages()
+
+def invoke_mapping_chain(chunk_text, label="chunk", model=None):
     """
-    Accepts OCR data as a list of dicts (structured OCR output) or plain text.
-    Serializes and chunks as needed, then runs the MapReduce chain.
+    Run the mapping prompt on one chunk with `model` (default: the module llm).
+    Returns (raw model text, finish_reason); finish_reason is "length" when the
+    completion was cut off at max_tokens.
+    """
+    try:
+        messages = chunk_messages(chunk_text)
+        debug_artifacts.capture("prompt", label, chunk_text)
+        with llm_slot(chunk_text):
+            chat_model = get_llm(model, max_retries=deadline.call_retries(None))
+            result = chat_model.generate([messages], timeout=deadline.call_timeout(label))
+        generation = result.generations[0][0]
+        debug_artifacts.capture("raw_output", label, generation.text)
+        print(f"LLM mapping chain result ({label}): {len(generation.text)} chars")
+    except Exception as e:
+        print(f"Exception during LLM mapping chain invoke ({label}):", e)
+        raise
+    metrics.record_token_usage("text_chunk", (result.llm_output or {}).get("token_usage"))
+    finish_reason = (generation.generation_info or {}).get("finish_reason")
+    return generation.text.strip(), finish_reason
+
+def parse_chunk_adaptive(payload, sizer, label="chunk", depth=0, max_depth=4, model=None):
+    """
+    Parse one chunk payload (list of OCR records or plain text).
+    A completion cut off at max_tokens keeps every entry it finished; the rest of
+    the payload is split in halves and only those halves are re-run. Each
+    truncation also lowers the sizer's per-menu limit for the chunks that follow.
+    Returns a list of parsed chunk results.
+    """
+    chunk_text = serialize_payload(payload)
+    cleaned, finish_reason = invoke_mapping_chain(chunk_text, label=label, model=model)
+    truncated = finish_reason == TRUNCATED_FINISH_REASON
+    try:
+        parsed_result, report = parse_model_json(cleaned)
+    except ValueError as e:
+        if not truncated:
+            print(f"JSON parsing failed for {label} (raw output in debug artifacts)")
+            raise ValueError(f"Could not parse LLM output as JSON: {e}\nOutput was:\n{cleaned}")
+        parsed_result, report = None, None
+    if report is not None:
+        print(f"Salvaged partial output for {label}:", report)
+        truncated = truncated or report["truncated"]
+    if not truncated:
+        return [parsed_result]
+
+    results = []
+    remainder = payload
+    if report is not None and any(report["recovered"].values()):
+        results.append(parsed_result)
+        remainder = payload_tail(payload, report["last_item_title"])
+        if remainder is None:
+            print(f"Could not locate the unparsed tail of {label}; {report['dropped']} entries lost.")
+            return results
+        if not remainder:
+            return results
+    completed_size = len(chunk_text) - len(serialize_payload(remainder)) if remainder is not payload else None
+    sizer.observe_truncation(len(chunk_text), completed_size)
+
+    halves = split_payload(remainder) if depth < max_depth else None
+    if not halves:
+        if results:
+            print(f"Giving up on the tail of {label} ({len(serialize_payload(remainder))} chars unparsed).")
+            return results
+        raise ValueError(f"LLM output for {label} was truncated and the chunk cannot be split further")
+    print(f"Completion for {label} truncated; re-running the remaining input as {len(halves)} halves")
+    for k, half in enumerate(halves, start=1):
+        for piece in sizer.fit(half):
+            results.extend(parse_chunk_adaptive(piece, sizer, label=f"{label}.{k}", depth=depth + 1, max_depth=max_depth, model=model))
+    return results
+
+def rule_based_result(payload, label="chunk", section_title=None):
+    """
+    The rule-based parse of a chunk when it explains every line, accounts for
+    every OCR price and scores at least CHUNK_CONFIDENCE_THRESHOLD, else None.
+    """
+    if not settings.CHUNK_RULE_BASED:
+        return None
+    result, unexplained = rule_based_parse(payload, section_title=section_title)
+    if unexplained or not result["data"]["items"]:
+        return None
+    confidence = chunk_confidence(payload, result)
+    # A price the rules did not place would be lost without a model call
+    if confidence["price_coverage"] < 1.0 or confidence["score"] < settings.CHUNK_CONFIDENCE_THRESHOLD:
+        return None
+    print(f"Rule-based parse accepted for {label}:", confidence)
+    metrics.incr("cascade_rule_based")
+    return result
+
+def results_confidence(payload, results):
+    """chunk_confidence of a chunk's merged results; 0 when they cannot be merged."""
+    try:
+        merged = merge_menu_json(results).to_json()
+    except (KeyError, TypeError, AttributeError):
+        return {"schema": False, "price_coverage": 0.0, "count_agreement": 0.0, "score": 0.0}
+    return chunk_confidence(payload, merged)
+
+def parse_chunk_cascade(payload, sizer, label="chunk"):
+    """
+    Parse one chunk with the cheapest path that is confident enough: the
+    rule-based parser, then each model of CHUNK_MODELS in order. A model result
+    scoring below CHUNK_CONFIDENCE_THRESHOLD (see reconciliation.chunk_confidence)
+    is escalated to the next model; the last model's result, or the best-scoring
+    one, is kept. Once the request deadline is near, or it stops an escalation,
+    the best result so far is kept. Returns a list of parsed chunk results.
+    """
+    rule_result = rule_based_result(payload, label=label)
+    if rule_result is not None:
+        return [rule_result]
+    models = settings.CHUNK_MODELS or [None]
+    best = None
+    for rank, model in enumerate(models):
+        last = rank == len(models) - 1
+        if best is not None and deadline.expired():
+            print(f"Request deadline reached; keeping the best result for {label} instead of escalating to {model}")
+            break
+        try:
+            results = parse_chunk_adaptive(payload, sizer, label=label, model=model)
+        except Exception as e:
+            if best is not None and deadline.timed_out(e):
+                print(f"{model} on {label} stopped by the request deadline; keeping the best result:", e)
+                break
+            if not isinstance(e, ValueError) or (last and best is None):
+                raise
+            print(f"{model} failed on {label}; escalating:", e)
+            metrics.incr(f"cascade_escalated_{model}")
+            continue
+        confidence = results_confidence(payload, results) if not last or best else None
+        if confidence is None or confidence["score"] >= settings.CHUNK_CONFIDENCE_THRESHOLD:
+            return results
+        print(f"Low confidence from {model} on {label}:", confidence)
+        if best is None or confidence["score"] > best[0]:
+            best = (confidence["score"], results)
+        if not last:
+            metrics.incr(f"cascade_escalated_{model}")
+    return best[1]
+
+def merge_menu_json(results):
+    """
+    Merge per-chunk results into one Menu, deduplicating categories by title and
+    subcategories by canonical title, and renumbering ids. Records reference the
+    chunk output's values instead of copying each dict.
+    """
+    merged = Menu()
+    cat_id_map = {}
+    subcat_id_map = {}
+    canonical_subcat_map = {}
+    subcat_matcher = FuzzyMatcher()
+
+    for res in results:
+        data = res.get("data", res)
+        categories = data.get("category", [])
+        sub_categories = data.get("sub_category", [])
+        # Chunk-local lookups, built once per chunk instead of scanned per record
+        chunk_cat_titles = {}
+        chunk_subcat_titles = {}
+        for cat in categories:
+            chunk_cat_titles.setdefault(cat.get("id"), cat["title"].strip().lower())
+        # Categories
+        for cat in categories:
+            cat_key = cat["title"].strip().lower()
+            if cat_key not in cat_id_map:
+                new_cat = Category.from_json(cat)
+                new_cat.id = len(merged.categories) + 1
+                cat_id_map[cat_key] = new_cat.id
+                merged.categories.append(new_cat)
+        # Subcategories with canonicalization
+        for subcat in sub_categories:
+            canonical_title = canonicalize_subcat(subcat["title"])
+            chunk_subcat_titles.setdefault(subcat.get("id"), canonical_title)
+            subcat_key = (canonical_title.lower(), subcat.get("catId", 1))
+            if subcat_key not in subcat_id_map:
+                new_subcat = SubCategory.from_json(subcat)
+                new_subcat.title = canonical_title
+                new_subcat.id = len(merged.sub_categories) + 1
+                # Remap catId
+                cat_title = chunk_cat_titles.get(subcat["catId"])
+                new_subcat.cat_id = cat_id_map.get(cat_title, 1) if cat_title else 1
+                subcat_id_map[subcat_key] = new_subcat.id
+                canonical_subcat_map[canonical_title.lower()] = new_subcat.id
+                subcat_matcher.add(canonical_title.lower())
+                merged.sub_categories.append(new_subcat)
+        # Items with improved subCatId assignment
+        for item in data.get("items", []):
+            new_item = Item.from_json(item)
+            # Try to find canonical subcategory
+            subcat_title = chunk_subcat_titles.get(item["subCatId"])
+            # Fuzzy match if not found
+            subcat_id = 1
+            if subcat_title:
+                # Try direct canonical map
+                if subcat_title.lower() in canonical_subcat_map:
+                    subcat_id = canonical_subcat_map[subcat_title.lower()]
+                else:
+                    # Fuzzy match
+                    match = subcat_matcher.best_match(subcat_title.lower(), cutoff=0.8)
+                    if match:
+                        subcat_id = canonical_subcat_map[match]
+            new_item.sub_cat_id = subcat_id
+            new_item.item_id = len(merged.items) + 1
+            merged.items.append(new_item)
+    return merged
+
+def menu_payloads(menu_ocr):
+    """
+    Chunk payloads for a menu: OCR records (merged into lines and put in column
+    order when enabled) chunked by whole records, or plain text chunked by lines.
+    menu_ocr may be a list of OCR dicts, a JSON string of one, or plain text.
     """
     # If input is a string, try to parse as JSON
     if isinstance(menu_ocr, str):
@@ -105,180 +313,75 @@ def parse_menu(menu_ocr):
     else:
         ocr_data = menu_ocr
 
-    # If ocr_data is a list (structured OCR), serialize for LLM
+    # If ocr_data is a list (structured OCR), chunk by whole records so a chunk
+    # can later be split again without cutting a record in half
     if isinstance(ocr_data, list):
-        serialized = json.dumps(ocr_data, ensure_ascii=False, indent=2)
-        chunks = chunk_menu_text(serialized)
-        docs = [Document(page_content=chunk) for chunk in chunks]
-    else:
-        # fallback: treat as plain text
-        chunks = chunk_menu_text(str(ocr_data))
-        docs = [Document(page_content=chunk) for chunk in chunks]
-
-    all_results = []
-    for i, doc in enumerate(docs):
-        print(f"Processing chunk {i+1}/{len(docs)}")
-        try:
-            result = mapping_chain.invoke({"chunk": doc.page_content})
-            print(f"RAW LLM MAPPING CHAIN RESULT (chunk {i+1}):", result)
-        except Exception as e:
-            print(f"Exception during LLM mapping chain invoke (chunk {i+1}):", e)
-            raise
-
-        if isinstance(result, dict) and "text" in result:
-            cleaned = result["text"].strip()
-        else:
-            cleaned = str(result).strip()
-        print(f"About to parse LLM output for chunk {i+1}. Type:", type(cleaned))
-        print(f"LLM OUTPUT BEFORE PARSING (chunk {i+1}):\n", cleaned)
-        # Remove markdown code block markers if present
-        cleaned_for_json = re.sub(r'^```json\s*|```$', '', cleaned.strip(), flags=re.MULTILINE).strip()
-        try:
-            parsed_result = json.loads(cleaned_for_json)
-            all_results.append(parsed_result)
-        except Exception as e:
-            print(f"JSON parsing failed for chunk {i+1}. Output was:\n", cleaned_for_json)
-            print("Exception type:", type(e), "Exception:", e)
-            raise ValueError(f"Could not parse LLM output as JSON: {e}\nOutput was:\n{cleaned_for_json}")
-
-    # Merge all_results into a single menu JSON
-    def merge_menu_json(results):
-        merged = {
-            "data": {
-                "category": [],
-                "sub_category": [],
-                "items": []
-            }
-        }
-        cat_id_map = {}
-        subcat_id_map = {}
-        canonical_subcat_map = {}
-        next_cat_id = 1
-        next_subcat_id = 1
-        next_item_id = 1
-
-        for res in results:
-            data = res.get("data", res)
-            # Categories
-            for cat in data.get("category", []):
-                cat_key = cat["title"].strip().lower()
-                if cat_key not in cat_id_map:
-                    new_cat = cat.copy()
-                    new_cat["id"] = next_cat_id
-                    cat_id_map[cat_key] = next_cat_id
-                    merged["data"]["category"].append(new_cat)
-                    next_cat_id += 1
-            # Subcategories with canonicalization
-            for subcat in data.get("sub_category", []):
-                canonical_title = canonicalize_subcat(subcat["title"])
-                subcat_key = (canonical_title.lower(), subcat.get("catId", 1))
-                if subcat_key not in subcat_id_map:
-                    new_subcat = subcat.copy()
-                    new_subcat["title"] = canonical_title
-                    new_subcat["id"] = next_subcat_id
-                    # Remap catId
-                    cat_title = None
-                    for cat in data.get("category", []):
-                        if cat["id"] == subcat["catId"]:
-                            cat_title = cat["title"].strip().lower()
-                            break
-                    if cat_title and cat_title in cat_id_map:
-                        new_subcat["catId"] = cat_id_map[cat_title]
-                    else:
-                        new_subcat["catId"] = 1
-                    subcat_id_map[subcat_key] = next_subcat_id
-                    canonical_subcat_map[canonical_title.lower()] = next_subcat_id
-                    merged["data"]["sub_category"].append(new_subcat)
-                    next_subcat_id += 1
-            # Items with improved subCatId assignment
-            for item in data.get("items", []):
-                new_item = item.copy()
-                # Try to find canonical subcategory
-                subcat_title = None
-                for subcat in data.get("sub_category", []):
-                    if subcat["id"] == item["subCatId"]:
-                        subcat_title = canonicalize_subcat(subcat["title"])
-                        break
-                # Fuzzy match if not found
-                subcat_id = 1
-                if subcat_title:
-                    # Try direct canonical map
-                    if subcat_title.lower() in canonical_subcat_map:
-                        subcat_id = canonical_subcat_map[subcat_title.lower()]
-                    else:
-                        # Fuzzy match
-                        match = get_close_matches(subcat_title.lower(), canonical_subcat_map.keys(), n=1, cutoff=0.8)
-                        if match:
-                            subcat_id = canonical_subcat_map[match[0]]
-                new_item["subCatId"] = subcat_id
-                new_item["itemId"] = next_item_id
-                next_item_id += 1
-                merged["data"]["items"].append(new_item)
-        return merged
+        if settings.OCR_LINE_MERGE:
+            # Word-level fragments -> one compact record per line segment
+            merged_lines = merge_ocr_lines(ocr_data)
+            if merged_lines is not ocr_data:
+                print(f"OCR line merge: {len(ocr_data)} fragments -> {len(merged_lines)} lines")
+            ocr_data = merged_lines
+        if settings.OCR_COLUMN_LAYOUT:
+            # Multi-column menus: keep each column's lines together in the chunks
+            ocr_data, _ = column_layout(ocr_data)
+        return chunk_ocr_records(ocr_data, max_length=settings.CHUNK_MAX_CHARS)
+    # fallback: treat as plain text
+    return chunk_menu_text(str(ocr_data), max_length=settings.CHUNK_MAX_CHARS)
 
+def merged_menu(all_results, as_model=False, label="parse_menu"):
+    """Merge chunk results into one menu and validate it; the menu JSON, or the compact Menu when as_model is True."""
     merged_result = merge_menu_json(all_results)
+    if debug_artifacts.capturing():
+        debug_artifacts.capture("merged", label, merged_result.to_json())
 
-    # Step 2: JSON schema validation
-    # Expanded schema for menu structure
-    menu_schema = {
-        "type": "object",
-        "properties": {
-            "data": {
-                "type": "object",
-                "properties": {
-                    "category": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "integer"},
-                                "title": {"type": "string"},
-                                "description": {"type": "string"}
-                            },
-                            "required": ["id", "title", "description"]
-                        }
-                    },
-                    "sub_category": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "integer"},
-                                "catId": {"type": "integer"},
-                                "title": {"type": "string"},
-                                "description": {"type": "string"}
-                            },
-                            "required": ["id", "catId", "title", "description"]
-                        }
-                    },
-                    "items": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "itemId": {"type": "integer"},
-                                "subCatId": {"type": "integer"},
-                                "title": {"type": "string"},
-                                "description": {"type": "string"},
-                                "price": {"type": "number"},
-                                "variantAvailable": {"type": "integer"},
-                                "variants": {"type": "array"},
-                                "optionsAvailable": {"type": "integer"},
-                                "options": {"type": "array"}
-                            },
-                            "required": ["itemId", "subCatId", "title", "description", "price", "variantAvailable", "variants", "optionsAvailable", "options"]
-                        }
-                    }
-                },
-                "required": ["category", "sub_category", "items"]
-            }
-        },
-        "required": ["data"]
-    }
+    # Step 2: schema validation, checked on the compact records directly
     try:
-        validate(instance=merged_result, schema=menu_schema)
-    except ValidationError as e:
+        merged_result.validate()
+    except ValueError as e:
         print("Schema validation error:", e)
         raise ValueError(f"Menu JSON schema validation failed: {e}")
 
-    return merged_result 
\ No newline at end of file
+    # Callers that only store the menu keep the compact model; it is
+    # serialized to the JSON shape in store_menu_json
+    return merged_result if as_model else merged_result.to_json()
+
+def chunk_section_name(label, payload):
+    """Name of a chunk in a partial result's missing sections: its label and first line."""
+    if isinstance(payload, list):
+        first_line = payload[0].get("text", "") if payload else ""
+    else:
+        first_line = str(payload).strip().split("\n", 1)[0]
+    first_line = first_line.strip()[:60]
+    return f"{label} ({first_line!r})" if first_line else label
+
+def parse_menu(menu_ocr, as_model=False, label=None):
+    print("parse_menu called")
+    """
+    Accepts OCR data as a list of dicts (structured OCR output) or plain text.
+    Serializes and chunks as needed, then parses each chunk (see
+    parse_chunk_cascade) and merges the chunk results.
+    Chunks the request deadline leaves no time for are skipped and recorded
+    as missing sections; the menu merges the chunks that finished. label
+    (e.g. "page 2") prefixes the chunk labels.
+    Returns the menu JSON, or the compact Menu model when as_model is True.
+    """
+    payloads = menu_payloads(menu_ocr)
+
+    # Learns this menu's safe chunk size from truncated completions
+    sizer = ChunkSizer(settings.CHUNK_MAX_CHARS, min_size=settings.CHUNK_MIN_CHARS)
+    all_results = []
+    for i, payload in enumerate(payloads):
+        print(f"Processing chunk {i+1}/{len(payloads)}")
+        pieces = sizer.fit(payload)
+        for k, piece in enumerate(pieces, start=1):
+            chunk_label = f"chunk {i+1}" if len(pieces) == 1 else f"chunk {i+1}.{k}"
+            if label:
+                chunk_label = f"{label} {chunk_label}"
+            results = deadline.run_section(
+                chunk_section_name(chunk_label, piece), parse_chunk_cascade, piece, sizer, label=chunk_label,
+            )
+            all_results.extend(results or [])
+
+    # Merge all_results into a single compact menu
+    return merged_menu(all_results, as_model=as_model)
@@ -0,0 +1,153 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from adaptive_chunking import estimate_tokens
+import deadline
+import metrics
+import settings
+
+# Tenant of the request being handled; LLM calls are queued under it
+_tenant = contextvars.ContextVar("llm_tenant", default="default")
+
+# Scheduling cost of a call: a fixed part plus one unit per 1000 prompt tokens,
+# so a tenant sending large chunks uses up its share faster
+BASE_CALL_COST = 1.0
+TOKENS_PER_COST_UNIT = 1000
+
+
+def tenant_for(doc_id=None, source_file_path=None):
+    """
+    Tenant key of a request: the docId up to TENANT_DELIMITER, else the source
+    file's folder. The web UIs name documents "<file name>_<timestamp>", so for
+    them the key is the uploaded file name's prefix, not a restaurant; callers
+    wanting per-customer fairness send docIds that start with a customer key.
+    """
+    if doc_id:
+        return doc_id.split(settings.TENANT_DELIMITER, 1)[0] or "default"
+    if source_file_path:
+        return os.path.dirname(source_file_path) or "default"
+    return "default"
+
+
+def set_tenant(tenant):
+    """Queue the current request's LLM calls under tenant. Returns a token for reset_tenant."""
+    return _tenant.set(tenant)
+
+
+def reset_tenant(token):
+    _tenant.reset(token)
+
+
+def call_cost(text):
+    return BASE_CALL_COST + estimate_tokens(text or "") / TOKENS_PER_COST_UNIT
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of LLM calls across tenants. At most `capacity`
+    calls run at once; when all slots are busy, waiting calls are admitted in
+    order of their virtual finish time: the tenant's previous finish (or the
+    current virtual time, for a tenant that was idle) plus cost / weight. A
+    tenant with a long backlog therefore alternates with the others instead of
+    holding every slot, and small requests are not queued behind it.
+    """
+
+    def __init__(self, capacity, weights=None):
+        self.capacity = capacity
+        self.weights = weights or {}
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self._finish = {}  # tenant -> virtual finish time of its last queued call
+        self._queued = {}  # tenant -> calls waiting
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, tenant, cost=BASE_CALL_COST, timeout=None):
+        """
+        Block until the call may run, for at most timeout seconds (then raises
+        TimeoutError). Returns the seconds waited.
+        """
+        started = time.monotonic()
+        with self._cond:
+            start = max(self.virtual_time, self._finish.get(tenant, 0.0))
+            finish = start + cost / self.weights.get(tenant, 1.0)
+            self._finish[tenant] = finish
+            if self.in_flight < self.capacity and not self._heap:
+                self.in_flight += 1
+                self.virtual_time = max(self.virtual_time, start)
+            else:
+                entry = [finish, next(self._seq), tenant, start, False]
+                heapq.heappush(self._heap, entry)
+                self._queued[tenant] = self._queued.get(tenant, 0) + 1
+                metrics.tenant_queue(tenant, self._queued[tenant])
+                while not entry[4]:
+                    left = None if timeout is None else started + timeout - time.monotonic()
+                    if left is not None and left <= 0:
+                        # Give up the place in the queue
+                        self._heap.remove(entry)
+                        heapq.heapify(self._heap)
+                        self._dequeued(tenant)
+                        raise TimeoutError(f"No LLM slot for tenant {tenant} within {timeout:.1f}s")
+                    self._cond.wait(left)
+        waited = time.monotonic() - started
+        metrics.record_tenant_call(tenant, waited, cost)
+        return waited
+
+    def release(self):
+        with self._cond:
+            if not self._heap:
+                self.in_flight -= 1
+                return
+            # Hand the slot straight to the waiting call with the earliest finish
+            entry = heapq.heappop(self._heap)
+            entry[4] = True
+            self.virtual_time = max(self.virtual_time, entry[3])
+            self._dequeued(entry[2])
+            # Tenants idle since before the current virtual time restart from it
+            if len(self._finish) > 1024:
+                self._finish = {t: f for t, f in self._finish.items() if f > self.virtual_time}
+            self._cond.notify_all()
+
+    def _dequeued(self, tenant):
+        self._queued[tenant] -= 1
+        metrics.tenant_queue(tenant, self._queued[tenant])
+        if not self._queued[tenant]:
+            del self._queued[tenant]
+
+
+def _parse_weights(spec):
+    """Parse TENANT_WEIGHTS ("tenantA:2,tenantB:0.5") into {tenant: weight}."""
+    weights = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().rpartition(":")
+        if name:
+            weights[name] = float(weight)
+    return weights
+
+
+scheduler = FairScheduler(settings.LLM_CONCURRENCY, _parse_weights(settings.TENANT_WEIGHTS))
+
+
+@contextmanager
+def llm_slot(text=""):
+    """
+    Hold one LLM concurrency slot for the current tenant while the block runs
+    (no-op when LLM_CONCURRENCY is 0). Waiting for the slot stops at the
+    request's deadline with DeadlineExceeded.
+    """
+    if settings.LLM_CONCURRENCY <= 0:
+        yield
+        return
+    try:
+        scheduler.acquire(_tenant.get(), call_cost(text), timeout=deadline.remaining())
+    except TimeoutError:
+        raise deadline.DeadlineExceeded("Request deadline reached while waiting for an LLM slot")
+    try:
+        yield
+    finally:
+        scheduler.release()
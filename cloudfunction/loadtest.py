@@ -0,0 +1,423 @@
+"""
+Load generator for the menu parsing service.
+
+Starts the FastAPI app in-process on localhost with the LLM, Storage and
+Firestore replaced by local fakes, then drives /parse-menu-from-file (or
+/parse-menu) at increasing client concurrency and reports throughput and
+p50/p95/p99 latency per level. Use it to size instances and to check changes
+to WEB_CONCURRENCY, CPU_POOL_WORKERS or the request thread pool with data.
+
+    python loadtest.py --concurrency 1,4,16,64 --requests 200 \
+        --text-latency lognormal:0.8,0.4 --vision-latency lognormal:2.5,0.5 --error-rate 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+
+RECORD_TEXT_RE = re.compile(r'"text"\s*:\s*"((?:[^"\\]|\\.)*)"')
+PRICE_RE = re.compile(r'(\d+(?:\.\d{1,2})?)\s*$')
+
+
+def latency_sampler(spec):
+    """
+    Build a latency sampler (seconds) from a spec string:
+    fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def fake_menu_json(prompt_text):
+    """A plausible model answer for a chunk: one item per OCR record in the prompt."""
+    items = []
+    for i, raw in enumerate(RECORD_TEXT_RE.findall(prompt_text), start=1):
+        text = json.loads(f'"{raw}"')
+        price = PRICE_RE.search(text)
+        items.append({
+            "itemId": i, "subCatId": 1, "title": PRICE_RE.sub("", text).strip() or text,
+            "description": "", "price": float(price.group(1)) if price else 0.0,
+            "variantAvailable": 0, "variants": [], "optionsAvailable": 0, "options": [],
+        })
+    return json.dumps({"data": {
+        "category": [{"id": 1, "title": "Menu", "description": ""}],
+        "sub_category": [{"id": 1, "catId": 1, "title": "Items", "description": ""}],
+        "items": items,
+    }})
+
+
+class FakeLLM:
+    """Stands in for both the LangChain chat model and the OpenAI client."""
+
+    def __init__(self, text_latency, vision_latency, error_rate):
+        self.text_latency = text_latency
+        self.vision_latency = vision_latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+        self.api_key = None
+
+    # openai.OpenAI (the client without retries used under a deadline)
+    def OpenAI(self, **options):
+        return self
+
+    def _call(self, latency, timeout=None):
+        delay = max(latency(), 0.0)
+        if timeout is not None and delay > timeout:
+            # The client gives up at the per-call timeout
+            time.sleep(timeout)
+            raise TimeoutError("Simulated LLM call timeout")
+        time.sleep(delay)
+        with self._lock:
+            self.calls += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            raise RuntimeError("Simulated LLM error")
+
+    @staticmethod
+    def _usage(prompt_text, content):
+        return {"prompt_tokens": len(prompt_text) // 4, "completion_tokens": len(content) // 4,
+                "prompt_tokens_details": {"cached_tokens": 0}}
+
+    # LangChain ChatOpenAI.generate
+    def generate(self, message_lists, timeout=None):
+        self._call(self.text_latency, timeout)
+        prompt_text = message_lists[0][-1].content
+        content = fake_menu_json(prompt_text)
+        generation = types.SimpleNamespace(text=content, generation_info={"finish_reason": "stop"})
+        return types.SimpleNamespace(
+            generations=[[generation]],
+            llm_output={"token_usage": self._usage(prompt_text, content)},
+        )
+
+    # openai.chat.completions.create
+    def create(self, model, messages, timeout=None, **kwargs):
+        self._call(self.vision_latency, timeout)
+        user_text = next(part["text"] for part in messages[-1]["content"] if part["type"] == "text")
+        if '"section_title"' in user_text:
+            content = fake_menu_json(user_text)
+        else:
+            content = user_text  # refinement: return the menu unchanged
+        choice = types.SimpleNamespace(message=types.SimpleNamespace(content=content), finish_reason="stop")
+        return types.SimpleNamespace(choices=[choice], usage=self._usage(user_text, content))
+
+
+class FakeBlob:
+    def __init__(self, bucket, path, data):
+        self.bucket = bucket
+        self.path = path
+        self.data = data
+        self.size = len(data)
+        self.generation = 1
+        self.md5_hash = str(hash(data))
+        self.chunk_size = None
+        self.content_encoding = None
+
+    def reload(self):
+        pass
+
+    def download_to_file(self, f):
+        f.write(self.data)
+
+    def download_as_bytes(self):
+        return self.data
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.uploads[self.path] = data
+
+
+class FakeBucket:
+    """Every path reads the same generated file, like re-uploads of one menu; uploads are kept in memory."""
+
+    def __init__(self, data):
+        self.data = data
+        self.uploads = {}
+
+    def blob(self, path):
+        return FakeBlob(self, path, self.data)
+
+
+class FakeDocument:
+    def __init__(self, collection, key):
+        self.collection_ref, self.id = collection, key
+
+    def get(self):
+        data = self.collection_ref.get(self.id)
+        return types.SimpleNamespace(id=self.id, exists=data is not None, to_dict=lambda: dict(data or {}))
+
+    def set(self, data):
+        self.collection_ref[self.id] = data
+
+    def delete(self):
+        self.collection_ref.pop(self.id, None)
+
+    def collection(self, name):
+        return self.collection_ref.subcollection(self.id, name)
+
+
+class FakeCollection(dict):
+    def __init__(self):
+        super().__init__()
+        self._subcollections = {}
+
+    def document(self, key):
+        return FakeDocument(self, key)
+
+    def subcollection(self, key, name):
+        return self._subcollections.setdefault((key, name), FakeCollection())
+
+    def list_documents(self):
+        return [FakeDocument(self, key) for key in list(self)]
+
+    def stream(self):
+        return [doc.get() for doc in self.list_documents()]
+
+    def where(self, field, op, value):
+        assert op == "array_contains"
+        matches = FakeCollection()
+        matches.update({k: v for k, v in self.items() if value in v.get(field, [])})
+        return matches
+
+
+class FakeBatch:
+    def __init__(self):
+        self.ops = []
+
+    def set(self, ref, data):
+        self.ops.append((ref.set, data))
+
+    def delete(self, ref):
+        self.ops.append((lambda _: ref.delete(), None))
+
+    def commit(self):
+        for op, data in self.ops:
+            op(data)
+
+
+class FakeFirestore(dict):
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        with self._lock:
+            return self.setdefault(name, FakeCollection())
+
+    def batch(self):
+        return FakeBatch()
+
+
+def synthetic_ocr(items, columns=2):
+    """Word-level OCR for a multi-column menu with the given number of priced items."""
+    records = []
+    per_column = math.ceil(items / columns)
+    for n in range(items):
+        col, row = divmod(n, per_column)
+        x, y = 60 + col * 700, 120 + row * 45
+        if row == 0:
+            records.append({"text": f"SECTION {col + 1}", "x": x, "y": y - 45})
+        records.append({"text": "Dish", "x": x, "y": y})
+        records.append({"text": f"number {n + 1}", "x": x + 45, "y": y})
+        records.append({"text": f"${5 + n % 20}.50", "x": x + 450, "y": y})
+    return records
+
+
+def install_fakes(args):
+    """Patch the service modules to use the fakes. Returns (app, fake_llm, fake_db, fake_bucket)."""
+    import settings
+    settings.RESULT_DEDUPE = args.dedupe
+    settings.CHUNK_RULE_BASED = args.rule_based
+    if args.deadline is not None:
+        settings.REQUEST_DEADLINE_SECONDS = args.deadline
+        settings.DEADLINE_MIN_CALL_SECONDS = min(settings.DEADLINE_MIN_CALL_SECONDS, args.deadline / 10)
+    settings.FILE_CACHE_DIR = tempfile.mkdtemp(prefix="menuparser-loadtest-")
+
+    import firebase_utils
+    import file_utils
+    import langchain_pipeline
+    import menu_parser_with_file
+    import result_index
+    import main
+
+    fake_llm = FakeLLM(latency_sampler(args.text_latency), latency_sampler(args.vision_latency), args.error_rate)
+    fake_db = FakeFirestore()
+    langchain_pipeline.llm = fake_llm
+    langchain_pipeline.get_llm = lambda model=None, max_retries=None: fake_llm
+    menu_parser_with_file.openai = fake_llm
+    firebase_utils.init_firebase = lambda: fake_db
+    result_index.init_firebase = lambda: fake_db
+    bucket = FakeBucket(os.urandom(args.image_kb * 1024))
+    file_utils.get_storage_bucket = lambda: bucket
+
+    if args.threadpool:
+        def resize_threadpool():
+            import anyio.to_thread
+            anyio.to_thread.current_default_thread_limiter().total_tokens = args.threadpool
+        main.app.add_event_handler("startup", resize_threadpool)
+    return main.app, fake_llm, fake_db, bucket
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Server failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_level(base_url, endpoint, concurrency, total_requests, ocr_json, same_source=False):
+    """Closed-loop run: `concurrency` clients issue total_requests requests between them."""
+    import requests
+    counter = iter(range(total_requests))
+    lock = threading.Lock()
+    latencies = []
+    failures = []
+    partial = []
+
+    def client(_):
+        session = requests.Session()
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            doc_id = f"loadtest-c{concurrency}-{n}"
+            source = "menus/loadtest.png" if same_source else f"menus/{doc_id}.png"
+            if endpoint == "parse-menu":
+                body = {"menu_text": ocr_json, "docId": doc_id, "sourceFilePath": source}
+            else:
+                body = {"sourceFilePath": source, "docId": doc_id, "ocr_data": ocr_json}
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/{endpoint}", json=body, timeout=600)
+                ok = response.status_code == 200
+                cut_short = ok and bool(response.json().get("partial"))
+            except Exception:
+                ok = cut_short = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if ok else failures).append(elapsed)
+                if cut_short:
+                    partial.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": len(failures),
+        "partial": len(partial),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "wall_s": round(wall, 2),
+    }
+
+
+def print_table(rows, out):
+    header = f"{'conc':>5} {'reqs':>6} {'errors':>6} {'partial':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header, file=out)
+    for r in rows:
+        print(f"{r['concurrency']:>5} {r['requests']:>6} {r['errors']:>6} {r['partial']:>7} {r['throughput_rps']:>8.2f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the menu parser with stubbed LLM, Storage and Firestore.")
+    parser.add_argument("--endpoint", choices=["parse-menu-from-file", "parse-menu"], default="parse-menu-from-file")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="comma-separated client concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per concurrency level")
+    parser.add_argument("--items", type=int, default=40, help="menu items in the synthetic OCR")
+    parser.add_argument("--image-kb", type=int, default=300, help="size of the fake uploaded image")
+    parser.add_argument("--text-latency", default="lognormal:0.8,0.4", help="text LLM latency: fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--vision-latency", default="lognormal:2.0,0.5", help="vision LLM latency, same format")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of LLM calls that raise")
+    parser.add_argument("--threadpool", type=int, default=0, help="override the request thread pool size (Starlette default: 40)")
+    parser.add_argument("--dedupe", action="store_true", help="leave result deduplication on (every request after the first is a hit)")
+    parser.add_argument("--rule-based", action="store_true", help="let the rule-based parser take the chunks it explains (they then skip the fake LLM)")
+    parser.add_argument("--deadline", type=float, default=None, help="per-request deadline in seconds (default: REQUEST_DEADLINE_SECONDS); slower requests store partial menus")
+    parser.add_argument("--same-source", action="store_true", help="send every request for the same file, so concurrent duplicates are coalesced")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--verbose", action="store_true", help="keep the service's own logging")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    out = sys.stdout
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        app, fake_llm, _, bucket = install_fakes(args)
+        port = free_port()
+        server, thread = start_server(app, port)
+    base_url = f"http://127.0.0.1:{port}"
+    ocr_json = json.dumps(synthetic_ocr(args.items))
+    print(f"Serving on {base_url}; {args.endpoint}, {args.items} items per menu", file=out)
+
+    rows = []
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(",") if c.strip()):
+            with (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())):
+                row = run_level(base_url, args.endpoint, concurrency, args.requests, ocr_json, args.same_source)
+            rows.append(row)
+            if args.json:
+                print(json.dumps(row), file=out)
+            else:
+                print(f"concurrency {concurrency}: {row['throughput_rps']:.2f} rps, p99 {row['p99_ms']:.0f} ms", file=out)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+    if not args.json:
+        print_table(rows, out)
+        print(f"LLM calls: {fake_llm.calls} ({fake_llm.errors} simulated errors); "
+              f"debug artifacts uploaded: {len(bucket.uploads)}", file=out)
+
+
+if __name__ == "__main__":
+    main()
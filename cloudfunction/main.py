@@ -7,19 +7,36 @@ from fastapi import FastAPI, Request, HTTPException, Body
 from pydantic import BaseModel
 from langchain_pipeline import parse_menu
 import uvicorn
-from firebase_utils import store_menu_json
+from firebase_utils import MENU_SECTIONS, read_menu_metadata, read_menu_page, read_subcategory_items, store_menu_json
 import os
 from firebase_admin import firestore
-from menu_parser_with_file import parse_menu_with_file
+from menu_parser_with_file import parse_menu_with_file, parse_menu_shard
+from menu_model import Menu, menu_to_json
+import settings
+import metrics
+import debug_artifacts
+import memory_budget
+import llm_scheduler
+import deadline
+from deadline import DeadlineExceeded
+from memory_budget import MemoryBudgetExceeded
+from cpu_pool import shutdown_pool
+from file_utils import file_content_hash
+from result_index import canonical_ocr, find_duplicate, record_result
+from single_flight import SingleFlight, flight_key
 
 app = FastAPI()
 
+# Concurrent duplicates (client retries, double submits) share one pipeline run
+text_parse_flights = SingleFlight("parse_menu")
+file_parse_flights = SingleFlight("parse_menu_from_file")
+
 class MenuRequest(BaseModel):
     menu_text: str
     docId: str = None
     sourceFilePath: str = None
     def __init__(self, **data):
-        print("MenuRequest __init__ called with:", data)
+        print("MenuRequest __init__ called with:", {k: v if k != "menu_text" else f"<{len(v or '')} chars>" for k, v in data.items()})
         super().__init__(**data)
 
 class FileMenuRequest(BaseModel):
@@ -27,19 +44,72 @@ class FileMenuRequest(BaseModel):
     docId: str = None
     ocr_data: str = None
     def __init__(self, **data):
-        print("FileMenuRequest __init__ called with:", data)
+        print("FileMenuRequest __init__ called with:", {k: v if k != "ocr_data" else f"<{len(v or '')} chars>" for k, v in data.items()})
         super().__init__(**data)
 
+class ShardMenuRequest(BaseModel):
+    sourceFilePath: str
+    ocr_data: str
+    firstPage: int
+    lastPage: int
+    # Time left of the coordinating request (default: REQUEST_DEADLINE_SECONDS)
+    deadlineSeconds: float = None
+
+@app.on_event("shutdown")
+def shutdown_background_work():
+    # Upload queued debug artifacts before the instance goes away
+    debug_artifacts.writer.flush()
+    shutdown_pool()
+
+def with_missing_sections(fn, *args, **kwargs):
+    """
+    fn's result and the sections the request deadline left unparsed, so
+    coalesced duplicates of a partial parse are flagged the same way.
+    """
+    return fn(*args, **kwargs), deadline.missing_sections()
+
+def partial_fields(menu, missing):
+    """
+    Stored document and response fields of a partial result; raises
+    DeadlineExceeded when the deadline left no section parsed.
+    """
+    if not missing:
+        return {}
+    if not menu_to_json(menu).get("data", {}).get("items"):
+        raise DeadlineExceeded(f"Request deadline reached before any section was parsed ({len(missing)} missing)")
+    print(f"Partial result: {len(missing)} sections missing:", missing)
+    metrics.incr("deadline_partial_results")
+    return {"partial": True, "missingSections": missing}
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Counters and per-stage token usage (prompt / cached / completion) for this worker process."""
+    return metrics.snapshot()
+
 @app.post("/parse-menu")
 def parse_menu_endpoint(request: MenuRequest):
     print(">>> PYTHON CLOUD RUN ENDPOINT HIT 11<<<")
-    print("parse_menu_endpoint called, request:", request)
+    print(f"parse_menu_endpoint called: docId={request.docId} sourceFilePath={request.sourceFilePath} menu_text={len(request.menu_text)} chars")
+    doc_id_no_ext = os.path.splitext(request.docId)[0] if request.docId else None
+    debug_raw_text_path = f'debug_langchain/{doc_id_no_ext}.raw.txt' if doc_id_no_ext else None
+    capture_token = debug_artifacts.start_capture(debug_raw_text_path)
+    memory_token = memory_budget.start_request()
+    tenant_token = llm_scheduler.set_tenant(llm_scheduler.tenant_for(request.docId, request.sourceFilePath))
+    deadline_token = deadline.start_request()
     try:
-        result = parse_menu(request.menu_text)
+        memory_budget.reserve(len(request.menu_text), "request body")
+        debug_artifacts.capture("request", "menu_text", request.menu_text)
+        index_key, reused = find_duplicate('menus_langchain', doc_id_no_ext, request.sourceFilePath, ocr_data=request.menu_text)
+        if reused:
+            return {"success": True, "deduplicated": True}
+        (result, missing), shared = text_parse_flights.do(
+            flight_key(request.sourceFilePath, canonical_ocr(request.menu_text)),
+            with_missing_sections, parse_menu, request.menu_text, as_model=True,
+        )
         # Guarantee only one object in the menu array
         if isinstance(result, list):
             # If result is a list (shouldn't be, but just in case), flatten to first object
@@ -47,27 +117,45 @@ def parse_menu_endpoint(request: MenuRequest):
         else:
             single_result = result
         # If docId is provided, store in Firestore
-        print("parse_menu_endpoint 1 result:", single_result)
-        print("parse_menu_endpoint 1 result:", request.docId)
+        print("parse_menu_endpoint result:", single_result if isinstance(single_result, Menu) else type(single_result).__name__)
+        if shared:
+            debug_artifacts.capture("note", "coalesced", "Result shared with a concurrent identical request")
+        partial = partial_fields(single_result, missing)
         if request.docId:
-            # Remove extension from docId if present
-            doc_id_no_ext = os.path.splitext(request.docId)[0]
             wrapped_result = {"menu": [single_result]}  # Always a single merged result
-            debug_raw_text_path = f'debug_langchain/{doc_id_no_ext}.raw.txt'
             doc_data = {
                 **wrapped_result,
                 'sourceFilePath': request.sourceFilePath,
                 'source': 'langchain',
                 'createdAt': firestore.SERVER_TIMESTAMP,
                 'debugRawTextPath': debug_raw_text_path,
+                **partial,
             }
-            print("doc_data :", doc_id_no_ext)
-            print("doc_data :", doc_data)
+            if debug_artifacts.capturing():
+                debug_artifacts.capture("result", doc_id_no_ext, menu_to_json(single_result))
+            print("Storing menu document:", doc_id_no_ext)
             store_menu_json(doc_id_no_ext, doc_data)
-        return {"success": True}
+            # A partial result is not reused for later identical requests
+            if index_key and not partial:
+                record_result(index_key, 'menus_langchain', doc_id_no_ext)
+        return {"success": True, **partial}
+    except DeadlineExceeded as e:
+        print("Request deadline reached in parse_menu_endpoint:", e)
+        debug_artifacts.capture("error", "parse_menu_endpoint", repr(e))
+        raise HTTPException(status_code=504, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        print("Rejected by the memory budget in parse_menu_endpoint:", e)
+        debug_artifacts.capture("error", "parse_menu_endpoint", repr(e))
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print("Exception in parse_menu_endpoint:", e)
+        debug_artifacts.capture("error", "parse_menu_endpoint", repr(e))
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        deadline.finish_request(deadline_token)
+        llm_scheduler.reset_tenant(tenant_token)
+        memory_budget.finish_request(memory_token, label=doc_id_no_ext or "parse_menu_endpoint")
+        debug_artifacts.finish_capture(capture_token)
 
 @app.post("/parse-menu-raw")
 async def parse_menu_raw(request: Request):
@@ -83,32 +171,132 @@ def test_echo(request: dict):
 
 @app.post("/parse-menu-from-file")
 def parse_menu_from_file_endpoint(request: FileMenuRequest = Body(...)):
-    print("parse_menu_from_file_endpoint called, request:", request)
+    print(f"parse_menu_from_file_endpoint called: docId={request.docId} sourceFilePath={request.sourceFilePath} ocr_data={len(request.ocr_data or '')} chars")
+    doc_id_no_ext = os.path.splitext(request.docId)[0] if request.docId else None
+    debug_raw_text_path = f'debug_langchain_vision/{doc_id_no_ext}.raw.txt' if doc_id_no_ext else None
+    capture_token = debug_artifacts.start_capture(debug_raw_text_path)
+    memory_token = memory_budget.start_request()
+    tenant_token = llm_scheduler.set_tenant(llm_scheduler.tenant_for(request.docId, request.sourceFilePath))
+    deadline_token = deadline.start_request()
     try:
-        result = parse_menu_with_file(request.sourceFilePath, request.ocr_data)
+        memory_budget.reserve(len(request.ocr_data or ""), "request body")
+        debug_artifacts.capture("request", "ocr_data", request.ocr_data or "")
+        index_key, reused = find_duplicate(
+            'menus_langchain_vision', doc_id_no_ext, request.sourceFilePath,
+            ocr_data=request.ocr_data, file_hash=lambda: file_content_hash(request.sourceFilePath),
+        )
+        if reused:
+            return {"success": True, "deduplicated": True}
+        (result, missing), shared = file_parse_flights.do(
+            flight_key(request.sourceFilePath, canonical_ocr(request.ocr_data)),
+            with_missing_sections, parse_menu_with_file, request.sourceFilePath, request.ocr_data,
+        )
         if isinstance(result, list):
             single_result = result[0] if result else {}
         else:
             single_result = result
-        print("parse_menu_from_file_endpoint result:", single_result)
+        print("parse_menu_from_file_endpoint result:", single_result if isinstance(single_result, Menu) else type(single_result).__name__)
+        if shared:
+            debug_artifacts.capture("note", "coalesced", "Result shared with a concurrent identical request")
+        partial = partial_fields(single_result, missing)
         if request.docId:
-            doc_id_no_ext = os.path.splitext(request.docId)[0]
             wrapped_result = {"menu": [single_result]}
-            debug_raw_text_path = f'debug_langchain_vision/{doc_id_no_ext}.raw.txt'
             doc_data = {
                 **wrapped_result,
                 'sourceFilePath': request.sourceFilePath,
                 'source': 'langchain',
                 'createdAt': firestore.SERVER_TIMESTAMP,
                 'debugRawTextPath': debug_raw_text_path,
+                **partial,
             }
-            print("doc_data :", doc_id_no_ext)
-            print("doc_data :", doc_data)
+            if debug_artifacts.capturing():
+                debug_artifacts.capture("result", doc_id_no_ext, menu_to_json(single_result))
+            print("Storing menu document:", doc_id_no_ext)
             store_menu_json(doc_id_no_ext, doc_data,collection_name='menus_langchain_vision')
-        return {"success": True}
+            if index_key and not partial:
+                record_result(index_key, 'menus_langchain_vision', doc_id_no_ext)
+        return {"success": True, **partial}
+    except DeadlineExceeded as e:
+        print("Request deadline reached in parse_menu_from_file_endpoint:", e)
+        debug_artifacts.capture("error", "parse_menu_from_file_endpoint", repr(e))
+        raise HTTPException(status_code=504, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        print("Rejected by the memory budget in parse_menu_from_file_endpoint:", e)
+        debug_artifacts.capture("error", "parse_menu_from_file_endpoint", repr(e))
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print("Exception in parse_menu_from_file_endpoint:", e)
+        debug_artifacts.capture("error", "parse_menu_from_file_endpoint", repr(e))
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        deadline.finish_request(deadline_token)
+        llm_scheduler.reset_tenant(tenant_token)
+        memory_budget.finish_request(memory_token, label=doc_id_no_ext or "parse_menu_from_file_endpoint")
+        debug_artifacts.finish_capture(capture_token)
+
+# Collections the read API may serve
+MENU_COLLECTIONS = ("menus_langchain", "menus_langchain_vision")
+
+def _check_menu_collection(collection):
+    if collection not in MENU_COLLECTIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown menu collection: {collection}")
+
+@app.get("/menus/{collection}/{doc_id}")
+def read_menu_endpoint(collection: str, doc_id: str):
+    """Menu document metadata with record and page counts per section."""
+    _check_menu_collection(collection)
+    metadata = read_menu_metadata(doc_id, collection)
+    if metadata is None:
+        raise HTTPException(status_code=404, detail="Menu not found")
+    return metadata
+
+@app.get("/menus/{collection}/{doc_id}/{section}")
+def read_menu_section_endpoint(collection: str, doc_id: str, section: str, page: int = 0, menuIndex: int = 0, subCatId: int = None):
+    """
+    One page of a menu section (category, sub_category or items). With
+    subCatId (items only), returns all items of that subcategory instead.
+    """
+    _check_menu_collection(collection)
+    if section not in MENU_SECTIONS:
+        raise HTTPException(status_code=404, detail=f"Unknown menu section: {section}")
+    if subCatId is not None:
+        if section != "items":
+            raise HTTPException(status_code=400, detail="subCatId is only supported for items")
+        records = read_subcategory_items(doc_id, subCatId, menuIndex, collection)
+        if records is None:
+            raise HTTPException(status_code=404, detail="Menu not found")
+        return {"records": records, "subCatId": subCatId}
+    result = read_menu_page(doc_id, section, page, menuIndex, collection)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Menu not found")
+    result["nextPage"] = page + 1 if page + 1 < result["pageCount"] else None
+    return result
+
+@app.post("/parse-menu-shard")
+def parse_menu_shard_endpoint(request: ShardMenuRequest = Body(...)):
+    """Parse one page range of a PDF for another instance; the caller merges and stores."""
+    print(f"parse_menu_shard_endpoint called for {request.sourceFilePath} pages {request.firstPage}-{request.lastPage}")
+    memory_token = memory_budget.start_request()
+    tenant_token = llm_scheduler.set_tenant(llm_scheduler.tenant_for(source_file_path=request.sourceFilePath))
+    deadline_token = deadline.start_request(request.deadlineSeconds)
+    try:
+        menu = parse_menu_shard(request.sourceFilePath, request.ocr_data, request.firstPage, request.lastPage)
+        # The coordinator merges the shard and flags what it left unparsed
+        return {"success": True, "menu": menu_to_json(menu), "missingSections": deadline.missing_sections()}
+    except DeadlineExceeded as e:
+        print("Request deadline reached in parse_menu_shard_endpoint:", e)
+        raise HTTPException(status_code=504, detail=str(e))
+    except MemoryBudgetExceeded as e:
+        print("Rejected by the memory budget in parse_menu_shard_endpoint:", e)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        print("Exception in parse_menu_shard_endpoint:", e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        deadline.finish_request(deadline_token)
+        llm_scheduler.reset_tenant(tenant_token)
+        memory_budget.finish_request(memory_token, label=f"{request.sourceFilePath} pages {request.firstPage}-{request.lastPage}")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080) 
\ No newline at end of file
+    # Each worker is a separate process with its own CPU pool; all read the same settings
+    uvicorn.run("main:app", host="0.0.0.0", port=settings.PORT, workers=settings.WEB_CONCURRENCY)
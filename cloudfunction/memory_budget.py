@@ -0,0 +1,126 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+import deadline
+import metrics
+import settings
+
+# Memory accounting of the request being handled; None outside a request
+_current = contextvars.ContextVar("memory_budget", default=None)
+
+
+class MemoryBudgetExceeded(Exception):
+    """A single buffer of the request does not fit in its memory budget."""
+
+
+class RequestMemory:
+    """
+    Bytes held by one request's large buffers (file bytes, page images, data
+    URLs, request bodies), its high-water mark and its budget (0: unlimited).
+    Shared by the request's worker threads through the copied context.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_use = 0
+        self.transient = 0  # bytes reserved through held(), released when the block ends
+        self.high_water = 0
+        self._cond = threading.Condition()
+
+    def reserve(self, nbytes, label, wait=False, transient=False):
+        """
+        Account nbytes held under label. Over budget, raises
+        MemoryBudgetExceeded; with wait=True it first waits while transient
+        buffers of the request (other pages in flight) are released, failing
+        only when nbytes cannot fit next to the request's long-lived buffers.
+        The wait ends with DeadlineExceeded when the request deadline passes.
+        """
+        with self._cond:
+            while self.budget and self.in_use + nbytes > self.budget:
+                if not wait or not self.transient:
+                    metrics.incr("memory_budget_exceeded")
+                    raise MemoryBudgetExceeded(
+                        f"{label} needs {nbytes} bytes; {self.in_use} of the request's "
+                        f"{self.budget}-byte memory budget are in use"
+                    )
+                left = deadline.remaining()
+                if left is not None and left <= 0:
+                    raise deadline.DeadlineExceeded(f"Request deadline reached while {label} waited for memory")
+                metrics.incr("memory_budget_waits")
+                self._cond.wait(left)
+            self.in_use += nbytes
+            if transient:
+                self.transient += nbytes
+            self.high_water = max(self.high_water, self.in_use)
+
+    def release(self, nbytes, transient=False):
+        with self._cond:
+            self.in_use = max(0, self.in_use - nbytes)
+            if transient:
+                self.transient = max(0, self.transient - nbytes)
+            self._cond.notify_all()
+
+
+def start_request(budget=None):
+    """Begin memory accounting for the current request. Returns a token for finish_request."""
+    return _current.set(RequestMemory(settings.REQUEST_MEMORY_BUDGET if budget is None else budget))
+
+
+def finish_request(token, label="request"):
+    """Stop accounting and report the request's high-water mark."""
+    memory = _current.get()
+    _current.reset(token)
+    if memory is not None and memory.high_water:
+        print(f"Memory high-water mark for {label}: {memory.high_water} bytes")
+        metrics.observe_max("request_memory_high_water_bytes", memory.high_water)
+
+
+def reserve(nbytes, label):
+    """Account a buffer kept until the end of the current request (no-op outside a request)."""
+    memory = _current.get()
+    if memory is not None:
+        memory.reserve(nbytes, label)
+
+
+def acquire(nbytes, label, wait=False):
+    """
+    Account a transient buffer that outlives the calling block, e.g. a page
+    image handed from one pipeline stage to the next. Returns a function that
+    releases it; calls after the first do nothing. Same waiting rules as held().
+    """
+    memory = _current.get()
+    if memory is None:
+        return lambda: None
+    memory.reserve(nbytes, label, wait, transient=True)
+    pending = [nbytes]
+
+    def release():
+        with memory._cond:
+            if not pending:
+                return
+            pending.clear()
+        memory.release(nbytes, transient=True)
+    return release
+
+
+@contextmanager
+def held(nbytes, label, wait=False):
+    """
+    Account nbytes for the duration of the block. Reserve everything the block
+    needs at once: waiting while holding another reservation can deadlock.
+    """
+    release = acquire(nbytes, label, wait)
+    try:
+        yield
+    finally:
+        release()
+
+
+def data_url_size(nbytes):
+    """Length of the base64 PNG data: URL for an image of nbytes."""
+    return 22 + (nbytes + 2) // 3 * 4
+
+
+def vision_call_size(nbytes):
+    """Transient memory of one vision call on an nbytes image: its data URL and the serialized request body."""
+    return 2 * data_url_size(nbytes)
@@ -0,0 +1,243 @@
+from collections import namedtuple
+
+# JSON schema for the stored menu shape ({"data": {"category", "sub_category", "items"}})
+MENU_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "data": {
+            "type": "object",
+            "properties": {
+                "category": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "title": {"type": "string"},
+                            "description": {"type": "string"}
+                        },
+                        "required": ["id", "title", "description"]
+                    }
+                },
+                "sub_category": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "catId": {"type": "integer"},
+                            "title": {"type": "string"},
+                            "description": {"type": "string"}
+                        },
+                        "required": ["id", "catId", "title", "description"]
+                    }
+                },
+                "items": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "itemId": {"type": "integer"},
+                            "subCatId": {"type": "integer"},
+                            "title": {"type": "string"},
+                            "description": {"type": "string"},
+                            "price": {"type": "number"},
+                            "variantAvailable": {"type": "integer"},
+                            "variants": {"type": "array"},
+                            "optionsAvailable": {"type": "integer"},
+                            "options": {"type": "array"}
+                        },
+                        "required": ["itemId", "subCatId", "title", "description", "price", "variantAvailable", "variants", "optionsAvailable", "options"]
+                    }
+                }
+            },
+            "required": ["category", "sub_category", "items"]
+        }
+    },
+    "required": ["data"]
+}
+
+# Marks a field the model output never had, so serialization can leave it out
+MISSING = object()
+
+# Normalized variant; tuples of these are interned per menu and shared between items
+Variant = namedtuple("Variant", ["title", "price", "description"])
+
+
+class _Record:
+    """
+    Base for slotted menu records. FIELDS maps slot name -> JSON key; keys the
+    model emitted that are not in FIELDS are kept in `extra`.
+    """
+    __slots__ = ("extra",)
+    FIELDS = ()
+
+    def __init__(self, **values):
+        for slot, _ in self.FIELDS:
+            setattr(self, slot, values.get(slot, MISSING))
+        self.extra = values.get("extra")
+
+    @classmethod
+    def from_json(cls, obj):
+        record = cls.__new__(cls)
+        present = 0
+        for slot, key in cls.FIELDS:
+            value = obj.get(key, MISSING)
+            setattr(record, slot, value)
+            if value is not MISSING:
+                present += 1
+        record.extra = None
+        if len(obj) > present:
+            keys = cls._keys()
+            record.extra = {k: v for k, v in obj.items() if k not in keys}
+        return record
+
+    @classmethod
+    def _keys(cls):
+        return {key for _, key in cls.FIELDS}
+
+    def to_json(self, variant_cache=None):
+        out = {}
+        for slot, key in self.FIELDS:
+            value = getattr(self, slot)
+            if value is not MISSING:
+                out[key] = value
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+    def __repr__(self):
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot, _ in self.FIELDS[:3])
+        return f"{type(self).__name__}({fields})"
+
+
+class Category(_Record):
+    __slots__ = ("id", "title", "description")
+    FIELDS = (("id", "id"), ("title", "title"), ("description", "description"))
+
+
+class SubCategory(_Record):
+    __slots__ = ("id", "cat_id", "title", "description")
+    FIELDS = (("id", "id"), ("cat_id", "catId"), ("title", "title"), ("description", "description"))
+
+
+class Item(_Record):
+    __slots__ = (
+        "item_id", "sub_cat_id", "title", "description", "price",
+        "variant_available", "variants", "options_available", "options",
+    )
+    FIELDS = (
+        ("item_id", "itemId"), ("sub_cat_id", "subCatId"), ("title", "title"),
+        ("description", "description"), ("price", "price"),
+        ("variant_available", "variantAvailable"), ("variants", "variants"),
+        ("options_available", "optionsAvailable"), ("options", "options"),
+    )
+
+    def has_variants(self):
+        return self.variants is not MISSING and bool(self.variants)
+
+    def to_json(self, variant_cache=None):
+        out = super().to_json()
+        if isinstance(self.variants, tuple):
+            # Interned variant table: serialize once per table, not once per item
+            if variant_cache is None:
+                variant_cache = {}
+            key = id(self.variants)
+            if key not in variant_cache:
+                variant_cache[key] = [
+                    {"variantTitle": v.title, "price": v.price, "description": v.description}
+                    for v in self.variants
+                ]
+            out["variants"] = variant_cache[key]
+        return out
+
+
+class Menu:
+    """
+    Compact in-memory menu used between merge and storage.
+    Records are slotted objects that reference the model output's nested values
+    instead of copying them, and normalized variant lists are interned so items
+    sharing sizes/prices share one tuple. Convert to the stored JSON shape with
+    to_json() only when writing to Firestore or sending the menu to a model.
+    """
+    __slots__ = ("categories", "sub_categories", "items", "_variant_table")
+
+    def __init__(self, categories=None, sub_categories=None, items=None):
+        self.categories = categories if categories is not None else []
+        self.sub_categories = sub_categories if sub_categories is not None else []
+        self.items = items if items is not None else []
+        self._variant_table = {}
+
+    @classmethod
+    def from_json(cls, menu_json):
+        data = menu_json.get("data", menu_json) if menu_json else {}
+        return cls(
+            [Category.from_json(c) for c in data.get("category", [])],
+            [SubCategory.from_json(s) for s in data.get("sub_category", [])],
+            [Item.from_json(i) for i in data.get("items", [])],
+        )
+
+    def to_json(self):
+        variant_cache = {}
+        return {
+            "data": {
+                "category": [c.to_json() for c in self.categories],
+                "sub_category": [s.to_json() for s in self.sub_categories],
+                "items": [i.to_json(variant_cache) for i in self.items],
+            }
+        }
+
+    def intern_variants(self, variants):
+        """Return the menu's shared tuple for this sequence of Variant records."""
+        key = tuple(variants)
+        return self._variant_table.setdefault(key, key)
+
+    def items_by_subcat(self):
+        """Map subcategory id -> list of its items, in menu order."""
+        grouped = {}
+        for item in self.items:
+            grouped.setdefault(item.sub_cat_id, []).append(item)
+        return grouped
+
+    def validate(self, schema=MENU_SCHEMA):
+        """
+        Check required fields and types against the menu schema without building
+        the JSON tree. Raises ValueError describing the first violation.
+        """
+        sections = schema["properties"]["data"]["properties"]
+        for section, records in (("category", self.categories), ("sub_category", self.sub_categories), ("items", self.items)):
+            item_schema = sections[section]["items"]
+            properties = item_schema["properties"]
+            required = set(item_schema.get("required", []))
+            for index, record in enumerate(records):
+                for slot, key in record.FIELDS:
+                    value = getattr(record, slot)
+                    if value is MISSING:
+                        if key in required:
+                            raise ValueError(f"'{key}' is a required property (data.{section}[{index}])")
+                        continue
+                    expected = properties.get(key, {}).get("type")
+                    if expected and not _matches_type(value, expected):
+                        raise ValueError(f"{value!r} is not of type '{expected}' (data.{section}[{index}].{key})")
+
+    def __repr__(self):
+        return f"Menu(categories={len(self.categories)}, sub_categories={len(self.sub_categories)}, items={len(self.items)})"
+
+
+def _matches_type(value, expected):
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool) or (isinstance(value, float) and value.is_integer())
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if expected == "string":
+        return isinstance(value, str)
+    if expected == "array":
+        return isinstance(value, (list, tuple))
+    if expected == "object":
+        return isinstance(value, dict)
+    return True
+
+
+def menu_to_json(menu):
+    """Return the stored JSON shape for a Menu, passing plain dicts through."""
+    return menu.to_json() if isinstance(menu, Menu) else menu
@@ -3,118 +3,261 @@ import base64
 import openai
 import json
 import re
-from file_utils import download_file_from_firebase, extract_data_from_excel
-from langchain_pipeline import parse_menu
+import requests
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import download_file_from_firebase, extract_data_from_excel, extract_text_from_pdf, file_size, has_text_layer
+from langchain_pipeline import canonicalize_subcat, parse_menu, merge_menu_json, rule_based_result
+from menu_model import MENU_SCHEMA, MISSING, Category, Item, Menu, SubCategory, Variant
+from json_salvage import parse_model_json, strip_code_fences
+from adaptive_chunking import TRUNCATED_FINISH_REASON, ChunkSizer, estimate_tokens, payload_tail, serialize_record
 from jsonschema import validate, ValidationError
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
 from io import BytesIO
+import settings
+import metrics
+import debug_artifacts
+from reconciliation import reconcile_menu
+from cpu_pool import run_cpu
+from pipeline_executor import Pipeline, Stage
+import memory_budget
+import deadline
+from llm_scheduler import llm_slot
+from prompts import VISION_SYSTEM_PROMPT, VISION_REFINE_SYSTEM_PROMPT
+from ocr_layout import column_layout, looks_like_section_header, merge_ocr_lines
 
-# Load system prompt from file
-PROMPT_DIR = os.path.dirname(os.path.abspath(__file__))
-SYSTEM_PROMPT_PATH = os.path.join(PROMPT_DIR, 'system_prompts_vision.txt')
-with open(SYSTEM_PROMPT_PATH, 'r', encoding='utf-8') as f:
-    SYSTEM_PROMPT = f.read()
+def image_to_data_url(image_bytes):
+    return "data:image/png;base64," + base64.b64encode(image_bytes).decode("ascii")
 
-def call_gpt4_vision_on_chunk(chunk_json, image_bytes, openai_api_key=None):
+def encode_image(image_bytes):
+    """
+    Base64-encode a PNG page as a data: URL. Encoding is a fast C routine, so
+    it runs inline; sending the page to the CPU pool would only add copies.
+    An already encoded data URL is passed through, so a page is encoded once
+    and the URL shared by all of its vision calls.
+    """
+    if isinstance(image_bytes, str):
+        return image_bytes
+    return image_to_data_url(image_bytes)
+
+# Client without retries for vision calls under a request deadline, created on first use
+_no_retry_client = None
+_no_retry_client_lock = threading.Lock()
+
+def chat_completions():
+    """
+    The chat completions API for one vision call: openai.chat.completions, or
+    under a request deadline a client without retries (see deadline.call_retries).
+    """
+    global _no_retry_client
+    if deadline.call_retries(None) is None:
+        return openai.chat.completions
+    with _no_retry_client_lock:
+        if _no_retry_client is None:
+            _no_retry_client = openai.OpenAI(api_key=openai.api_key, max_retries=0)
+        return _no_retry_client.chat.completions
+
+def call_gpt4_vision_on_chunk(chunk_json, image_bytes, openai_api_key=None, return_finish_reason=False):
+    """image_bytes: PNG bytes or their data URL from encode_image."""
     if openai_api_key:
         openai.api_key = openai_api_key
-    image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    image_data_url = f"data:image/png;base64,{image_b64}"
-    response = openai.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": chunk_json},
-                    {"type": "image_url", "image_url": {"url": image_data_url}},
-                ],
-            },
-        ],
-        max_tokens=4096,
-        temperature=0,
-        top_p=1,
-    )
-    return response.choices[0].message.content
+    image_data_url = encode_image(image_bytes)
+    debug_artifacts.capture("prompt", "vision_chunk", chunk_json)
+    with llm_slot(chunk_json):
+        response = chat_completions().create(
+            model="gpt-4.1-mini",
+            messages=[
+                {"role": "system", "content": VISION_SYSTEM_PROMPT},
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": chunk_json},
+                        {"type": "image_url", "image_url": {"url": image_data_url}},
+                    ],
+                },
+            ],
+            max_tokens=4096,
+            temperature=0,
+            top_p=1,
+            timeout=deadline.call_timeout("vision chunk"),
+        )
+    metrics.record_token_usage("vision_chunk", response.usage)
+    choice = response.choices[0]
+    debug_artifacts.capture("raw_output", "vision_chunk", choice.message.content or "")
+    if return_finish_reason:
+        return choice.message.content, choice.finish_reason
+    return choice.message.content
 
-def chunk_ocr_by_sections(ocr_data, max_items_per_chunk=60):
+def split_section_chunk(chunk):
+    """Split a section chunk into two halves by items, keeping the section title."""
+    items = chunk["items"]
+    if len(items) < 2:
+        return None
+    mid = len(items) // 2
+    return [
+        {"section_title": chunk["section_title"], "items": items[:mid]},
+        {"section_title": chunk["section_title"], "items": items[mid:]},
+    ]
+
+def parse_vision_chunk_adaptive(chunk, image_bytes, sizer, openai_api_key=None, depth=0, max_depth=4):
+    """
+    Run one section chunk through the vision model. If the completion is cut off
+    at max_tokens, the items the model did not finish are split in halves and
+    re-run, and the sizer's per-menu item limit is lowered for later chunks.
+    Returns a list of parsed results.
+    """
+    chunk_json = json.dumps({
+        "section_title": chunk["section_title"],
+        "items": chunk["items"]
+    }, ensure_ascii=False)
+    result, finish_reason = call_gpt4_vision_on_chunk(chunk_json, image_bytes, openai_api_key, return_finish_reason=True)
+    truncated = finish_reason == TRUNCATED_FINISH_REASON
+    try:
+        parsed, report = parse_model_json(result)
+    except ValueError as e:
+        print(f"Error parsing vision model output for section {chunk['section_title']!r}:", e)
+        parsed, report = None, None
+        if not truncated:
+            return []
+    if report is not None:
+        print(f"Salvaged partial vision output for section {chunk['section_title']!r}:", report)
+        truncated = truncated or report["truncated"]
+    if not truncated:
+        return [parsed]
+
+    results = []
+    remainder = chunk["items"]
+    if report is not None and any(report["recovered"].values()):
+        results.append(parsed)
+        remainder = payload_tail(chunk["items"], report["last_item_title"])
+        if remainder is None:
+            print(f"Could not locate the unparsed tail of section {chunk['section_title']!r}; {report['dropped']} entries lost.")
+            return results
+        if not remainder:
+            return results
+    completed = len(chunk["items"]) - len(remainder) if remainder is not chunk["items"] else None
+    sizer.observe_truncation(len(chunk["items"]), completed)
+    rest = {"section_title": chunk["section_title"], "items": remainder}
+    halves = split_section_chunk(rest) if depth < max_depth else None
+    if not halves:
+        print(f"Vision output for section {chunk['section_title']!r} truncated; {len(remainder)} OCR items left unparsed.")
+        return results
+    print(f"Vision output for section {chunk['section_title']!r} truncated; re-running {len(remainder)} items as {len(halves)} halves")
+    for half in halves:
+        for piece in sizer.fit(half):
+            results.extend(parse_vision_chunk_adaptive(piece, image_bytes, sizer, openai_api_key, depth + 1, max_depth))
+    return results
+
+def chunk_ocr_by_sections(ocr_data, max_items_per_chunk=60, max_tokens=None):
     """
     Improved: Chunk OCR data by detected section/category headers.
-    Each chunk will contain all items under one or more sections/categories.
-    Section headers are not included as items. Each chunk is a dict with section_title and items.
+    Positioned OCR is first put in column reading order, so a section never
+    spans two columns; a column that starts without a header continues the
+    previous section. Each chunk holds the items of one section, split so it
+    stays within max_items_per_chunk and max_tokens (estimated from the
+    serialized items). Section headers are not included as items. Each chunk
+    is a dict with section_title and items.
     """
-    import re
     if not isinstance(ocr_data, list):
         return [ocr_data]
+    if not ocr_data:
+        return []
 
-    section_indices = []
-    section_titles = []
+    columns = None
+    if settings.OCR_COLUMN_LAYOUT:
+        ocr_data, columns = column_layout(ocr_data)
+        if columns is not None and max(columns) > 0:
+            print(f"Layout: {max(columns) + 1} columns detected")
+
+    # (section_title, items) in reading order
+    sections = []
+    title = ocr_data[0].get('text', '').strip()
+    items = []
+    items_column = None
     for i, item in enumerate(ocr_data):
         text = item.get('text', '').strip()
-        # Improved heuristics for section headers
-        if (
-            text.isupper() and len(text) > 2 and len(text.split()) < 6
-            and not re.search(r'\$|\d+\.\d{2}|HALF|WHOLE|SMALL|LARGE', text)
-        ) or re.match(r'^(starters|appetizers|main course|desserts|beverages|drinks|sides|salads|soups|specials|breakfast|lunch|dinner)s?$', text, re.I):
-            section_indices.append(i)
-            section_titles.append(text)
-    if not section_indices or section_indices[0] != 0:
-        section_indices = [0] + section_indices
-        section_titles = [ocr_data[0].get('text', '').strip()] + section_titles
-    section_indices.append(len(ocr_data))
+        column = columns[i] if columns is not None else None
+        if i == 0 or looks_like_section_header(text):
+            if i > 0:
+                sections.append((title, items))
+            title, items = text, []
+            continue
+        if items and column != items_column:
+            # Section continues in the next column: same title, new chunk
+            sections.append((title, items))
+            items = []
+        items.append(item)
+        items_column = column
+    sections.append((title, items))
 
     chunks = []
-    for idx in range(len(section_indices) - 1):
-        section = ocr_data[section_indices[idx]:section_indices[idx+1]]
-        # Remove the section header from items
-        if section:
-            section_header = section[0]
-            items = section[1:]
-            # If section is too large, split by size
-            for i in range(0, len(items), max_items_per_chunk):
-                chunk = {
-                    "section_title": section_header.get('text', '').strip(),
-                    "items": items[i:i+max_items_per_chunk]
-                }
-                chunks.append(chunk)
+    for section_title, items in sections:
+        for part in split_by_budget(items, max_items_per_chunk, max_tokens):
+            chunks.append({"section_title": section_title, "items": part})
     return chunks
 
+def split_by_budget(items, max_items, max_tokens=None):
+    """Split a section's items into runs of at most max_items and max_tokens."""
+    parts = []
+    current = []
+    current_tokens = 0
+    for item in items:
+        tokens = estimate_tokens(serialize_record(item))
+        if current and (len(current) >= max_items or (max_tokens and current_tokens + tokens > max_tokens)):
+            parts.append(current)
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        parts.append(current)
+    return parts
+
 def parse_menu_with_gpt4_vision(ocr_data, image_bytes, openai_api_key=None):
     # Parse OCR data if it's a string
     if isinstance(ocr_data, str):
         ocr_data = json.loads(ocr_data)
+    # Compact line records for the prompts; robust_ocr_postprocessing below still
+    # reads the original fragments
+    ocr_lines = merge_ocr_lines(ocr_data) if settings.OCR_LINE_MERGE else ocr_data
     # Improved chunking: Chunk by logical sections/categories
-    chunks = chunk_ocr_by_sections(ocr_data, max_items_per_chunk=60)
+    chunks = chunk_ocr_by_sections(ocr_lines, max_items_per_chunk=60, max_tokens=settings.VISION_CHUNK_MAX_TOKENS)
+    # Learns this menu's safe items-per-chunk from truncated completions
+    sizer = ChunkSizer(60, size_fn=lambda c: len(c["items"]), split_fn=split_section_chunk)
     all_results = []
+    # One data URL for the page, shared by every section chunk's call
+    image_bytes = encode_image(image_bytes)
     for chunk in chunks:
-        # Compose chunk JSON with section title and items
-        chunk_json = json.dumps({
-            "section_title": chunk["section_title"],
-            "items": chunk["items"]
-        }, ensure_ascii=False)
-        result = call_gpt4_vision_on_chunk(chunk_json, image_bytes, openai_api_key)
-        # Remove markdown code block markers if present
-        cleaned_for_json = result.strip().removeprefix('```json').removesuffix('```').strip()
-        try:
-            parsed = json.loads(cleaned_for_json)
-            all_results.append(parsed)
-        except Exception as e:
-            print("Error parsing vision model output:", e)
-            continue
-    # Use parse_menu to merge results (it already merges multiple results)
-    merged = parse_menu(all_results)
+        for piece in sizer.fit(chunk):
+            # Simple sections the rule-based parser explains fully skip the vision call
+            rule_result = rule_based_result(piece["items"], label=f"section {piece['section_title']!r}", section_title=piece["section_title"])
+            if rule_result is not None:
+                all_results.append(rule_result)
+                continue
+            results = deadline.run_section(
+                f"section {piece['section_title']!r}", parse_vision_chunk_adaptive,
+                piece, image_bytes, sizer, openai_api_key,
+            )
+            all_results.extend(results or [])
+    # Merge the per-chunk results directly; they are already parsed menu JSON
+    menu = merge_menu_json(all_results)
+    menu.validate()
+    merged = menu.to_json()
+    debug_artifacts.capture("merged", "vision_chunks", merged)
     # Post-processing: Remove hallucinated subcategories
     merged = filter_hallucinated_subcategories(merged)
     # Merge single-item subcategories into parent (e.g., DESSERTS)
     merged = merge_single_item_subcategories(merged, parent_subcat_title="DESSERTS")
     # OCR-aware postprocessing for look-ahead price blocks and inline prices
-    merged = robust_ocr_postprocessing(merged, ocr_data)
-    # Generalized: propagate shared variants and extract variants from descriptions for all subcategories
-    merged = extract_variants_from_description_all(merged)
-    merged = propagate_shared_variants_all(merged)
-    merged = reindex_menu_ids(merged)
-    return merged
+    merged = run_cpu(robust_ocr_postprocessing, merged, ocr_data)
+    # Generalized: propagate shared variants and extract variants from descriptions for all subcategories.
+    # These stages run on the compact model; it is serialized again at store time.
+    menu = Menu.from_json(merged)
+    menu = extract_variants_from_description_all(menu)
+    menu = propagate_shared_variants_all(menu)
+    menu = reindex_menu_ids(menu)
+    return menu
 
 def filter_hallucinated_subcategories(menu_json):
     """
@@ -177,258 +320,453 @@ def normalize_price(price):
     except Exception:
         return 0.0
 
+def normalize_variants(menu, variants):
+    """Normalize variant titles and prices, returning the menu's shared tuple for the result."""
+    normalized = []
+    for v in variants:
+        if isinstance(v, Variant):
+            normalized.append(Variant(normalize_variant_title(v.title), normalize_price(v.price), v.description))
+        else:
+            normalized.append(Variant(normalize_variant_title(v["variantTitle"]), normalize_price(v["price"]), v.get("description", "")))
+    return menu.intern_variants(normalized)
+
 def propagate_shared_variants_all(menu_json):
     """
     For all subcategories, if any item has variants, propagate those variants to all items in the subcategory that are missing them.
-    Normalize variant titles and prices.
+    Normalize variant titles and prices. Items with the same variants share one interned tuple.
+    Accepts a Menu (returned as-is) or menu JSON (returned as new menu JSON).
     """
-    if not menu_json or "data" not in menu_json or "sub_category" not in menu_json["data"]:
+    if isinstance(menu_json, Menu):
+        menu = menu_json
+    elif not menu_json or "data" not in menu_json or "sub_category" not in menu_json["data"]:
         return menu_json
-    subcats = menu_json["data"]["sub_category"]
-    items = menu_json["data"]["items"]
-    for subcat in subcats:
-        subcat_id = subcat["id"]
-        # Find all variants in this subcategory
-        all_variants = []
-        for item in items:
-            if item["subCatId"] == subcat_id and item.get("variants") and len(item["variants"]) > 0:
-                all_variants = item["variants"]
-                break
-        # Normalize variant titles and prices
-        all_variants = [
-            {"variantTitle": normalize_variant_title(v["variantTitle"]), "price": normalize_price(v["price"]), "description": v.get("description", "")}
-            for v in all_variants
-        ]
-        for item in items:
-            if item["subCatId"] == subcat_id:
-                # Normalize existing variants
-                if item.get("variants") and len(item["variants"]) > 0:
-                    item["variants"] = [
-                        {"variantTitle": normalize_variant_title(v["variantTitle"]), "price": normalize_price(v["price"]), "description": v.get("description", "")}
-                        for v in item["variants"]
-                    ]
-                    item["variantAvailable"] = 1
-                    item["price"] = 0
-                # Propagate if missing
-                elif all_variants:
-                    item["variants"] = all_variants
-                    item["variantAvailable"] = 1
-                    item["price"] = 0
-    return menu_json
+    else:
+        menu = Menu.from_json(menu_json)
+    items_by_subcat = menu.items_by_subcat()
+    for subcat in menu.sub_categories:
+        subcat_items = items_by_subcat.get(subcat.id, [])
+        # Find the first variants in this subcategory
+        all_variants = next((item.variants for item in subcat_items if item.has_variants()), ())
+        all_variants = normalize_variants(menu, all_variants)
+        for item in subcat_items:
+            # Normalize existing variants
+            if item.has_variants():
+                item.variants = normalize_variants(menu, item.variants)
+                item.variant_available = 1
+                item.price = 0
+            # Propagate if missing
+            elif all_variants:
+                item.variants = all_variants
+                item.variant_available = 1
+                item.price = 0
+    return menu if menu is menu_json else menu.to_json()
 
 def extract_variants_from_description_all(menu_json):
     """
     For all subcategories, if an item has a description like 'PINT $2.00 QUART $3.00',
     extract these as variants and clear the description. Normalize titles and prices.
+    Accepts a Menu (returned as-is) or menu JSON (returned as new menu JSON).
     """
-    if not menu_json or "data" not in menu_json or "sub_category" not in menu_json["data"]:
+    if isinstance(menu_json, Menu):
+        menu = menu_json
+    elif not menu_json or "data" not in menu_json or "sub_category" not in menu_json["data"]:
         return menu_json
-    subcats = menu_json["data"]["sub_category"]
-    items = menu_json["data"]["items"]
-    for subcat in subcats:
-        subcat_id = subcat["id"]
-        for item in items:
-            if item["subCatId"] == subcat_id and item.get("description"):
-                desc = item["description"]
-                # Look for patterns like 'PINT $2.00 QUART $3.00'
-                matches = re.findall(r'(\w+)\s*\$([0-9]+(?:\.[0-9]{1,2})?)', desc)
-                if matches:
-                    item["variants"] = [
-                        {"variantTitle": normalize_variant_title(m[0]), "price": normalize_price(m[1]), "description": ""} for m in matches
-                    ]
-                    item["variantAvailable"] = 1
-                    item["price"] = 0
-                    item["description"] = ""
-    return menu_json
+    else:
+        menu = Menu.from_json(menu_json)
+    items_by_subcat = menu.items_by_subcat()
+    for subcat_id in {subcat.id for subcat in menu.sub_categories}:
+        for item in items_by_subcat.get(subcat_id, []):
+            desc = item.description
+            if desc is MISSING or not desc:
+                continue
+            # Look for patterns like 'PINT $2.00 QUART $3.00'
+            matches = re.findall(r'(\w+)\s*\$([0-9]+(?:\.[0-9]{1,2})?)', desc)
+            if matches:
+                item.variants = menu.intern_variants(
+                    Variant(normalize_variant_title(m[0]), normalize_price(m[1]), "") for m in matches
+                )
+                item.variant_available = 1
+                item.price = 0
+                item.description = ""
+    return menu if menu is menu_json else menu.to_json()
 
-def pdf_to_images(pdf_bytes):
+def rasterize_pdf(pdf_bytes, first_page=None, last_page=None):
     """
     Convert PDF bytes to a list of image bytes (PNG format).
+    first_page/last_page (1-based, inclusive) limit rasterizing to a page range.
     Returns a list of bytes objects.
     """
-    pil_images = convert_from_bytes(pdf_bytes)
+    pil_images = convert_from_bytes(pdf_bytes, first_page=first_page, last_page=last_page)
     image_bytes_list = []
-    for img in pil_images:
+    while pil_images:
+        # Free each decoded page as soon as it is encoded
+        img = pil_images.pop(0)
         buf = BytesIO()
         img.save(buf, format='PNG')
+        img.close()
         image_bytes_list.append(buf.getvalue())
     return image_bytes_list
 
+def pdf_to_images(pdf_bytes, first_page=None, last_page=None):
+    """Rasterize a PDF (or a page range of it) to PNG page bytes in the CPU process pool."""
+    return run_cpu(rasterize_pdf, pdf_bytes, first_page, last_page)
+
+def pdf_page_count(pdf_bytes):
+    return pdfinfo_from_bytes(pdf_bytes)["Pages"]
+
+def shard_page_ranges(page_count, pages_per_shard):
+    """Split pages 1..page_count into (first_page, last_page) ranges of at most pages_per_shard pages."""
+    pages_per_shard = max(1, pages_per_shard)
+    return [
+        (first, min(first + pages_per_shard - 1, page_count))
+        for first in range(1, page_count + 1, pages_per_shard)
+    ]
+
+def merge_page_results(results):
+    """
+    Global merge of per-page or per-shard menus into one Menu.
+    Categories are deduplicated by title and subcategories by (merged category,
+    canonical title) across all inputs; each input's own catId/subCatId
+    references are remapped to the merged ids before the final reindex, so ids
+    from different pages never collide.
+    """
+    merged = Menu()
+    cat_ids = {}
+    subcat_ids = {}
+    for res in results:
+        if isinstance(res, Menu):
+            res = res.to_json()
+        if not isinstance(res, dict):
+            continue
+        data = res.get("data", res)
+        local_cat_ids = {}
+        for cat in data.get("category", []):
+            key = cat["title"].strip().lower()
+            if key not in cat_ids:
+                new_cat = Category.from_json(cat)
+                new_cat.id = len(merged.categories) + 1
+                cat_ids[key] = new_cat.id
+                merged.categories.append(new_cat)
+            local_cat_ids.setdefault(cat.get("id"), cat_ids[key])
+        local_subcat_ids = {}
+        for sub in data.get("sub_category", []):
+            cat_id = local_cat_ids.get(sub.get("catId"), 1)
+            title = canonicalize_subcat(sub["title"])
+            key = (cat_id, title.lower())
+            if key not in subcat_ids:
+                new_sub = SubCategory.from_json(sub)
+                new_sub.id = len(merged.sub_categories) + 1
+                new_sub.cat_id = cat_id
+                new_sub.title = title
+                subcat_ids[key] = new_sub.id
+                merged.sub_categories.append(new_sub)
+            local_subcat_ids.setdefault(sub.get("id"), subcat_ids[key])
+        for item in data.get("items", []):
+            new_item = Item.from_json(item)
+            new_item.sub_cat_id = local_subcat_ids.get(item.get("subCatId"), 1)
+            merged.items.append(new_item)
+    return reindex_menu_ids(merged)
+
+def pdf_text_pages(pdf_bytes, first_page, last_page):
+    """
+    Positioned text-layer words for pages first_page..last_page, or None for a
+    page without a usable text layer (scanned pages).
+    """
+    if not settings.PDF_TEXT_LAYER:
+        return [None] * (last_page - first_page + 1)
+    try:
+        pages = run_cpu(extract_text_from_pdf, pdf_bytes, first_page, last_page)
+    except Exception as e:
+        print(f"Text layer extraction failed for pages {first_page}-{last_page}:", e)
+        return [None] * (last_page - first_page + 1)
+    return [words if has_text_layer(words) else None for words in pages]
+
+def parse_pdf_page_range(pdf_bytes, page_ocr_list, first_page, last_page, openai_api_key=None):
+    """
+    Parse one shard of a PDF. Pages with an embedded text layer go straight to
+    parse_menu from their positioned words; only scanned pages are rasterized
+    and run through the two-step parse with their OCR from page_ocr_list.
+    Pages stream through a rasterize -> parse pipeline, so the next page is
+    rasterized while earlier ones wait on the model. Pages the request deadline
+    leaves no time for are recorded as missing sections.
+    Returns the shard's merged Menu.
+    """
+    print(f"Parsing PDF pages {first_page}-{last_page}")
+    text_pages = pdf_text_pages(pdf_bytes, first_page, last_page)
+    # Releases of the page images reserved by rasterize_page; any a failed or
+    # stopped run leaves behind are released when the run ends
+    releases = []
+
+    def rasterize_page(page):
+        page_number, page_ocr, page_words = page
+        if page_words:
+            print(f"Page {page_number}: using the embedded text layer ({len(page_words)} words)")
+            metrics.incr("pdf_pages_text_layer")
+            return page_number, page_words, None, None
+        if not page_ocr:
+            print(f"Page {page_number}: no text layer and no OCR data, skipped")
+            metrics.incr("pdf_pages_skipped")
+            return None
+        metrics.incr("pdf_pages_rasterized")
+        page_img = pdf_to_images(pdf_bytes, page_number, page_number)[0]
+        # The page image plus its vision call, reserved here so images waiting in
+        # the parse queue count too; over budget the page waits for other pages
+        # of the request to finish
+        footprint = len(page_img) + memory_budget.vision_call_size(len(page_img))
+        release = memory_budget.acquire(footprint, f"page {page_number}", wait=True)
+        releases.append(release)
+        return page_number, page_ocr, page_img, release
+
+    def parse_page(page):
+        page_number, page_input, page_img, release = page
+        if page_img is None:
+            return parse_menu(page_input, as_model=True, label=f"page {page_number}")
+        try:
+            return parse_menu_two_step(page_input, page_img, openai_api_key, label=f"page {page_number}")
+        finally:
+            release()
+
+    def page_section(fn):
+        # A page the deadline stops is dropped from the pipeline and recorded
+        return lambda page: deadline.run_section(f"page {page[0]}", fn, page)
+
+    pipeline = Pipeline("pdf_pages", [
+        Stage("rasterize", page_section(rasterize_page), workers=settings.PDF_RASTER_WORKERS,
+              max_concurrency=settings.PDF_RASTER_CONCURRENCY),
+        Stage("parse", page_section(parse_page), workers=settings.PDF_PARSE_WORKERS,
+              max_concurrency=settings.PDF_PARSE_CONCURRENCY),
+    ], queue_size=settings.PIPELINE_QUEUE_SIZE)
+    pages = zip(range(first_page, last_page + 1), page_ocr_list, text_pages)
+    try:
+        results = pipeline.run(pages)
+    finally:
+        for release in releases:
+            release()
+    return merge_page_results(results)
+
+def parse_remote_shard(source_file_path, page_ocr_list, first_page, last_page):
+    """
+    Send one page range to another instance's /parse-menu-shard endpoint. The
+    shard gets the request's remaining time, less a margin to send its partial
+    result back; the sections it leaves unparsed are recorded here.
+    """
+    body = {
+        "sourceFilePath": source_file_path,
+        "ocr_data": json.dumps(page_ocr_list, ensure_ascii=False),
+        "firstPage": first_page,
+        "lastPage": last_page,
+    }
+    timeout = settings.PDF_SHARD_TIMEOUT
+    left = deadline.remaining()
+    if left is not None:
+        body["deadlineSeconds"] = max(left - settings.DEADLINE_MIN_CALL_SECONDS, 0)
+        timeout = min(timeout, left)
+    response = requests.post(settings.PDF_SHARD_URL, json=body, timeout=timeout)
+    response.raise_for_status()
+    result = response.json()
+    for section in result.get("missingSections", []):
+        deadline.note_missing(section)
+    return result["menu"]
+
+def parse_pdf_sharded(source_file_path, pdf_bytes, ocr_pages, openai_api_key=None):
+    """
+    Split a PDF into page ranges of PDF_PAGES_PER_SHARD pages, parse the ranges
+    concurrently (locally, or on other instances when PDF_SHARD_URL is set) and
+    merge them globally.
+    """
+    ranges = shard_page_ranges(len(ocr_pages), settings.PDF_PAGES_PER_SHARD)
+    print(f"PDF with {len(ocr_pages)} pages split into {len(ranges)} shards")
+
+    def run_shard(page_range):
+        first_page, last_page = page_range
+        page_ocr_list = ocr_pages[first_page - 1:last_page]
+        if settings.PDF_SHARD_URL and len(ranges) > 1 and not deadline.expired():
+            try:
+                return parse_remote_shard(source_file_path, page_ocr_list, first_page, last_page)
+            except Exception as e:
+                print(f"Remote shard for pages {first_page}-{last_page} failed, parsing locally:", e)
+        return parse_pdf_page_range(pdf_bytes, page_ocr_list, first_page, last_page, openai_api_key)
+
+    if len(ranges) == 1:
+        shard_results = [run_shard(ranges[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=settings.PDF_SHARD_CONCURRENCY) as executor:
+            # Each shard runs in the request's context so its debug artifacts are captured
+            futures = [executor.submit(contextvars.copy_context().run, run_shard, r) for r in ranges]
+            shard_results = [f.result() for f in futures]
+    return merge_page_results(shard_results)
+
+def parse_menu_shard(source_file_path, ocr_data, first_page, last_page):
+    """Parse one page range of a PDF for a coordinating instance; returns the shard's Menu."""
+    memory_budget.reserve(file_size(source_file_path), "source file")
+    pdf_bytes = download_file_from_firebase(source_file_path)
+    if isinstance(ocr_data, str):
+        ocr_data = json.loads(ocr_data)
+    return parse_pdf_page_range(pdf_bytes, ocr_data, first_page, last_page, os.getenv("OPENAI_API_KEY"))
+
 def parse_menu_with_file(source_file_path, ocr_data=None):
     file_bytes = None
     if source_file_path.lower().endswith((".png", ".jpg", ".jpeg", ".pdf")):
+        # Reserved from the blob's metadata, so an over-budget file is rejected before it is downloaded
+        memory_budget.reserve(file_size(source_file_path), "source file")
         file_bytes = download_file_from_firebase(source_file_path)
     openai_api_key = os.getenv("OPENAI_API_KEY")
     if ocr_data and file_bytes:
         if source_file_path.lower().endswith(".pdf"):
-            # Convert PDF to images and process each page
-            image_bytes_list = pdf_to_images(file_bytes)
             # Assume ocr_data is a list of lists (one per page) or a flat list
             if isinstance(ocr_data, str):
                 ocr_data = json.loads(ocr_data)
-            if isinstance(ocr_data, list) and len(image_bytes_list) == len(ocr_data):
-                results = []
-                for page_ocr, page_img in zip(ocr_data, image_bytes_list):
-                    result = parse_menu_two_step(page_ocr, page_img, openai_api_key)
-                    results.append(result)
-                # Merge results (simple merge: combine categories, subcategories, items)
-                merged = {"data": {"category": [], "sub_category": [], "items": []}}
-                for res in results:
-                    if "data" in res:
-                        merged["data"]["category"].extend(res["data"].get("category", []))
-                        merged["data"]["sub_category"].extend(res["data"].get("sub_category", []))
-                        merged["data"]["items"].extend(res["data"].get("items", []))
-                return merged
+            if isinstance(ocr_data, list) and pdf_page_count(file_bytes) == len(ocr_data):
+                # Process page ranges as shards and merge them with consistent ids
+                return parse_pdf_sharded(source_file_path, file_bytes, ocr_data, openai_api_key)
             else:
                 # Fallback: treat as single page
-                return parse_menu_two_step(ocr_data, image_bytes_list[0], openai_api_key)
+                first_page_img = pdf_to_images(file_bytes, 1, 1)[0]
+                footprint = len(first_page_img) + memory_budget.vision_call_size(len(first_page_img))
+                with memory_budget.held(footprint, "page 1"):
+                    return parse_menu_two_step(ocr_data, first_page_img, openai_api_key)
         else:
             # Use the new two-step process for images
-            return parse_menu_two_step(ocr_data, file_bytes, openai_api_key)
+            with memory_budget.held(memory_budget.vision_call_size(len(file_bytes)), "image"):
+                return parse_menu_two_step(ocr_data, file_bytes, openai_api_key)
     elif ocr_data:
-        return parse_menu(ocr_data)
+        return parse_menu(ocr_data, as_model=True)
+    elif file_bytes and source_file_path.lower().endswith(".pdf") and settings.PDF_TEXT_LAYER:
+        # Digital PDFs parse from their text layer; without OCR, scanned pages are skipped
+        page_count = pdf_page_count(file_bytes)
+        menu = parse_pdf_sharded(source_file_path, file_bytes, [None] * page_count, openai_api_key)
+        if not menu.items:
+            raise ValueError("OCR data must be provided for scanned PDFs.")
+        return menu
     elif source_file_path.lower().endswith((".xls", ".xlsx")):
         file_bytes = download_file_from_firebase(source_file_path)
         menu_input = extract_data_from_excel(file_bytes)
-        return parse_menu(menu_input)
+        return parse_menu(menu_input, as_model=True)
     else:
         raise ValueError("OCR data must be provided for images and PDFs.")
 
-def refine_menu_with_vision(initial_json, image_bytes, openai_api_key=None):
-    """
-    Refine the initial menu JSON using the menu image and a vision model.
-    The model is instructed to only make corrections based on the image, not to start from scratch.
-    """
-    PROMPT_DIR = os.path.dirname(os.path.abspath(__file__))
-    SYSTEM_PROMPT_PATH = os.path.join(PROMPT_DIR, 'system_prompts_vision_refine.txt')
-    with open(SYSTEM_PROMPT_PATH, 'r', encoding='utf-8') as f:
-        SYSTEM_PROMPT = f.read()
-
-    if openai_api_key:
-        openai.api_key = openai_api_key
-    image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-    image_data_url = f"data:image/png;base64,{image_b64}"
-
+def refine_messages(initial_json, image_data_url):
+    """Chat messages of the vision refinement call for a menu and its page's data URL."""
     user_content = [
         {"type": "text", "text": json.dumps(initial_json, ensure_ascii=False)},
         {"type": "image_url", "image_url": {"url": image_data_url}},
     ]
+    return [
+        {"role": "system", "content": VISION_REFINE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+    ]
 
-    response = openai.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_content},
-        ],
-        max_tokens=4096,
-        temperature=0,
-        top_p=1,
-    )
-    result = response.choices[0].message.content
-    cleaned_for_json = result.strip().removeprefix('```json').removesuffix('```').strip()
+def refine_output_json(result):
+    """Parsed refinement output, or the cleaned raw text when it is not valid JSON."""
+    cleaned_for_json = strip_code_fences(result)
     try:
         return json.loads(cleaned_for_json)
     except Exception as e:
         print("Error parsing vision model output:", e)
         return cleaned_for_json  # Return raw output for debugging 
 
+def refine_menu_with_vision(initial_json, image_bytes, openai_api_key=None):
+    """
+    Refine the initial menu JSON using the menu image and a vision model.
+    The model is instructed to only make corrections based on the image, not to start from scratch.
+    """
+    if openai_api_key:
+        openai.api_key = openai_api_key
+    image_data_url = encode_image(image_bytes)
+
+    messages = refine_messages(initial_json, image_data_url)
+    prompt_text = messages[1]["content"][0]["text"]
+    debug_artifacts.capture("prompt", "vision_refine", prompt_text)
+    with llm_slot(prompt_text):
+        response = chat_completions().create(
+            model="gpt-4.1-mini",
+            messages=messages,
+            max_tokens=4096,
+            temperature=0,
+            top_p=1,
+            timeout=deadline.call_timeout("vision refinement"),
+        )
+    metrics.record_token_usage("vision_refine", response.usage)
+    result = response.choices[0].message.content
+    debug_artifacts.capture("raw_output", "vision_refine", result or "")
+    return refine_output_json(result)
+
 def attempt_repair_json(json_str):
     """
-    Attempt to repair common JSON issues: remove trailing commas, fix brackets, etc.
+    Attempt to repair common JSON issues: trailing commas, missing commas, truncated output, etc.
     Returns parsed JSON if successful, else None.
     """
-    # Remove markdown code block markers if present
-    cleaned = re.sub(r'^```json\s*|```$', '', json_str.strip(), flags=re.MULTILINE).strip()
-    # Remove trailing commas before } or ]
-    cleaned = re.sub(r',\s*([}\]])', r'\1', cleaned)
-    # Try to load
-    try:
-        return json.loads(cleaned)
-    except Exception:
-        pass
-    # Try to fix unbalanced brackets (very basic)
-    open_braces = cleaned.count('{')
-    close_braces = cleaned.count('}')
-    if open_braces > close_braces:
-        cleaned += '}' * (open_braces - close_braces)
-    elif close_braces > open_braces:
-        cleaned = cleaned.rstrip('}')
     try:
-        return json.loads(cleaned)
-    except Exception:
+        repaired, report = parse_model_json(json_str)
+    except ValueError:
         return None
+    if report is not None:
+        print("Repaired vision model output:", report)
+    return repaired
+
+def menu_schema_error(menu_json):
+    """Return the schema validation message for menu_json, or None if it is valid."""
+    try:
+        validate(instance=menu_json, schema=MENU_SCHEMA)
+    except ValidationError as e:
+        return str(e)
+    return None
+
+def validate_menu_json(menu_json):
+    """Validate menu JSON against MENU_SCHEMA in the CPU pool; raises ValidationError."""
+    error = run_cpu(menu_schema_error, menu_json)
+    if error is not None:
+        raise ValidationError(error)
 
-def parse_menu_two_step(ocr_data, image_bytes, openai_api_key=None):
+def refinement_plan(initial_json, ocr_data):
     """
-    Two-step menu parsing:
-    1. Parse OCR data with text-based parser to get initial JSON.
-    2. Refine the initial JSON using the vision model and the menu image.
-    Returns the final refined JSON.
+    Decide how much of a text parse goes to vision refinement: "skip" when its
+    prices, item text and headers reconcile with the OCR, "partial" with the
+    subcategories of the unreconciled sections, or "full". An empty parse, or
+    OCR without a single price token to check against, is never skipped.
+    Returns (plan, subcategory ids, report).
     """
-    # Step 1: Text-based parse
-    initial_json = parse_menu(ocr_data)
-    # Step 2: Vision-based refinement
-    refined_json = refine_menu_with_vision(initial_json, image_bytes, openai_api_key)
-
-    # Menu schema (copied from langchain_pipeline.py)
-    menu_schema = {
-        "type": "object",
-        "properties": {
-            "data": {
-                "type": "object",
-                "properties": {
-                    "category": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "integer"},
-                                "title": {"type": "string"},
-                                "description": {"type": "string"}
-                            },
-                            "required": ["id", "title", "description"]
-                        }
-                    },
-                    "sub_category": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "integer"},
-                                "catId": {"type": "integer"},
-                                "title": {"type": "string"},
-                                "description": {"type": "string"}
-                            },
-                            "required": ["id", "catId", "title", "description"]
-                        }
-                    },
-                    "items": {
-                        "type": "array",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "itemId": {"type": "integer"},
-                                "subCatId": {"type": "integer"},
-                                "title": {"type": "string"},
-                                "description": {"type": "string"},
-                                "price": {"type": "number"},
-                                "variantAvailable": {"type": "integer"},
-                                "variants": {"type": "array"},
-                                "optionsAvailable": {"type": "integer"},
-                                "options": {"type": "array"}
-                            },
-                            "required": ["itemId", "subCatId", "title", "description", "price", "variantAvailable", "variants", "optionsAvailable", "options"]
-                        }
-                    }
-                },
-                "required": ["category", "sub_category", "items"]
-            }
-        },
-        "required": ["data"]
-    }
+    threshold = settings.VISION_REFINE_SKIP_COVERAGE
+    report = reconcile_menu(initial_json, ocr_data, threshold, canonicalize=canonicalize_subcat)
+    print("Reconciliation with OCR:", {k: report[k] for k in ("price_coverage", "text_coverage", "header_coverage", "ocr_prices", "items")},
+          f"{len(report['unreconciled'])}/{len(report['sections'])} sections unreconciled")
+    if not report["items"]:
+        return "full", [], report
+    reconciled = (
+        report["price_coverage"] >= threshold and report["text_coverage"] >= threshold
+        and report["header_coverage"] >= threshold and not report["unreconciled"]
+    )
+    if reconciled and report["ocr_prices"]:
+        return "skip", [], report
+    if settings.VISION_REFINE_PARTIAL and len(report["unreconciled"]) < len(report["sections"]):
+        ids = [sub_id for section in report["unreconciled"] for sub_id in section["subCatIds"]]
+        # A section the parse has no subcategory for cannot be refined on its own
+        if ids and all(section["subCatIds"] for section in report["unreconciled"]):
+            return "partial", ids, report
+    return "full", [], report
+
+def split_menu_by_subcats(menu_json, subcat_ids):
+    """Split menu JSON into (menu without those subcategories' items, menu with only them)."""
+    data = menu_json["data"]
+    wanted = set(subcat_ids)
+    selected_subcats = [s for s in data["sub_category"] if s["id"] in wanted]
+    cat_ids = {s["catId"] for s in selected_subcats}
+    kept = {"data": {
+        "category": data["category"],
+        "sub_category": data["sub_category"],
+        "items": [i for i in data["items"] if i["subCatId"] not in wanted],
+    }}
+    selected = {"data": {
+        "category": [c for c in data["category"] if c["id"] in cat_ids],
+        "sub_category": selected_subcats,
+        "items": [i for i in data["items"] if i["subCatId"] in wanted],
+    }}
+    return kept, selected
+
+def validated_refinement(refined_json):
+    """The refined JSON (repaired if it was malformed) when it passes the schema, else None."""
     try:
-        validate(instance=refined_json, schema=menu_schema)
-        refined_json = reindex_menu_ids(refined_json)
+        validate_menu_json(refined_json)
         return refined_json
     except ValidationError as e:
         print("Schema validation error after vision model refinement:", e)
@@ -438,15 +776,61 @@ def parse_menu_two_step(ocr_data, image_bytes, openai_api_key=None):
             repaired = attempt_repair_json(refined_json)
             if repaired is not None:
                 try:
-                    validate(instance=repaired, schema=menu_schema)
+                    validate_menu_json(repaired)
                     print("Repair successful. Returning repaired JSON.")
-                    repaired = reindex_menu_ids(repaired)
                     return repaired
                 except ValidationError as e2:
                     print("Repair failed schema validation:", e2)
+    return None
+
+def parse_menu_two_step(ocr_data, image_bytes, openai_api_key=None, label=None):
+    """
+    Two-step menu parsing:
+    1. Parse OCR data with text-based parser to get initial JSON.
+    2. Refine the initial JSON using the vision model and the menu image, unless
+       it already reconciles with the OCR; only the unreconciled sections are
+       sent when the rest does (see refinement_plan). When the request deadline
+       stops the refinement, the text parse is kept and the refinement is
+       recorded as a missing section.
+    Returns the final refined JSON.
+    """
+    # Step 1: Text-based parse (its merged JSON is captured by parse_menu)
+    initial_json = parse_menu(ocr_data, label=label)
+    plan, subcat_ids, _ = refinement_plan(initial_json, ocr_data)
+    metrics.incr(f"vision_refine_{plan}")
+    if plan == "skip":
+        print("Text parse reconciles with the OCR; skipping vision refinement.")
+        return reindex_menu_ids(initial_json)
+    kept, target = (split_menu_by_subcats(initial_json, subcat_ids) if plan == "partial" else (None, initial_json))
+    # Step 2: Vision-based refinement
+    try:
+        refined_output = refine_menu_with_vision(target, image_bytes, openai_api_key)
+    except Exception as e:
+        if not deadline.timed_out(e):
+            raise
+        print("Vision refinement stopped by the request deadline; keeping the text parse:", e)
+        metrics.incr("vision_refine_deadline")
+        deadline.note_missing(f"{label or 'menu'} vision refinement")
+        return reindex_menu_ids(initial_json)
+    return apply_refinement(initial_json, kept, refined_output)
+
+def apply_refinement(initial_json, kept, refined_output):
+    """
+    Final menu from the refinement output: validated (or repaired) and, for a
+    partial refinement, merged with the kept reconciled sections. Falls back to
+    the initial parse when the output is unusable.
+    """
+    refined_json = validated_refinement(refined_output)
+    if refined_json is None:
         print("Falling back to initial text-based parse result.")
-        initial_json = reindex_menu_ids(initial_json)
-        return initial_json 
+        return reindex_menu_ids(initial_json)
+    if kept is not None:
+        # Refined sections rejoin the reconciled ones under their subcategory titles
+        merged = merge_menu_json([kept, refined_json])
+        used = {item.sub_cat_id for item in merged.items}
+        merged.sub_categories = [sub for sub in merged.sub_categories if sub.id in used]
+        refined_json = merged.to_json()
+    return reindex_menu_ids(refined_json)
 
 def fuzzy_fix_price(text):
     # Fixes prices like 'Small $1.' to 'Small $1.00', 'Je $2.00' to 'Large $2.00', etc.
@@ -460,7 +844,12 @@ def fuzzy_fix_price(text):
         return f"{m2.group(1)}{m2.group(2)}.00"
     return text
 
-def is_section_header(line):
+def is_caps_header(line):
+    """
+    Strict all-caps header check of the OCR post-processing below, which also
+    treats price and size lines as headers. Chunking uses
+    ocr_layout.looks_like_section_header.
+    """
     return line.isupper() and len(line) > 2 and len(line.split()) < 6
 
 def is_price_line(line):
@@ -469,7 +858,7 @@ def is_price_line(line):
 
 def is_item_name(line):
     # Heuristic: not a price, not a header, not empty, not a variant label
-    if not line or is_section_header(line) or is_price_line(line):
+    if not line or is_caps_header(line) or is_price_line(line):
         return False
     if re.match(r'^(SMALL|MEDIUM|LARGE|HALF|WHOLE|PINT|QUART)$', line.strip(), re.I):
         return False
@@ -496,7 +885,7 @@ def robust_ocr_postprocessing(menu_json, ocr_data):
     section_indices = []
     for i, ocr in enumerate(ocr_data):
         text = ocr.get('text', '').strip()
-        if is_section_header(text):
+        if is_caps_header(text):
             section_indices.append(i)
     if not section_indices or section_indices[0] != 0:
         section_indices = [0] + section_indices
@@ -555,11 +944,7 @@ def robust_ocr_postprocessing(menu_json, ocr_data):
                 parent_title = m.group(1).strip().upper()
                 price = float(m.group(2).replace('$',''))
                 norm_parent_title = normalize_title(parent_title)
-                parent_item = None
-                for (scid, norm_title), item in item_map.items():
-                    if scid == subcat_id and norm_title == norm_parent_title:
-                        parent_item = item
-                        break
+                parent_item = item_map.get((subcat_id, norm_parent_title))
                 if parent_item:
                     parent_item["price"] = 0.00
                     parent_item["variantAvailable"] = 0
@@ -582,17 +967,16 @@ def robust_ocr_postprocessing(menu_json, ocr_data):
             # If in shared variant block and line is an item name, apply variants
             if in_shared_variant_block and is_item_name(line):
                 norm_line = normalize_title(line)
-                for (scid, norm_title), item in item_map.items():
-                    if scid == subcat_id and norm_title == norm_line:
-                        item["variants"] = shared_variants
-                        item["variantAvailable"] = 1
-                        item["price"] = 0
-                        handled_items.add((scid, norm_title))
-                        break
+                item = item_map.get((subcat_id, norm_line))
+                if item is not None:
+                    item["variants"] = shared_variants
+                    item["variantAvailable"] = 1
+                    item["price"] = 0
+                    handled_items.add((subcat_id, norm_line))
                 i += 1
                 continue
             # End parent-with-options or shared variant block if we hit a price, section, or non-item
-            if is_section_header(line) or is_price_line(line) or not is_item_name(line):
+            if is_caps_header(line) or is_price_line(line) or not is_item_name(line):
                 parent_item = None
                 in_parent_options_block = False
                 in_shared_variant_block = False
@@ -709,6 +1093,8 @@ def reindex_menu_ids(menu_json):
     Reassigns unique, sequential IDs to categories, subcategories, and items,
     and fixes references (catId, subCatId) accordingly.
     """
+    if isinstance(menu_json, Menu):
+        return _reindex_menu_model(menu_json)
     if not menu_json or "data" not in menu_json:
         return menu_json
 
@@ -733,4 +1119,20 @@ def reindex_menu_ids(menu_json):
         item["itemId"] = i
         item["subCatId"] = new_subcat_ids.get(item["subCatId"], 1)
 
-    return menu_json 
\ No newline at end of file
+    return menu_json
+
+def _reindex_menu_model(menu):
+    """reindex_menu_ids for the compact Menu model."""
+    new_cat_ids = {}
+    new_subcat_ids = {}
+    for i, cat in enumerate(menu.categories, start=1):
+        new_cat_ids[cat.id] = i
+        cat.id = i
+    for i, sub in enumerate(menu.sub_categories, start=1):
+        new_subcat_ids[sub.id] = i
+        sub.id = i
+        sub.cat_id = new_cat_ids.get(sub.cat_id, 1)  # fallback to 1
+    for i, item in enumerate(menu.items, start=1):
+        item.item_id = i
+        item.sub_cat_id = new_subcat_ids.get(item.sub_cat_id, 1)
+    return menu
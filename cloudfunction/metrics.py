@@ -0,0 +1,113 @@
+import threading
+from collections import Counter, defaultdict
+
+# Per-process counters; each uvicorn worker keeps its own
+_lock = threading.Lock()
+_counters = Counter()
+_token_usage = defaultdict(Counter)
+_stages = defaultdict(Counter)
+_tenants = {}  # tenant -> Counter, least recently active first
+
+# Tenants kept in the per-tenant metrics; the least recently active idle ones
+# are dropped beyond it (tenant keys follow file names, see llm_scheduler.tenant_for)
+MAX_TENANTS = 1024
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def observe_max(name, value):
+    """Keep the largest value seen for name (e.g. a high-water mark)."""
+    with _lock:
+        _counters[name] = max(_counters[name], value)
+
+
+def _field(obj, name):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_counts(usage):
+    """Return (prompt, cached, completion) token counts from an OpenAI usage object or dict."""
+    prompt = _field(usage, "prompt_tokens") or 0
+    completion = _field(usage, "completion_tokens") or 0
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+    return prompt, cached, completion
+
+
+def record_token_usage(stage, usage):
+    """
+    Account one LLM call's prompt, cached-prompt and completion tokens under
+    `stage` (e.g. "text_chunk", "vision_chunk", "vision_refine").
+    """
+    prompt, cached, completion = usage_counts(usage)
+    with _lock:
+        stats = _token_usage[stage]
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt
+        stats["cached_tokens"] += cached
+        stats["completion_tokens"] += completion
+    print(f"Token usage [{stage}]: prompt={prompt} cached={cached} completion={completion}")
+    return prompt, cached, completion
+
+
+def record_stage(stage, busy_seconds, wait_seconds, queue_depth):
+    """
+    Account one item processed by a pipeline stage (see pipeline_executor):
+    time spent in the stage, time it waited in the stage's input queue and the
+    queue depth it left behind.
+    """
+    with _lock:
+        stats = _stages[stage]
+        stats["items"] += 1
+        stats["busy_seconds"] += busy_seconds
+        stats["wait_seconds"] += wait_seconds
+        stats["queue_depth"] = queue_depth
+        stats["max_queue_depth"] = max(stats["max_queue_depth"], queue_depth)
+
+
+def _tenant_stats(tenant):
+    """The tenant's stats, marked as most recently active; call with _lock held."""
+    stats = _tenants.pop(tenant, None)
+    if stats is None:
+        stats = Counter()
+        excess = len(_tenants) + 1 - MAX_TENANTS
+        if excess > 0:
+            idle = [t for t, s in _tenants.items() if not s["queued"]]
+            for t in idle[:excess]:
+                del _tenants[t]
+    _tenants[tenant] = stats
+    return stats
+
+
+def tenant_queue(tenant, depth):
+    """Current number of the tenant's LLM calls waiting for a slot (see llm_scheduler)."""
+    with _lock:
+        stats = _tenant_stats(tenant)
+        stats["queued"] = depth
+        stats["max_queued"] = max(stats["max_queued"], depth)
+
+
+def record_tenant_call(tenant, wait_seconds, cost):
+    """Account one LLM call admitted for tenant: time it waited for a slot and its scheduling cost."""
+    with _lock:
+        stats = _tenant_stats(tenant)
+        stats["calls"] += 1
+        stats["wait_seconds"] += wait_seconds
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait_seconds)
+        stats["cost"] += cost
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "token_usage": {stage: dict(stats) for stage, stats in _token_usage.items()},
+            "stages": {stage: {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()} for stage, stats in _stages.items()},
+            "tenants": {tenant: {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()} for tenant, stats in _tenants.items()},
+        }
@@ -0,0 +1,192 @@
+import re
+import numpy as np
+
+PRICE_RE = re.compile(r'^[$£€]?\d{1,4}(?:[.,]\d{1,2})?$')
+
+SECTION_NAME_RE = re.compile(r'^(starters|appetizers|main course|desserts|beverages|drinks|sides|salads|soups|specials|breakfast|lunch|dinner)s?$', re.I)
+NOT_HEADER_RE = re.compile(r'\$|\d+\.\d{2}|HALF|WHOLE|SMALL|LARGE')
+
+# Fallbacks when the OCR records carry no sizes: Vision word boxes are usually
+# about this tall and wide per character at the resolutions we receive
+DEFAULT_ROW_TOLERANCE = 15.0
+DEFAULT_CHAR_WIDTH = 8.0
+
+
+def is_positioned_ocr(ocr_data):
+    """True for a non-empty list of OCR records with text and numeric x/y coordinates."""
+    if not isinstance(ocr_data, list) or not ocr_data:
+        return False
+    return all(
+        isinstance(r, dict) and "text" in r
+        and isinstance(r.get("x"), (int, float)) and isinstance(r.get("y"), (int, float))
+        for r in ocr_data
+    )
+
+
+def looks_like_section_header(text):
+    """Section header heuristic: short all-caps line without prices/sizes, or a known section name."""
+    return bool(
+        (text.isupper() and len(text) > 2 and len(text.split()) < 6 and not NOT_HEADER_RE.search(text))
+        or SECTION_NAME_RE.match(text)
+    )
+
+
+def _column(records, *keys):
+    """Float array of the first present key per record (0 when absent)."""
+    values = []
+    for r in records:
+        v = 0.0
+        for key in keys:
+            if isinstance(r.get(key), (int, float)):
+                v = float(r[key])
+                break
+        values.append(v)
+    return np.asarray(values, dtype=float)
+
+
+def ocr_geometry(records):
+    """Return (texts, x, y, right, height, char_width) arrays for positioned OCR records."""
+    texts = [str(r.get("text", "")).strip() for r in records]
+    x = _column(records, "x")
+    y = _column(records, "y")
+    w = _column(records, "width", "w")
+    h = _column(records, "height", "h")
+    lengths = np.fromiter((max(len(t), 1) for t in texts), dtype=float, count=len(texts))
+    has_w = w > 0
+    if has_w.any():
+        char_width = float(np.median(w[has_w] / lengths[has_w]))
+    elif (h > 0).any():
+        char_width = float(np.median(h[h > 0])) * 0.5
+    else:
+        char_width = DEFAULT_CHAR_WIDTH
+    right = np.where(has_w, x + w, x + lengths * char_width)
+    return texts, x, y, right, h, char_width
+
+
+def cluster_rows(y, tolerance):
+    """Assign a row id to every fragment: sorted y values closer than tolerance share a row."""
+    order = np.argsort(y, kind="stable")
+    new_row = np.empty(len(y), dtype=bool)
+    new_row[0] = True
+    new_row[1:] = np.diff(y[order]) > tolerance
+    rows = np.empty(len(y), dtype=int)
+    rows[order] = np.cumsum(new_row) - 1
+    return rows
+
+
+def merge_ocr_lines(ocr_data, row_tolerance=None, column_gap=None):
+    """
+    Collapse word/fragment-level OCR into compact line records.
+    Fragments are clustered into rows by y, split into column segments where the
+    horizontal gap exceeds column_gap, and a price-only segment is joined to the
+    name segment before it on the same row. Output records keep only
+    {"text", "x", "y"} and follow the input's reading order.
+    Input that is not positioned OCR is returned unchanged.
+    """
+    if not is_positioned_ocr(ocr_data):
+        return ocr_data
+    records = [r for r in ocr_data if str(r.get("text", "")).strip()]
+    if not records:
+        return []
+    texts, x, y, right, h, char_width = ocr_geometry(records)
+    if row_tolerance is None:
+        row_tolerance = float(np.median(h[h > 0])) * 0.5 if (h > 0).any() else DEFAULT_ROW_TOLERANCE
+    if column_gap is None:
+        column_gap = char_width * 4
+
+    rows = cluster_rows(y, row_tolerance)
+    # Fragments in (row, x) order; a segment break wherever the row changes or the gap is wide
+    idx = np.lexsort((x, rows))
+    breaks = np.ones(len(idx), dtype=bool)
+    if len(idx) > 1:
+        same_row = rows[idx[1:]] == rows[idx[:-1]]
+        gaps = x[idx[1:]] - right[idx[:-1]]
+        breaks[1:] = ~same_row | (gaps > column_gap)
+    starts = np.flatnonzero(breaks)
+    ends = np.append(starts[1:], len(idx))
+
+    segments = []
+    for start, end in zip(starts, ends):
+        members = idx[start:end]
+        text = " ".join(texts[i] for i in members)
+        segment = {
+            "text": text,
+            "x": int(round(x[members].min())),
+            "y": int(round(y[members].min())),
+            "row": int(rows[members[0]]),
+            "order": int(members.min()),
+        }
+        prev = segments[-1] if segments else None
+        if prev is not None and prev["row"] == segment["row"] and PRICE_RE.match(text) and not PRICE_RE.match(prev["text"]):
+            prev["text"] = f"{prev['text']} {text}"
+            continue
+        segments.append(segment)
+
+    segments.sort(key=lambda s: s["order"])
+    return [{"text": s["text"], "x": s["x"], "y": s["y"]} for s in segments]
+
+
+def _extents(records):
+    """Return (x, y, right) arrays for positioned records, estimating widths from text length."""
+    _, x, y, right, _, _ = ocr_geometry(records)
+    return x, y, right
+
+
+def detect_columns(records, min_gutter=None, max_crossings=None):
+    """
+    Assign a column index to every positioned record from a projection profile.
+    The [x, right) spans of all records are counted per x bin; internal runs of
+    bins crossed by at most max_crossings records and at least min_gutter wide
+    are gutters. A record's column is the number of gutters left of it; records
+    that cross a gutter (titles, banners) get column -1.
+    Returns (columns array, number of columns).
+    """
+    x, _, right = _extents(records)
+    if min_gutter is None:
+        min_gutter = DEFAULT_CHAR_WIDTH * 2
+    if max_crossings is None:
+        max_crossings = max(1, len(records) // 50)
+    bin_width = max(min_gutter / 4, 1.0)
+    origin = float(x.min())
+    first = ((x - origin) // bin_width).astype(int)
+    last = np.maximum(((right - origin) // bin_width).astype(int), first + 1)
+    # Difference array -> number of records covering each bin
+    delta = np.zeros(int(last.max()) + 1, dtype=int)
+    np.add.at(delta, first, 1)
+    np.add.at(delta, last, -1)
+    coverage = np.cumsum(delta)[:-1]
+    sparse = coverage <= max_crossings
+    # Runs of sparse bins that are long enough and have text on both sides
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], sparse.astype(int), [0]))))
+    gutters = [
+        (start, end) for start, end in zip(edges[::2], edges[1::2])
+        if start > 0 and end < len(sparse) and (end - start) * bin_width >= min_gutter
+    ]
+    columns = np.zeros(len(records), dtype=int)
+    spanning = np.zeros(len(records), dtype=bool)
+    for start, end in gutters:
+        columns += first >= end
+        spanning |= (first < start) & (last > end)
+    columns[spanning] = -1
+    return columns, len(gutters) + 1
+
+
+def column_layout(records, **kwargs):
+    """
+    Order positioned records for reading column by column.
+    Spanning records split the page into horizontal bands; within a band the
+    columns are read left to right, each top to bottom.
+    Returns (ordered records, column index per record, -1 for spanning records);
+    the records are the input dicts, not copies. Input that is not positioned
+    OCR comes back unchanged with columns None.
+    """
+    if not is_positioned_ocr(records):
+        return records, None
+    columns, _ = detect_columns(records, **kwargs)
+    x, y, _ = _extents(records)
+    # Band id: number of spanning records above (or level with) this record
+    span_y = np.sort(y[columns < 0])
+    bands = np.searchsorted(span_y, y, side="right")
+    # Spanning records lead their band since -1 sorts before every column
+    idx = np.lexsort((x, y, columns, bands))
+    return [records[i] for i in idx], [int(columns[i]) for i in idx]
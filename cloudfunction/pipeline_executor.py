@@ -0,0 +1,133 @@
+import contextvars
+import queue
+import threading
+import time
+import metrics
+
+# Process-wide concurrency limits per stage name, shared by every pipeline run
+_limits = {}
+_limits_lock = threading.Lock()
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+def stage_limit(name, max_concurrency):
+    """The semaphore bounding concurrent calls of stage `name` across all pipeline runs."""
+    with _limits_lock:
+        if name not in _limits:
+            _limits[name] = threading.BoundedSemaphore(max_concurrency)
+        return _limits[name]
+
+
+class Stage:
+    """
+    One step of a pipeline: fn(item) -> next item, run by `workers` threads per
+    pipeline run. Returning None drops the item. max_concurrency (optional)
+    bounds calls of this stage across all runs in the process, e.g. to keep
+    rasterizing within the CPU pool or LLM calls within the rate limit.
+    """
+
+    def __init__(self, name, fn, workers=1, max_concurrency=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.max_concurrency = max_concurrency
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages. Stages are connected by bounded
+    queues, so a fast stage blocks (backpressure) instead of piling up results
+    that a slower stage cannot take yet, and different items are in different
+    stages at the same time. Per-stage time, queue wait and queue depth go to
+    metrics.record_stage as "<pipeline>.<stage>".
+    """
+
+    def __init__(self, name, stages, queue_size=4):
+        self.name = name
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    def run(self, items):
+        """
+        Run every item through the stages. Returns the final outputs in input
+        order, without dropped items. The first exception raised by a stage
+        or by the items iterator stops the run and is re-raised here.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = {}
+        errors = []
+        failed = threading.Event()
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        def worker(index, stage):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+            limit = stage_limit(stage.name, stage.max_concurrency) if stage.max_concurrency else None
+            label = f"{self.name}.{stage.name}"
+            while True:
+                entry = inbox.get()
+                if entry is _DONE:
+                    break
+                position, item, queued_at = entry
+                if failed.is_set():
+                    continue  # drain without working so upstream puts never block
+                started = time.monotonic()
+                try:
+                    if limit is not None:
+                        with limit:
+                            output = stage.fn(item)
+                    else:
+                        output = stage.fn(item)
+                except BaseException as e:
+                    errors.append(e)
+                    failed.set()
+                    continue
+                finally:
+                    metrics.record_stage(label, time.monotonic() - started, started - queued_at, inbox.qsize())
+                if output is None:
+                    continue
+                if outbox is None:
+                    results[position] = output
+                else:
+                    outbox.put((position, output, time.monotonic()))
+            with remaining_lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    outbox.put(_DONE)
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                # Each worker runs in its own copy of the caller's context
+                # (debug artifact capture, per-request state)
+                context = contextvars.copy_context()
+                thread = threading.Thread(
+                    target=context.run, args=(worker, index, stage),
+                    name=f"{self.name}-{stage.name}-{n}", daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for position, item in enumerate(items):
+                if failed.is_set():
+                    break
+                queues[0].put((position, item, time.monotonic()))
+        except BaseException as e:
+            # An input iterator that fails stops the run like a failing stage
+            errors.append(e)
+            failed.set()
+        finally:
+            # Always end the first stage's input, or its workers wait forever
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return [results[position] for position in sorted(results)]
@@ -0,0 +1,35 @@
+import hashlib
+import os
+import re
+
+PROMPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def compact_prompt(text):
+    """
+    Normalize prompt whitespace: drop trailing spaces and collapse runs of blank
+    lines. Prompts are loaded once, so every call sends byte-identical text.
+    """
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip() + '\n'
+
+
+def load_prompt(filename):
+    with open(os.path.join(PROMPT_DIR, filename), 'r', encoding='utf-8') as f:
+        return compact_prompt(f.read())
+
+
+# Static instructions. Each is sent as the leading system message of its call,
+# identical on every call, so the provider can serve it from its prefix cache;
+# only the chunk, image and JSON that follow change per call.
+SYSTEM_PROMPT = load_prompt('system_prompts.txt')
+USER_PROMPT = load_prompt('user_prompts.txt')
+VISION_SYSTEM_PROMPT = load_prompt('system_prompts_vision.txt')
+VISION_REFINE_SYSTEM_PROMPT = load_prompt('system_prompts_vision_refine.txt')
+
+# Changes whenever any prompt text changes; stored results parsed with other
+# prompts are not reused (see result_index.py)
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join((SYSTEM_PROMPT, USER_PROMPT, VISION_SYSTEM_PROMPT, VISION_REFINE_SYSTEM_PROMPT)).encode("utf-8")
+).hexdigest()[:12]
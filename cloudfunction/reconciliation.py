@@ -0,0 +1,263 @@
+import json
+import re
+from collections import Counter
+from fuzzy_match import FuzzyMatcher
+from menu_model import Menu
+from ocr_layout import column_layout, looks_like_section_header, merge_ocr_lines
+import settings
+
+# Price tokens in OCR text: decimals ("9.50", "9,50") or currency-prefixed whole
+# amounts ("$12"). Bare integers are too ambiguous ("2 eggs") to count.
+OCR_PRICE_RE = re.compile(r'(?<![\w.,])(?:[$£€]\s?\d{1,4}(?:[.,]\d{1,2})?|\d{1,4}[.,]\d{2})(?![\w])')
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def _price_value(token):
+    token = token.lstrip("$£€").strip().replace(",", ".")
+    try:
+        return round(float(token), 2)
+    except ValueError:
+        return None
+
+
+def payload_lines(payload):
+    """Text lines of a chunk payload (OCR records or plain text)."""
+    if isinstance(payload, list):
+        return [str(r.get("text", "")) if isinstance(r, dict) else str(r) for r in payload]
+    return str(payload).splitlines()
+
+
+def ocr_prices(payload):
+    """Counter of the price amounts appearing in a chunk payload."""
+    prices = Counter()
+    for line in payload_lines(payload):
+        for token in OCR_PRICE_RE.findall(line):
+            value = _price_value(token)
+            if value:
+                prices[value] += 1
+    return prices
+
+
+def _positive_price(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        return round(float(value), 2)
+    return None
+
+
+def result_prices(menu_json):
+    """Counter of the non-zero prices in parsed menu JSON: items, variants, options and choices."""
+    prices = Counter()
+    data = menu_json.get("data", menu_json) if isinstance(menu_json, dict) else {}
+    for item in data.get("items", []) or []:
+        if not isinstance(item, dict):
+            continue
+        entries = [item]
+        entries.extend(v for v in item.get("variants") or [] if isinstance(v, dict))
+        for option in item.get("options") or []:
+            if isinstance(option, dict):
+                entries.append(option)
+                entries.extend(c for c in option.get("choices") or [] if isinstance(c, dict))
+        for entry in entries:
+            value = _positive_price(entry.get("price"))
+            if value:
+                prices[value] += 1
+    return prices
+
+
+def price_coverage(ocr, result):
+    """Share of the OCR price tokens the result accounts for (1.0 when the OCR has none)."""
+    total = sum(ocr.values())
+    if not total:
+        return 1.0
+    return sum((ocr & result).values()) / total
+
+
+def count_agreement(ocr, result):
+    """How closely the number of prices in the result matches the OCR, in [0, 1]."""
+    ocr_count, result_count = sum(ocr.values()), sum(result.values())
+    if not ocr_count and not result_count:
+        return 1.0
+    return min(ocr_count, result_count) / max(ocr_count, result_count)
+
+
+def schema_valid(menu_json):
+    if not isinstance(menu_json, dict):
+        return False
+    try:
+        Menu.from_json(menu_json).validate()
+    except (ValueError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def chunk_confidence(payload, menu_json):
+    """
+    Cheap confidence score for one chunk's parse, without another model call:
+    schema validity, the share of the chunk's OCR prices found in the result and
+    how well the price counts agree. An invalid result scores 0.
+    """
+    ocr = ocr_prices(payload)
+    result = result_prices(menu_json)
+    valid = schema_valid(menu_json)
+    coverage = price_coverage(ocr, result)
+    agreement = count_agreement(ocr, result)
+    score = round(0.6 * coverage + 0.4 * agreement, 3) if valid else 0.0
+    return {"schema": valid, "price_coverage": round(coverage, 3), "count_agreement": round(agreement, 3), "score": score}
+
+
+def _normalize_text(text):
+    """Lowercase words and numbers of a line, single-spaced, for substring checks."""
+    return " ".join(WORD_RE.findall(text.lower()))
+
+
+def _text_line(text):
+    """Normalized text of an OCR line that could name or describe an item, without its prices; "" otherwise."""
+    text = OCR_PRICE_RE.sub(" ", text)
+    if not re.search(r'[^\W\d_]{2}', text):
+        return ""
+    return _normalize_text(text)
+
+
+def ocr_sections(ocr_data):
+    """
+    Split OCR input into (header, prices, text lines) sections in reading
+    order, using the same header heuristic as the chunkers. Text lines are the
+    normalized lines with letters (item names, descriptions), so sections whose
+    prices are bare integers ("Steak Frites 28") are still checked. Lines before
+    the first header form a section with an empty header.
+    """
+    if isinstance(ocr_data, str):
+        try:
+            ocr_data = json.loads(ocr_data)
+        except ValueError:
+            pass
+    if isinstance(ocr_data, list):
+        # Same line records and reading order as parse_menu used
+        if settings.OCR_LINE_MERGE:
+            ocr_data = merge_ocr_lines(ocr_data)
+        if settings.OCR_COLUMN_LAYOUT:
+            ocr_data, _ = column_layout(ocr_data)
+    sections = [("", Counter(), [])]
+    for line in payload_lines(ocr_data):
+        text = line.strip()
+        if looks_like_section_header(text):
+            sections.append((text, Counter(), []))
+            continue
+        sections[-1][1].update(ocr_prices(text))
+        normalized = _text_line(text)
+        if normalized:
+            sections[-1][2].append(normalized)
+    return [(title, prices, lines) for title, prices, lines in sections if prices or lines]
+
+
+def _item_texts(item):
+    """Normalized titles and descriptions of an item, its variants, options and choices."""
+    entries = [item]
+    entries.extend(v for v in item.get("variants") or [] if isinstance(v, dict))
+    for option in item.get("options") or []:
+        if isinstance(option, dict):
+            entries.append(option)
+            entries.extend(c for c in option.get("choices") or [] if isinstance(c, dict))
+    texts = []
+    for entry in entries:
+        for key in ("title", "variantTitle", "optTitle", "description"):
+            value = entry.get(key)
+            if isinstance(value, str):
+                normalized = _normalize_text(value)
+                if len(normalized) >= 3:
+                    texts.append(normalized)
+    return texts
+
+
+def text_coverage(lines, texts):
+    """
+    Share of OCR text lines the parse accounts for: a line is explained when it
+    contains a parsed title or description as whole words, or is part of one
+    (a description wrapped over several lines). 1.0 when there are no lines.
+    """
+    if not lines:
+        return 1.0
+    padded = [f" {t} " for t in texts]
+    explained = 0
+    for line in lines:
+        line_padded = f" {line} "
+        if any(t in line_padded or line_padded in t for t in padded):
+            explained += 1
+    return explained / len(lines)
+
+
+def _subcat_contents(menu_json):
+    """
+    {subcategory id: (Counter of its item prices, list of its item texts)},
+    and {lowercase title: [ids]}.
+    """
+    data = menu_json.get("data", menu_json) if isinstance(menu_json, dict) else {}
+    by_id = {}
+    for item in data.get("items", []) or []:
+        if isinstance(item, dict):
+            prices, texts = by_id.setdefault(item.get("subCatId"), (Counter(), []))
+            prices.update(result_prices({"items": [item]}))
+            texts.extend(_item_texts(item))
+    titles = {}
+    for sub in data.get("sub_category", []) or []:
+        if isinstance(sub, dict) and isinstance(sub.get("title"), str):
+            titles.setdefault(sub["title"].strip().lower(), []).append(sub.get("id"))
+    return by_id, titles
+
+
+def reconcile_menu(menu_json, ocr_data, threshold, canonicalize=None):
+    """
+    Compare a parsed menu with its OCR: every OCR section is matched to the
+    subcategory of the same (canonical) title, and the share of its prices
+    found among that subcategory's items and of its text lines explained by
+    their titles and descriptions are computed. Sections with no matching
+    subcategory are checked against the whole menu.
+    Returns {"price_coverage", "text_coverage", "header_coverage",
+    "ocr_prices", "items", "sections", "unreconciled"}, where ocr_prices and
+    items count the OCR price tokens and parsed items, and unreconciled lists
+    the sections below threshold on either coverage as
+    {"title", "subCatIds", "price_coverage", "text_coverage"}.
+    """
+    sections = ocr_sections(ocr_data)
+    by_id, titles = _subcat_contents(menu_json)
+    matcher = FuzzyMatcher(titles)
+    everything = result_prices(menu_json)
+    all_texts = [t for _, texts in by_id.values() for t in texts]
+    ocr_total = Counter()
+    ocr_lines = []
+    headers = matched_headers = 0
+    report = []
+    for title, prices, lines in sections:
+        ocr_total.update(prices)
+        ocr_lines.extend(lines)
+        ids = []
+        if title:
+            headers += 1
+            key = (canonicalize(title) if canonicalize else title).strip().lower()
+            match = key if key in titles else matcher.best_match(key, cutoff=0.8)
+            if match:
+                matched_headers += 1
+                ids = titles[match]
+        found, texts = Counter(), []
+        for sub_id in ids:
+            sub_prices, sub_texts = by_id.get(sub_id, (Counter(), []))
+            found.update(sub_prices)
+            texts.extend(sub_texts)
+        report.append({
+            "title": title,
+            "subCatIds": ids,
+            "price_coverage": round(price_coverage(prices, found if ids else everything), 3),
+            "text_coverage": round(text_coverage(lines, texts if ids else all_texts), 3),
+        })
+    data = menu_json.get("data", menu_json) if isinstance(menu_json, dict) else {}
+    return {
+        "price_coverage": round(price_coverage(ocr_total, everything), 3),
+        "text_coverage": round(text_coverage(ocr_lines, all_texts), 3),
+        "header_coverage": round(matched_headers / headers, 3) if headers else 1.0,
+        "ocr_prices": sum(ocr_total.values()),
+        "items": len(data.get("items") or []),
+        "sections": report,
+        "unreconciled": [
+            r for r in report if r["price_coverage"] < threshold or r["text_coverage"] < threshold
+        ],
+    }
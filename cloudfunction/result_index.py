@@ -0,0 +1,108 @@
+import hashlib
+import json
+from firebase_admin import firestore
+from firebase_utils import copy_menu_document, init_firebase
+from prompts import PROMPT_VERSION
+import metrics
+import settings
+
+
+def pipeline_version():
+    """Version stamp of everything that shapes a parse result besides its input."""
+    return f"{settings.PIPELINE_VERSION}:{PROMPT_VERSION}"
+
+
+def canonical_ocr(ocr_data):
+    """OCR input as stable text: JSON strings are re-serialized so formatting differences do not matter."""
+    if ocr_data is None:
+        return ""
+    if isinstance(ocr_data, str):
+        try:
+            ocr_data = json.loads(ocr_data)
+        except Exception:
+            return ocr_data.strip()
+    return json.dumps(ocr_data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def result_key(collection_name, ocr_data=None, file_hash=None):
+    """
+    Index key for a parse: sha256 over the target collection, pipeline version,
+    file content hash and OCR input. A prompt or pipeline version change yields
+    new keys, so entries written under the old version are never matched again.
+    """
+    digest = hashlib.sha256()
+    for part in (collection_name, pipeline_version(), file_hash or "", canonical_ocr(ocr_data)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def lookup_result(key):
+    """Return the index entry {"collection", "docId", "pipelineVersion"} for key, or None."""
+    db = init_firebase()
+    snapshot = db.collection(settings.RESULT_INDEX_COLLECTION).document(key).get()
+    if not snapshot.exists:
+        return None
+    entry = snapshot.to_dict()
+    if entry.get("pipelineVersion") != pipeline_version():
+        return None
+    return entry
+
+
+def record_result(key, collection_name, doc_id):
+    """Point key at the stored result document. Failures are logged, not raised: the result is already stored."""
+    try:
+        db = init_firebase()
+        db.collection(settings.RESULT_INDEX_COLLECTION).document(key).set({
+            "collection": collection_name,
+            "docId": doc_id,
+            "pipelineVersion": pipeline_version(),
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        })
+    except Exception as e:
+        print("Could not record result index entry:", e)
+
+
+def reuse_result(key, doc_id=None, overrides=None):
+    """
+    Serve a duplicate upload from the index. When doc_id is given, the indexed
+    result is copied into that document, pages included, with overrides such
+    as sourceFilePath applied. Returns True on a hit; a stale entry whose
+    document is gone counts as a miss.
+    """
+    entry = lookup_result(key)
+    if entry is None:
+        metrics.incr("result_index_miss")
+        return False
+    if doc_id and doc_id != entry["docId"]:
+        copied = copy_menu_document(entry["collection"], entry["docId"], doc_id, {
+            **(overrides or {}),
+            "dedupedFrom": entry["docId"],
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        })
+        if not copied:
+            metrics.incr("result_index_stale")
+            return False
+    print(f"Duplicate upload: reusing result {entry['collection']}/{entry['docId']}")
+    metrics.incr("result_index_hit")
+    return True
+
+
+def find_duplicate(collection_name, doc_id, source_file_path, ocr_data=None, file_hash=None):
+    """
+    Check the index before parsing. Returns (key, reused): reused is True when
+    the request was served from an earlier result; otherwise pass key to
+    record_result after storing. key is None when deduplication is off or the
+    lookup failed (parsing then proceeds as usual). file_hash may be a callable,
+    so the file is only hashed when deduplication is on.
+    """
+    if not settings.RESULT_DEDUPE:
+        return None, False
+    try:
+        if callable(file_hash):
+            file_hash = file_hash()
+        key = result_key(collection_name, ocr_data, file_hash)
+        return key, reuse_result(key, doc_id, {"sourceFilePath": source_file_path})
+    except Exception as e:
+        print("Result index lookup failed, parsing normally:", e)
+        return None, False
@@ -0,0 +1,77 @@
+import re
+from ocr_layout import PRICE_RE, looks_like_section_header
+from reconciliation import OCR_PRICE_RE, payload_lines
+
+# "Title ..... $9.50": a title with letters, optional dot leaders, one trailing price
+ITEM_PRICE_RE = re.compile(r'^(?P<title>.*?[A-Za-z].*?)[\s.]*(?P<price>[$£€]\s?\d{1,4}(?:[.,]\d{1,2})?|\d{1,4}[.,]\d{2})$')
+SIZE_WORD_RE = re.compile(r'^(SMALL|MEDIUM|LARGE|HALF|WHOLE|PINT|QUART|REGULAR)\b', re.I)
+
+
+def _price(token):
+    return round(float(token.lstrip("$£€").strip().replace(",", ".")), 2)
+
+
+def _is_description(text):
+    # Ingredient lines: lowercase start, comma lists or longer phrases. A line
+    # with a price ("add shrimp 6.00", "3.00 / 4.50") carries prices the menu
+    # must keep, so it is never folded into a description
+    if OCR_PRICE_RE.search(text):
+        return False
+    return text[:1].islower() or "," in text or len(text.split()) >= 4
+
+
+def rule_based_parse(payload, section_title=None):
+    """
+    Parse a simple chunk without a model: section headers become subcategories,
+    "title ... price" lines become items and the ingredient lines after an item
+    its description. Anything else (bare integers, multi-price lines, add-on
+    prices, size blocks, orphan text) is counted as unexplained for the caller
+    to escalate.
+    Returns (menu JSON, number of unexplained lines).
+    """
+    sub_categories = []
+    items = []
+    unexplained = 0
+    current = None
+
+    def open_subcategory(title):
+        sub_categories.append({"id": len(sub_categories) + 1, "catId": 1, "title": title, "description": ""})
+
+    if section_title and section_title.strip():
+        open_subcategory(section_title.strip())
+
+    for raw in payload_lines(payload):
+        text = raw.strip()
+        if not text or text == "### COLUMN BREAK ###":
+            continue
+        if section_title and text == section_title.strip() and len(sub_categories) == 1 and not items:
+            continue
+        if looks_like_section_header(text):
+            open_subcategory(text)
+            current = None
+            continue
+        # More than one price on a line means variants, which are left to the model
+        match = ITEM_PRICE_RE.match(text)
+        if match and sub_categories and len(OCR_PRICE_RE.findall(text)) == 1 and not SIZE_WORD_RE.match(text):
+            current = {
+                "itemId": len(items) + 1, "subCatId": sub_categories[-1]["id"],
+                "title": match.group("title").strip(" .-:"), "description": "", "price": _price(match.group("price")),
+                "variantAvailable": 0, "variants": [], "optionsAvailable": 0, "options": [],
+            }
+            items.append(current)
+            continue
+        if current is not None and not PRICE_RE.match(text) and _is_description(text):
+            current["description"] = f"{current['description']} {text}".strip()
+            continue
+        unexplained += 1
+
+    # Subcategories without items are dropped, as the prompt asks of the model
+    used = {item["subCatId"] for item in items}
+    kept = [s for s in sub_categories if s["id"] in used]
+    renumber = {s["id"]: i for i, s in enumerate(kept, start=1)}
+    for s in kept:
+        s["id"] = renumber[s["id"]]
+    for item in items:
+        item["subCatId"] = renumber[item["subCatId"]]
+    categories = [{"id": 1, "title": "Food", "description": ""}] if kept else []
+    return {"data": {"category": categories, "sub_category": kept, "items": items}}, unexplained
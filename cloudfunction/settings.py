@@ -0,0 +1,134 @@
+# Service settings, read once from the environment (and .env) at import time.
+# Every uvicorn worker and CPU pool process imports this module, so they all
+# see the same configuration.
+import os
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _int_env(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _bool_env(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+# HTTP server
+PORT = _int_env("PORT", 8080)
+# Number of uvicorn worker processes (uvicorn reads the same variable)
+WEB_CONCURRENCY = _int_env("WEB_CONCURRENCY", 1)
+
+# Process pool for CPU-bound stages (rasterizing, OCR post-processing, schema
+# validation). 0 runs those stages inline in the request thread.
+CPU_POOL_WORKERS = _int_env("CPU_POOL_WORKERS", max((os.cpu_count() or 1) - 1, 0))
+
+# Starting chunk size for parse_menu; shrinks per menu when completions get truncated
+CHUNK_MAX_CHARS = _int_env("CHUNK_MAX_CHARS", 2000)
+CHUNK_MIN_CHARS = _int_env("CHUNK_MIN_CHARS", 300)
+
+# Large PDFs are parsed in page-range shards and merged globally
+PDF_PAGES_PER_SHARD = _int_env("PDF_PAGES_PER_SHARD", 10)
+# Shards parsed at the same time per request
+PDF_SHARD_CONCURRENCY = _int_env("PDF_SHARD_CONCURRENCY", 2)
+# When set (e.g. https://<service>/parse-menu-shard), shards are sent to other instances
+PDF_SHARD_URL = os.getenv("PDF_SHARD_URL", "")
+PDF_SHARD_TIMEOUT = _int_env("PDF_SHARD_TIMEOUT", 540)
+
+# Local disk cache for Storage downloads (0 disables it)
+FILE_CACHE_DIR = os.getenv("FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "menuparser-file-cache"))
+FILE_CACHE_MAX_BYTES = _int_env("FILE_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+# Download chunk size; must be a multiple of 256 KiB
+FILE_DOWNLOAD_CHUNK_BYTES = _int_env("FILE_DOWNLOAD_CHUNK_BYTES", 8 * 1024 * 1024)
+
+# Merge word-level OCR fragments into line records (name + price) before chunking
+OCR_LINE_MERGE = _bool_env("OCR_LINE_MERGE", True)
+# Read multi-column layouts column by column when chunking positioned OCR
+OCR_COLUMN_LAYOUT = _bool_env("OCR_COLUMN_LAYOUT", True)
+# Token budget for the OCR lines of one vision section chunk
+VISION_CHUNK_MAX_TOKENS = _int_env("VISION_CHUNK_MAX_TOKENS", 1500)
+
+# Parse digital PDF pages from their embedded text layer instead of rasterizing
+PDF_TEXT_LAYER = _bool_env("PDF_TEXT_LAYER", True)
+# Fewer extracted words than this means the page is treated as scanned
+PDF_TEXT_MIN_WORDS = _int_env("PDF_TEXT_MIN_WORDS", 20)
+
+# Reuse stored results for byte-identical uploads (file + OCR + pipeline version)
+RESULT_DEDUPE = _bool_env("RESULT_DEDUPE", True)
+RESULT_INDEX_COLLECTION = os.getenv("RESULT_INDEX_COLLECTION", "menu_result_index")
+# Bump when parsing logic changes so earlier results stop matching; prompt edits
+# are picked up automatically through prompts.PROMPT_VERSION
+PIPELINE_VERSION = os.getenv("PIPELINE_VERSION", "1")
+
+# Per-request debug artifacts (prompts, raw model output, intermediate JSON),
+# gzip-compressed and uploaded to the document's debugRawTextPath in the background
+DEBUG_ARTIFACTS = _bool_env("DEBUG_ARTIFACTS", True)
+# Raw bytes kept per request; artifacts beyond this are dropped
+DEBUG_ARTIFACT_MAX_BYTES = _int_env("DEBUG_ARTIFACT_MAX_BYTES", 8 * 1024 * 1024)
+# Finished requests waiting for upload; when full, new artifacts are dropped rather than waited on
+DEBUG_ARTIFACT_QUEUE_SIZE = _int_env("DEBUG_ARTIFACT_QUEUE_SIZE", 64)
+DEBUG_ARTIFACT_BATCH_SIZE = _int_env("DEBUG_ARTIFACT_BATCH_SIZE", 16)
+DEBUG_ARTIFACT_FLUSH_SECONDS = _int_env("DEBUG_ARTIFACT_FLUSH_SECONDS", 2)
+
+# Firestore layout for stored menus: "auto" keeps small menus inline in the
+# document and pages large ones into a subcollection; "inline" / "paged" force one
+MENU_STORAGE_LAYOUT = os.getenv("MENU_STORAGE_LAYOUT", "auto")
+# Documents whose Firestore storage size would exceed this are paged: just under
+# Firestore's 1 MiB document cap, so every menu that fits stays in the "menu" field
+# the web UIs read
+MENU_INLINE_MAX_BYTES = _int_env("MENU_INLINE_MAX_BYTES", 1000 * 1000)
+# Records per page, and the JSON size a page may not exceed
+MENU_PAGE_SIZE = _int_env("MENU_PAGE_SIZE", 200)
+MENU_PAGE_MAX_BYTES = _int_env("MENU_PAGE_MAX_BYTES", 512 * 1024)
+
+# Optional JSON vocabulary of subcategory variants -> canonical titles, added to
+# the built-in CANONICAL_SUBCATS ({"variant": "Canonical"} or {"Canonical": [variants]})
+CANONICAL_SUBCATS_PATH = os.getenv("CANONICAL_SUBCATS_PATH", "")
+
+# Chunk cascade: a chunk is parsed by the rule-based parser first, then by each
+# model in order (cheapest first) until its confidence score reaches the threshold
+CHUNK_MODELS = [m.strip() for m in os.getenv("CHUNK_MODELS", "gpt-4.1-nano,gpt-4.1-mini").split(",") if m.strip()]
+CHUNK_CONFIDENCE_THRESHOLD = float(os.getenv("CHUNK_CONFIDENCE_THRESHOLD", "0.8"))
+CHUNK_RULE_BASED = _bool_env("CHUNK_RULE_BASED", True)
+
+# Vision refinement is skipped when the text parse accounts for at least this
+# share of the OCR prices in every section and of the OCR section headers
+VISION_REFINE_SKIP_COVERAGE = float(os.getenv("VISION_REFINE_SKIP_COVERAGE", "0.95"))
+# Otherwise send only the unreconciled sections to refinement when the rest reconciles
+VISION_REFINE_PARTIAL = _bool_env("VISION_REFINE_PARTIAL", True)
+
+# PDF page pipeline (pipeline_executor): worker threads per shard for each stage,
+# the process-wide limit on concurrent calls of the stage, and the bounded
+# queue size between stages
+PDF_RASTER_WORKERS = _int_env("PDF_RASTER_WORKERS", 1)
+PDF_RASTER_CONCURRENCY = _int_env("PDF_RASTER_CONCURRENCY", max(1, CPU_POOL_WORKERS))
+PDF_PARSE_WORKERS = _int_env("PDF_PARSE_WORKERS", 2)
+PDF_PARSE_CONCURRENCY = _int_env("PDF_PARSE_CONCURRENCY", 16)
+PIPELINE_QUEUE_SIZE = _int_env("PIPELINE_QUEUE_SIZE", 2)
+
+# Bytes of large buffers (request body, source file, page images and their
+# vision calls) one request may hold at once; over it, PDF pages wait for each
+# other and requests that cannot fit are rejected with 413 (0 disables)
+REQUEST_MEMORY_BUDGET = _int_env("REQUEST_MEMORY_BUDGET", 512 * 1024 * 1024)
+
+# LLM calls running at once per worker process, shared between tenants by
+# weighted fair queuing (0 disables the scheduler)
+LLM_CONCURRENCY = _int_env("LLM_CONCURRENCY", 16)
+# Tenant = docId up to the first delimiter (e.g. "<restaurantId>_<menuId>")
+TENANT_DELIMITER = os.getenv("TENANT_DELIMITER", "_")
+# Optional relative shares, e.g. "bulk-import:0.25,vip:2" (default weight 1)
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+
+# End-to-end time budget of a parse request in seconds (0 disables). Stages and
+# LLM calls take their timeouts from what is left; when it runs out, the
+# sections parsed so far are stored as a partial menu. Keep it below the
+# platform's request timeout.
+REQUEST_DEADLINE_SECONDS = _int_env("REQUEST_DEADLINE_SECONDS", 480)
+# No LLM call is started with less time than this left
+DEADLINE_MIN_CALL_SECONDS = _int_env("DEADLINE_MIN_CALL_SECONDS", 5)
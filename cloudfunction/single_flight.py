@@ -0,0 +1,50 @@
+import hashlib
+import threading
+from concurrent.futures import Future
+import metrics
+
+
+class SingleFlight:
+    """
+    In-process request coalescing: while a call for a key is running, further
+    calls with the same key wait for it and share its result (or exception)
+    instead of running the work again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once per concurrent key. Returns (result, shared)."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        if not leader:
+            print(f"{self.name}: joining in-flight call {key[:12]}")
+            metrics.incr(f"{self.name}_coalesced")
+            return future.result(), True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+
+def flight_key(source_file_path, ocr_text):
+    """Coalescing key: source path plus a hash of the (canonical) OCR input."""
+    digest = hashlib.sha256()
+    digest.update((source_file_path or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((ocr_text or "").encode("utf-8"))
+    return digest.hexdigest()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The service modules are flat top-level modules in cloudfunction/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The LLM clients are constructed at import time; tests never call them
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import langchain_pipeline
+from adaptive_chunking import ChunkSizer, payload_tail, serialize_payload, split_payload
+
+LINES = [f"Dish {n} {n}.50\n" for n in range(1, 9)]
+
+
+def test_split_payload_halves_records_and_lines():
+    assert split_payload([1, 2, 3]) == [[1], [2, 3]]
+    assert split_payload("a\nb\nc\nd\n") == ["a\nb\n", "c\nd\n"]
+    assert split_payload([1]) is None
+    assert split_payload("one line") is None
+
+
+def test_payload_tail_after_last_finished_item():
+    records = [{"text": "Dish 1"}, {"text": "Dish 10"}, {"text": "Dish 2"}]
+    assert payload_tail(records, "Dish 1") == [{"text": "Dish 10"}, {"text": "Dish 2"}]
+    assert payload_tail(records, "Dish 2") == []
+    assert payload_tail(records, "Pizza") is None
+    assert payload_tail("".join(LINES), "Dish 6") == "Dish 7 7.50\nDish 8 8.50\n"
+    assert payload_tail(records, "") is None
+
+
+def test_chunk_sizer_fits_and_learns_from_truncation():
+    sizer = ChunkSizer(max_size=100)
+    payload = "".join(LINES)
+    assert sizer.fit(payload) == [payload]
+    sizer.observe_truncation(len(payload), completed_size=40)
+    assert sizer.max_size == 36
+    assert sizer.truncations == 1
+    pieces = sizer.fit(payload)
+    assert "".join(pieces) == payload
+    assert all(len(piece) <= 36 for piece in pieces)
+    sizer.observe_truncation(36)
+    assert sizer.max_size == 16
+
+
+def fake_model(max_items):
+    """invoke_mapping_chain stand-in that stops after max_items items, like a completion hitting max_tokens."""
+    calls = []
+
+    def invoke(chunk_text, label="chunk", model=None):
+        calls.append(chunk_text)
+        titles = [line.rsplit(" ", 1)[0] for line in chunk_text.splitlines() if line.strip()]
+        items = [{"itemId": n, "subCatId": 1, "title": title, "price": 1.0} for n, title in enumerate(titles, start=1)]
+        text = json.dumps({"data": {"category": [], "sub_category": [], "items": items}})
+        if len(items) <= max_items:
+            return text, "stop"
+        cut = text.index(json.dumps(items[max_items])) + 10
+        return text[:cut], "length"
+    return invoke, calls
+
+
+def parsed_titles(results):
+    return [item["title"] for result in results for item in result["data"]["items"]]
+
+
+def test_truncated_chunk_reruns_only_the_unparsed_tail(monkeypatch):
+    invoke, calls = fake_model(max_items=3)
+    monkeypatch.setattr(langchain_pipeline, "invoke_mapping_chain", invoke)
+    sizer = ChunkSizer(max_size=1000)
+    payload = "".join(LINES)
+    results = langchain_pipeline.parse_chunk_adaptive(payload, sizer)
+    assert parsed_titles(results) == [f"Dish {n}" for n in range(1, 9)]
+    assert sizer.truncations == 1
+    assert sizer.max_size < len(serialize_payload(payload))
+    # The first three items are never sent again
+    assert not any("Dish 2 " in text for text in calls[1:])
+
+
+def test_unsplittable_truncated_chunk_fails(monkeypatch):
+    invoke, _ = fake_model(max_items=0)
+    monkeypatch.setattr(langchain_pipeline, "invoke_mapping_chain", invoke)
+    with pytest.raises(ValueError, match="cannot be split further"):
+        langchain_pipeline.parse_chunk_adaptive("Dish 1 1.50\n", ChunkSizer(max_size=1000))
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+import bulk_reparse
+
+
+@pytest.fixture
+def two_page_pdf(monkeypatch):
+    monkeypatch.setattr(bulk_reparse, "download_file_from_firebase", lambda path: b"%PDF")
+    monkeypatch.setattr(bulk_reparse, "pdf_page_count", lambda data: 2)
+    monkeypatch.setattr(bulk_reparse, "pdf_text_pages", lambda data, first, last: ["Soup 4.50", ""])
+
+
+def pdf_job(ocr_data=None):
+    return {"collection": bulk_reparse.VISION_COLLECTION, "sourceFilePath": "menu.pdf", "ocr_data": ocr_data}
+
+
+def test_scanned_page_uses_its_ocr(two_page_pdf):
+    units = bulk_reparse.job_units(pdf_job(["page one", "Salad 6.00"]))
+    assert units == [{"ocr": "Soup 4.50"}, {"ocr": "Salad 6.00", "page": 2}]
+
+
+def test_scanned_page_without_ocr_fails_the_job(two_page_pdf):
+    with pytest.raises(ValueError, match="page 2"):
+        bulk_reparse.job_units(pdf_job())
+
+
+def test_store_keeps_previous_debug_path(monkeypatch):
+    stored = {}
+    previous = SimpleNamespace(exists=True, to_dict=lambda: {"createdAt": "then", "debugRawTextPath": "debug/a.jsonl"})
+    doc_ref = SimpleNamespace(get=lambda: previous)
+    firebase = SimpleNamespace(collection=lambda name: SimpleNamespace(document=lambda doc_id: doc_ref))
+    monkeypatch.setattr(bulk_reparse, "init_firebase", lambda: firebase)
+    monkeypatch.setattr(bulk_reparse, "pipeline_version", lambda: "v")
+    monkeypatch.setattr(bulk_reparse, "store_menu_json", lambda doc_id, doc, collection_name: stored.update(doc))
+    monkeypatch.setattr(bulk_reparse.settings, "RESULT_DEDUPE", False)
+    job = dict(pdf_job(), docId="a", units=[{"final": {"Title": "Menu"}}])
+    bulk_reparse.store_jobs({"jobs": [job]})
+    assert stored["debugRawTextPath"] == "debug/a.jsonl"
+    assert stored["createdAt"] == "then"
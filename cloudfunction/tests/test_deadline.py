@@ -0,0 +1,100 @@
+import httpx
+import openai
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import deadline
+import langchain_pipeline
+import menu_parser_with_file
+import settings
+
+
+@pytest.fixture
+def request_deadline():
+    token = deadline.start_request(30)
+    yield
+    deadline.finish_request(token)
+
+
+def test_no_retries_under_a_deadline(request_deadline):
+    assert deadline.call_retries(2) == 0
+    assert menu_parser_with_file.chat_completions() is menu_parser_with_file._no_retry_client.chat.completions
+    assert menu_parser_with_file._no_retry_client.max_retries == 0
+    assert langchain_pipeline.get_llm(None, deadline.call_retries(None)).max_retries == 0
+
+
+def test_client_retries_without_a_deadline():
+    assert deadline.call_retries(2) == 2
+    assert langchain_pipeline.get_llm(None, deadline.call_retries(None)) is langchain_pipeline.llm
+
+
+@pytest.fixture
+def two_model_cascade(monkeypatch):
+    monkeypatch.setattr(settings, "CHUNK_MODELS", ["small", "large"])
+    monkeypatch.setattr(langchain_pipeline, "rule_based_result", lambda payload, label: None)
+    monkeypatch.setattr(langchain_pipeline, "results_confidence", lambda payload, results: {"score": 0.1})
+
+
+def test_cascade_keeps_best_result_when_escalation_times_out(monkeypatch, two_model_cascade):
+    def parse(payload, sizer, label, model):
+        if model == "large":
+            raise deadline.DeadlineExceeded("Request deadline reached before chunk")
+        return ["small result"]
+    monkeypatch.setattr(langchain_pipeline, "parse_chunk_adaptive", parse)
+    assert langchain_pipeline.parse_chunk_cascade("text", None) == ["small result"]
+
+
+def test_cascade_raises_other_escalation_errors(monkeypatch, two_model_cascade):
+    def parse(payload, sizer, label, model):
+        if model == "large":
+            raise RuntimeError("boom")
+        return ["small result"]
+    monkeypatch.setattr(langchain_pipeline, "parse_chunk_adaptive", parse)
+    with pytest.raises(RuntimeError):
+        langchain_pipeline.parse_chunk_cascade("text", None)
+
+
+@pytest.fixture
+def ends_in_last_seconds(monkeypatch):
+    """
+    A section that starts with time to spare and fails once less than
+    DEADLINE_MIN_CALL_SECONDS is left, but before the deadline has passed.
+    """
+    monkeypatch.setattr(settings, "DEADLINE_MIN_CALL_SECONDS", 1)
+    token = deadline.start_request(3)
+
+    def section(error):
+        monkeypatch.setattr(settings, "DEADLINE_MIN_CALL_SECONDS", 5)
+        raise error
+    yield section
+    deadline.finish_request(token)
+
+
+def test_real_failures_near_the_deadline_are_raised(ends_in_last_seconds):
+    with pytest.raises(RuntimeError):
+        deadline.run_section("chunk 1", ends_in_last_seconds, RuntimeError("401 Unauthorized"))
+    assert not deadline.timed_out(RuntimeError("401 Unauthorized"))
+    assert deadline.missing_sections() == []
+
+
+def test_client_timeouts_near_the_deadline_are_deadline_stops(ends_in_last_seconds):
+    assert deadline.run_section("page 2", ends_in_last_seconds, requests.Timeout("read timed out")) is None
+    assert deadline.missing_sections() == ["page 2"]
+    assert deadline.timed_out(openai.APITimeoutError(request=httpx.Request("POST", "https://api.openai.com")))
+
+
+def test_client_timeouts_without_a_deadline_are_failures():
+    assert not deadline.timed_out(TimeoutError("client timeout"))
+
+
+def test_shard_endpoint_maps_the_deadline_to_504(monkeypatch):
+    import main
+
+    def parse_shard(*args):
+        raise deadline.DeadlineExceeded("Request deadline reached before page 1")
+    monkeypatch.setattr(main, "parse_menu_shard", parse_shard)
+    response = TestClient(main.app).post("/parse-menu-shard", json={
+        "sourceFilePath": "menu.pdf", "ocr_data": "[]", "firstPage": 1, "lastPage": 1, "deadlineSeconds": 10,
+    })
+    assert response.status_code == 504
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import file_utils
+import settings
+
+
+class FakeBlob:
+    def __init__(self, bucket, path):
+        self.bucket, self.path = bucket, path
+        data = bucket.files[path]
+        self.size = len(data)
+        self.generation = bucket.generations.get(path, 1)
+        self.md5_hash = str(hash(data))
+        self.chunk_size = None
+
+    def reload(self):
+        pass
+
+    def download_to_file(self, f):
+        self.bucket.downloads.append(self.path)
+        f.write(self.bucket.files[self.path])
+
+
+class FakeBucket:
+    def __init__(self, files):
+        self.files = files
+        self.generations = {}
+        self.downloads = []
+
+    def blob(self, path):
+        return FakeBlob(self, path)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FILE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "FILE_CACHE_MAX_BYTES", 100)
+    return tmp_path
+
+
+def read(path, bucket):
+    with file_utils.open_cached_file(path, bucket) as f:
+        return f.read()
+
+
+def test_repeat_reads_hit_the_cache(cache_dir):
+    bucket = FakeBucket({"a.pdf": b"a" * 40})
+    assert read("a.pdf", bucket) == b"a" * 40
+    assert read("a.pdf", bucket) == b"a" * 40
+    assert bucket.downloads == ["a.pdf"]
+
+
+def test_new_generation_is_downloaded_again(cache_dir):
+    bucket = FakeBucket({"a.pdf": b"a" * 40})
+    read("a.pdf", bucket)
+    bucket.files["a.pdf"] = b"b" * 40
+    bucket.generations["a.pdf"] = 2
+    assert read("a.pdf", bucket) == b"b" * 40
+    assert bucket.downloads == ["a.pdf", "a.pdf"]
+
+
+def test_least_recently_used_entry_is_evicted(cache_dir):
+    bucket = FakeBucket({"a.pdf": b"a" * 40, "b.pdf": b"b" * 40, "c.pdf": b"c" * 40})
+    read("a.pdf", bucket)
+    os.utime(next(cache_dir.iterdir()), (0, 0))
+    read("b.pdf", bucket)
+    read("c.pdf", bucket)
+    assert len(list(cache_dir.iterdir())) == 2
+    read("b.pdf", bucket)
+    read("a.pdf", bucket)
+    assert bucket.downloads == ["a.pdf", "b.pdf", "c.pdf", "a.pdf"]
+
+
+def test_returned_entry_survives_eviction(cache_dir, monkeypatch):
+    monkeypatch.setattr(settings, "FILE_CACHE_MAX_BYTES", 60)
+    bucket = FakeBucket({"a.pdf": b"a" * 50, "b.pdf": b"b" * 50})
+    read("a.pdf", bucket)
+    # b.pdf is newer than a.pdf, but trimming the cache must not delete it before it is read
+    for entry in cache_dir.iterdir():
+        os.utime(entry, (2 ** 31, 2 ** 31))
+    assert read("b.pdf", bucket) == b"b" * 50
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+def test_file_larger_than_the_cache_is_not_cached(cache_dir):
+    bucket = FakeBucket({"big.pdf": b"x" * 150})
+    assert read("big.pdf", bucket) == b"x" * 150
+    assert read("big.pdf", bucket) == b"x" * 150
+    assert bucket.downloads == ["big.pdf", "big.pdf"]
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_evict_keeps_the_kept_entry(tmp_path):
+    for name, mtime in (("old", 1), ("kept", 2), ("new", 3)):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        os.utime(tmp_path / name, (mtime, mtime))
+    file_utils.evict_file_cache(str(tmp_path), 10, keep=str(tmp_path / "kept"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["kept"]
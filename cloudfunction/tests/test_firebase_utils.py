@@ -0,0 +1,110 @@
+import pytest
+
+import firebase_utils
+import settings
+from loadtest import FakeFirestore
+
+COLLECTION = "menus_langchain"
+
+
+def sample_menu(items=5, sub_categories=2):
+    return {"data": {
+        "category": [{"id": 1, "title": "Food", "description": ""}],
+        "sub_category": [{"id": n, "catId": 1, "title": f"Section {n}", "description": ""} for n in range(1, sub_categories + 1)],
+        "items": [
+            {"itemId": n, "subCatId": n % sub_categories + 1, "title": f"Dish {n}", "price": 5.5}
+            for n in range(1, items + 1)
+        ],
+    }}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeFirestore()
+    monkeypatch.setattr(firebase_utils, "init_firebase", lambda: fake)
+    monkeypatch.setattr(settings, "MENU_PAGE_SIZE", 2)
+    return fake
+
+
+def stored(db, doc_id="doc"):
+    return db.collection(COLLECTION).get(doc_id)
+
+
+def page_ids(db, doc_id="doc"):
+    return sorted(db.collection(COLLECTION).subcollection(doc_id, "pages"))
+
+
+def test_menu_pages_split_by_count_and_size(monkeypatch):
+    monkeypatch.setattr(settings, "MENU_PAGE_SIZE", 2)
+    monkeypatch.setattr(settings, "MENU_PAGE_MAX_BYTES", 10 ** 6)
+    pages = list(firebase_utils._menu_pages([sample_menu(items=5)]))
+    items = [p for p in pages if p["section"] == "items"]
+    assert [len(p["records"]) for p in items] == [2, 2, 1]
+    assert [p["page"] for p in items] == [0, 1, 2]
+    assert items[0]["subCatIds"] == [1, 2]
+    assert "subCatIds" not in pages[0]
+    monkeypatch.setattr(settings, "MENU_PAGE_MAX_BYTES", 1)
+    # A record larger than the byte limit still gets a page of its own
+    pages = list(firebase_utils._menu_pages([sample_menu(items=3)]))
+    assert [len(p["records"]) for p in pages if p["section"] == "items"] == [1, 1, 1]
+
+
+def test_menu_that_fits_is_stored_inline(db):
+    firebase_utils.store_menu_json("doc", {"menu": [sample_menu()], "source": "langchain"})
+    assert stored(db)["menu"] == [sample_menu()]
+    assert page_ids(db) == []
+
+
+def test_oversize_menu_is_paged(db, monkeypatch):
+    monkeypatch.setattr(settings, "MENU_INLINE_MAX_BYTES", 200)
+    firebase_utils.store_menu_json("doc", {"menu": [sample_menu()], "source": "langchain"})
+    doc = stored(db)
+    assert "menu" not in doc
+    assert doc["layout"] == "paged"
+    assert doc["menuPages"] == [{"category": 1, "sub_category": 1, "items": 3}]
+    assert doc["menuCounts"] == [{"category": 1, "sub_category": 2, "items": 5}]
+    assert len(page_ids(db)) == 5
+
+
+def test_firestore_size_counts_numbers_as_eight_bytes():
+    assert firebase_utils.firestore_size({"price": 5, "title": "Soup"}) == (6 + 8) + (6 + 5)
+    assert firebase_utils.firestore_size([True, None, 1.5]) == 10
+
+
+@pytest.mark.parametrize("layout", ["inline", "paged"])
+def test_read_menu_page_and_subcategory_items(db, monkeypatch, layout):
+    monkeypatch.setattr(settings, "MENU_STORAGE_LAYOUT", layout)
+    firebase_utils.store_menu_json("doc", {"menu": [sample_menu()]})
+    page = firebase_utils.read_menu_page("doc", "items", page=1)
+    assert [r["itemId"] for r in page["records"]] == [3, 4]
+    assert page["pageCount"] == 3
+    assert firebase_utils.read_menu_page("doc", "items", menu_index=1)["records"] == []
+    assert firebase_utils.read_menu_page("missing", "items") is None
+    items = firebase_utils.read_subcategory_items("doc", 1)
+    assert [r["itemId"] for r in items] == [2, 4]
+    assert firebase_utils.read_subcategory_items("missing", 1) is None
+
+
+def test_smaller_version_deletes_stale_pages(db, monkeypatch):
+    monkeypatch.setattr(settings, "MENU_STORAGE_LAYOUT", "paged")
+    firebase_utils.store_menu_json("doc", {"menu": [sample_menu(items=5)]})
+    firebase_utils.store_menu_json("doc", {"menu": [sample_menu(items=2)]})
+    assert page_ids(db) == ["m0-category-00000", "m0-items-00000", "m0-sub_category-00000"]
+    monkeypatch.setattr(settings, "MENU_STORAGE_LAYOUT", "inline")
+    firebase_utils.store_menu_json("doc", {"menu": [sample_menu(items=2)]})
+    assert page_ids(db) == []
+    assert stored(db)["menu"] == [sample_menu(items=2)]
+
+
+@pytest.mark.parametrize("layout", ["inline", "paged"])
+def test_copy_menu_document(db, monkeypatch, layout):
+    monkeypatch.setattr(settings, "MENU_STORAGE_LAYOUT", layout)
+    firebase_utils.store_menu_json("source", {"menu": [sample_menu()], "createdAt": 1})
+    # The destination had a larger paged menu before; its extra pages must go
+    monkeypatch.setattr(settings, "MENU_STORAGE_LAYOUT", "paged")
+    firebase_utils.store_menu_json("dest", {"menu": [sample_menu(items=9)]})
+    assert firebase_utils.copy_menu_document(COLLECTION, "source", "dest", {"createdAt": 2})
+    assert stored(db, "dest") == {**stored(db, "source"), "createdAt": 2}
+    assert page_ids(db, "dest") == page_ids(db, "source")
+    assert firebase_utils.read_subcategory_items("dest", 2) == firebase_utils.read_subcategory_items("source", 2)
+    assert not firebase_utils.copy_menu_document(COLLECTION, "missing", "dest")
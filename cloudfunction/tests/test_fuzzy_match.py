@@ -0,0 +1,47 @@
+import random
+import string
+from difflib import get_close_matches
+
+import pytest
+
+from fuzzy_match import FuzzyMatcher
+
+MENU_WORDS = ["soups", "wings", "salads", "desserts", "drinks", "burgers", "sides", "pasta", "main course"]
+
+
+def expected(query, choices, cutoff):
+    matches = get_close_matches(query, choices, n=1, cutoff=cutoff)
+    return matches[0] if matches else None
+
+
+@pytest.mark.parametrize("query,choice", [("addh b", "ddgh b"), ("   ec", "   hc")])
+def test_matches_reached_with_few_shared_trigrams(query, choice):
+    assert FuzzyMatcher([choice]).best_match(query, cutoff=0.8) == choice
+
+
+def test_single_edits_of_menu_words_match_difflib():
+    matcher = FuzzyMatcher(MENU_WORDS)
+    alphabet = string.ascii_lowercase + " "
+    for word in MENU_WORDS:
+        for i in range(len(word) + 1):
+            for ch in alphabet:
+                for query in (word[:i] + ch + word[i:], word[:i] + ch + word[i + 1:], word[:i] + word[i + 1:]):
+                    assert matcher.best_match(query, cutoff=0.8) == expected(query, MENU_WORDS, 0.8), query
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_queries_match_difflib(seed):
+    rng = random.Random(seed)
+    for _ in range(300):
+        alphabet = rng.choice(["ab ", "abcdeh ", string.ascii_lowercase + " "])
+        choices = sorted({"".join(rng.choice(alphabet) for _ in range(rng.randint(0, 14))) for _ in range(rng.randint(1, 40))})
+        query = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 14)))
+        cutoff = rng.choice([0.0, 0.5, 0.6, 0.8, 0.85, 0.9, 1.0])
+        assert FuzzyMatcher(choices).best_match(query, cutoff=cutoff) == expected(query, choices, cutoff), (query, choices, cutoff)
+
+
+def test_choices_added_later_are_found():
+    matcher = FuzzyMatcher(["soups"])
+    assert matcher.best_match("salad", cutoff=0.8) is None
+    matcher.add("salads")
+    assert matcher.best_match("salad", cutoff=0.8) == "salads"
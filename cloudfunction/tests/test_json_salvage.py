@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from json_salvage import TolerantJSONParser, parse_model_json, remaining_tail, salvage_menu_json, strip_code_fences
+
+MENU = {"data": {
+    "category": [{"id": 1, "title": "Food"}],
+    "sub_category": [{"id": 1, "catId": 1, "title": "Mains"}],
+    "items": [
+        {"itemId": 1, "subCatId": 1, "title": "Soup", "price": 4.5},
+        {"itemId": 2, "subCatId": 1, "title": "Steak", "price": 21.0},
+    ],
+}}
+
+
+def test_strip_code_fences_and_leading_prose():
+    fenced = "Here is the menu:\n```json\n" + json.dumps(MENU) + "\n```"
+    assert json.loads(strip_code_fences(fenced)) == MENU
+
+
+def test_parser_tolerates_trailing_and_missing_commas_and_python_literals():
+    parser = TolerantJSONParser('{"a": [1, 2,], "b": True "c": None,}')
+    assert parser.parse() == {"a": [1, 2], "b": True, "c": None}
+
+
+def test_parser_returns_none_when_truncated_inside_a_scalar():
+    assert TolerantJSONParser('"unfinished').parse() is None
+
+
+def test_parser_rejects_empty_output():
+    with pytest.raises(ValueError):
+        TolerantJSONParser("   ").parse()
+
+
+def test_valid_output_is_parsed_strictly():
+    assert parse_model_json("```json\n" + json.dumps(MENU) + "\n```") == (MENU, None)
+
+
+def test_truncated_output_keeps_complete_items():
+    text = json.dumps(MENU)
+    cut = text[:text.index('"Steak"') + 4]
+    menu, report = parse_model_json("```json\n" + cut)
+    assert [item["title"] for item in menu["data"]["items"]] == ["Soup"]
+    assert menu["data"]["category"] == MENU["data"]["category"]
+    assert report["truncated"] is True
+    assert report["recovered"]["items"] == 1
+    assert report["dropped"]["items"] == 1
+    assert report["last_item_title"] == "Soup"
+
+
+def test_truncated_scalar_drops_the_unfinished_item():
+    text = json.dumps(MENU)
+    menu, report = salvage_menu_json(text[:text.index("21.0") + 2])
+    assert [item["title"] for item in menu["data"]["items"]] == ["Soup"]
+    assert report["truncated"] is True
+
+
+def test_salvage_rejects_output_without_an_object():
+    with pytest.raises(ValueError):
+        salvage_menu_json("[1, 2, 3]")
+
+
+def test_remaining_tail_after_last_item():
+    chunk = "Soup 4.50\nItem 1 3.00\nItem 10 5.00\n"
+    assert remaining_tail(chunk, "Item 1") == "Item 10 5.00\n"
+    assert remaining_tail(chunk, "Item 10") == ""
+    assert remaining_tail(chunk, "Pizza") is None
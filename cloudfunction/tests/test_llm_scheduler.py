@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+import metrics
+from llm_scheduler import FairScheduler, tenant_for
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def queue_call(scheduler, tenant, admitted, hold=None):
+    """Start a thread whose call for tenant queues up; it records its admission and releases."""
+    queued = len(scheduler._heap)
+
+    def call():
+        scheduler.acquire(tenant)
+        admitted.append(tenant)
+        if hold is not None:
+            hold.wait(5)
+        scheduler.release()
+    thread = threading.Thread(target=call)
+    thread.start()
+    wait_for(lambda: len(scheduler._heap) > queued)
+    return thread
+
+
+def test_calls_are_admitted_by_weighted_finish_time():
+    scheduler = FairScheduler(1, weights={"small": 2.0})
+    scheduler.acquire("holder")
+    admitted = []
+    # The bulk tenant queues first; FIFO would run all of its calls before the other tenant's
+    threads = [queue_call(scheduler, "bulk", admitted) for _ in range(3)]
+    threads += [queue_call(scheduler, "small", admitted) for _ in range(4)]
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == ["small", "bulk", "small", "small", "bulk", "small", "bulk"]
+    assert scheduler.in_flight == 0
+
+
+def test_timed_out_call_leaves_the_queue():
+    scheduler = FairScheduler(1)
+    scheduler.acquire("a")
+    with pytest.raises(TimeoutError):
+        scheduler.acquire("b", timeout=0.05)
+    assert scheduler._heap == []
+    assert scheduler._queued == {}
+    scheduler.release()
+    assert scheduler.in_flight == 0
+    assert scheduler.acquire("b", timeout=0.05) < 0.05
+
+
+def test_release_hands_the_slot_to_the_waiting_call():
+    scheduler = FairScheduler(1)
+    scheduler.acquire("a")
+    admitted, hold = [], threading.Event()
+    thread = queue_call(scheduler, "b", admitted, hold)
+    scheduler.release()
+    wait_for(lambda: admitted == ["b"])
+    # The slot went straight to the waiter; a new call cannot take it meanwhile
+    assert scheduler.in_flight == 1
+    with pytest.raises(TimeoutError):
+        scheduler.acquire("c", timeout=0.05)
+    hold.set()
+    thread.join(5)
+    assert scheduler.in_flight == 0
+
+
+def test_tenant_metrics_drop_least_recently_active_idle_tenants(monkeypatch):
+    monkeypatch.setattr(metrics, "_tenants", {})
+    monkeypatch.setattr(metrics, "MAX_TENANTS", 3)
+    metrics.tenant_queue("busy", 2)
+    for tenant in ("a", "b", "c", "d"):
+        metrics.record_tenant_call(tenant, 0.0, 1.0)
+    assert list(metrics.snapshot()["tenants"]) == ["busy", "c", "d"]
+    metrics.record_tenant_call("c", 0.0, 1.0)
+    metrics.record_tenant_call("e", 0.0, 1.0)
+    assert list(metrics.snapshot()["tenants"]) == ["busy", "c", "e"]
+    assert metrics.snapshot()["tenants"]["c"]["calls"] == 2
+
+
+def test_tenant_key():
+    assert tenant_for("menu_1700000000000") == "menu"
+    assert tenant_for(None, "menus_langchain/menu_1700000000000.pdf") == "menus_langchain"
+    assert tenant_for() == "default"
@@ -0,0 +1,120 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+import deadline
+import memory_budget
+import menu_parser_with_file
+import settings
+from memory_budget import MemoryBudgetExceeded, RequestMemory
+
+
+@pytest.fixture
+def request_memory():
+    token = memory_budget.start_request(1000)
+    yield memory_budget._current.get()
+    memory_budget.finish_request(token)
+
+
+def test_reserve_over_budget_raises():
+    memory = RequestMemory(1000)
+    memory.reserve(600, "file")
+    with pytest.raises(MemoryBudgetExceeded):
+        memory.reserve(500, "page")
+    assert memory.in_use == 600
+
+
+def test_zero_budget_is_unlimited():
+    memory = RequestMemory(0)
+    memory.reserve(10 ** 12, "file")
+    assert memory.high_water == 10 ** 12
+
+
+def test_held_releases_at_the_end_of_the_block(request_memory):
+    memory_budget.reserve(300, "file")
+    with memory_budget.held(500, "page"):
+        assert (request_memory.in_use, request_memory.transient) == (800, 500)
+    assert (request_memory.in_use, request_memory.transient) == (300, 0)
+    assert request_memory.high_water == 800
+
+
+def test_held_outside_a_request_is_a_no_op():
+    with memory_budget.held(10 ** 12, "page"):
+        pass
+
+
+def test_acquire_releases_once(request_memory):
+    release = memory_budget.acquire(400, "page")
+    release()
+    release()
+    assert request_memory.in_use == 0
+
+
+def test_wait_blocks_until_a_transient_buffer_is_released(request_memory):
+    release = memory_budget.acquire(700, "page 1")
+    waited = []
+
+    def second_page():
+        with memory_budget.held(700, "page 2", wait=True):
+            waited.append(request_memory.in_use)
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(second_page,))
+    thread.start()
+    time.sleep(0.05)
+    assert waited == []
+    release()
+    thread.join(5)
+    assert waited == [700]
+
+
+def test_wait_fails_when_only_long_lived_buffers_are_held(request_memory):
+    memory_budget.reserve(700, "file")
+    with pytest.raises(MemoryBudgetExceeded):
+        with memory_budget.held(700, "page", wait=True):
+            pass
+
+
+def test_wait_ends_at_the_request_deadline(request_memory):
+    memory_budget.acquire(700, "page 1")
+    token = deadline.start_request(0.1)
+    try:
+        started = time.monotonic()
+        with pytest.raises(deadline.DeadlineExceeded):
+            with memory_budget.held(700, "page 2", wait=True):
+                pass
+        assert time.monotonic() - started < 2
+    finally:
+        deadline.finish_request(token)
+
+
+def test_pdf_pages_are_reserved_from_rasterizing(monkeypatch, request_memory):
+    """Page images waiting for the parse stage count against the budget."""
+    monkeypatch.setattr(settings, "PDF_RASTER_WORKERS", 2)
+    monkeypatch.setattr(settings, "PDF_PARSE_WORKERS", 1)
+    monkeypatch.setattr(settings, "PIPELINE_QUEUE_SIZE", 4)
+    monkeypatch.setattr(menu_parser_with_file, "pdf_text_pages", lambda data, first, last: [None] * (last - first + 1))
+    monkeypatch.setattr(menu_parser_with_file, "pdf_to_images", lambda data, first, last: [b"x" * 100])
+    monkeypatch.setattr(menu_parser_with_file, "merge_page_results", lambda results: results)
+    # One page image and its vision call take 100 + 2 * 158 bytes: two fit in the budget, three do not
+    peak = []
+
+    def parse(ocr, image, api_key, label):
+        peak.append(request_memory.in_use)
+        time.sleep(0.02)
+        return label
+    monkeypatch.setattr(menu_parser_with_file, "parse_menu_two_step", parse)
+    results = menu_parser_with_file.parse_pdf_page_range(b"%PDF", [["ocr"]] * 6, 1, 6)
+    assert results == [f"page {n}" for n in range(1, 7)]
+    assert request_memory.high_water <= 1000
+    assert max(peak) == 2 * (100 + memory_budget.vision_call_size(100))
+    assert request_memory.in_use == 0
+
+
+def test_over_budget_file_is_rejected_before_download(monkeypatch, request_memory):
+    downloads = []
+    monkeypatch.setattr(menu_parser_with_file, "file_size", lambda path: 5000)
+    monkeypatch.setattr(menu_parser_with_file, "download_file_from_firebase", downloads.append)
+    with pytest.raises(MemoryBudgetExceeded):
+        menu_parser_with_file.parse_menu_with_file("menu.pdf", [["ocr"]])
+    assert downloads == []
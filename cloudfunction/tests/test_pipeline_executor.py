@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+from pipeline_executor import Pipeline, Stage
+
+
+def test_results_keep_input_order_and_drop_none():
+    pipeline = Pipeline("t", [
+        Stage("double", lambda x: x * 2, workers=3),
+        Stage("odd_only", lambda x: x if x % 4 else None, workers=2),
+    ], queue_size=1)
+    assert pipeline.run(range(10)) == [2, 6, 10, 14, 18]
+
+
+def test_stage_error_is_reraised():
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("bad item")
+        return x
+
+    with pytest.raises(ValueError, match="bad item"):
+        Pipeline("t", [Stage("check", fail_on_three, workers=2)]).run(range(10))
+
+
+def test_failing_items_iterator_stops_the_workers():
+    def items():
+        yield 1
+        yield 2
+        raise RuntimeError("source failed")
+
+    before = set(threading.enumerate())
+    with pytest.raises(RuntimeError, match="source failed"):
+        Pipeline("t", [Stage("a", lambda x: x, workers=2), Stage("b", lambda x: x, workers=2)]).run(items())
+    leaked = [t for t in threading.enumerate() if t not in before and t.is_alive()]
+    assert leaked == []
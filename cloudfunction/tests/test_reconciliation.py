@@ -0,0 +1,87 @@
+import pytest
+
+import settings
+from menu_parser_with_file import refinement_plan
+from reconciliation import reconcile_menu
+
+
+def ocr(*texts):
+    return [{"text": t} for t in texts]
+
+
+def menu(sections):
+    """Menu JSON from {subcategory title: [(item title, price), ...]}."""
+    subs, items = [], []
+    for sub_id, (title, entries) in enumerate(sections.items(), start=1):
+        subs.append({"id": sub_id, "catId": 1, "title": title, "description": ""})
+        for name, price in entries:
+            items.append({
+                "itemId": len(items) + 1, "subCatId": sub_id, "title": name, "description": "", "price": price,
+                "variantAvailable": 0, "variants": [], "optionsAvailable": 0, "options": [],
+            })
+    return {"data": {"category": [{"id": 1, "title": "Food", "description": ""}], "sub_category": subs, "items": items}}
+
+
+STARTERS = ocr("STARTERS", "Soup of the Day 6.50", "Garlic Bread 4.00")
+MAINS = ocr("MAINS", "Steak Frites 28", "Roast Chicken 22")
+FULL_MENU = menu({"STARTERS": [("Soup of the Day", 6.5), ("Garlic Bread", 4.0)],
+                  "MAINS": [("Steak Frites", 28), ("Roast Chicken", 22)]})
+
+
+@pytest.fixture(autouse=True)
+def refine_settings(monkeypatch):
+    monkeypatch.setattr(settings, "VISION_REFINE_SKIP_COVERAGE", 0.95)
+    monkeypatch.setattr(settings, "VISION_REFINE_PARTIAL", True)
+
+
+def test_complete_parse_reconciles():
+    report = reconcile_menu(FULL_MENU, STARTERS + MAINS, 0.95)
+    assert report["price_coverage"] == 1.0
+    assert report["text_coverage"] == 1.0
+    assert report["header_coverage"] == 1.0
+    assert report["ocr_prices"] == 2
+    assert report["items"] == 4
+    assert report["unreconciled"] == []
+
+
+def test_missing_items_without_decimal_prices_are_unreconciled():
+    parsed = menu({"STARTERS": [("Soup of the Day", 6.5), ("Garlic Bread", 4.0)], "MAINS": [("Steak Frites", 28)]})
+    report = reconcile_menu(parsed, STARTERS + MAINS, 0.95)
+    assert report["price_coverage"] == 1.0
+    assert [(s["title"], s["text_coverage"]) for s in report["unreconciled"]] == [("MAINS", 0.5)]
+
+
+def test_wrapped_descriptions_are_explained():
+    parsed = menu({"STARTERS": [("Soup of the Day", 6.5)]})
+    parsed["data"]["items"][0]["description"] = "Tomato and basil, served with crusty bread"
+    report = reconcile_menu(parsed, ocr("STARTERS", "Soup of the Day 6.50", "Tomato and basil,", "served with crusty bread"), 0.95)
+    assert report["text_coverage"] == 1.0
+
+
+def test_skip_when_everything_reconciles():
+    assert refinement_plan(FULL_MENU, STARTERS + MAINS)[0] == "skip"
+
+
+def test_empty_parse_is_never_skipped():
+    plan, _, report = refinement_plan({"data": {"category": [], "sub_category": [], "items": []}}, MAINS)
+    assert plan == "full"
+    assert report["items"] == 0
+
+
+def test_ocr_without_price_tokens_is_never_skipped():
+    parsed = menu({"MAINS": [("Steak Frites", 28), ("Roast Chicken", 22)]})
+    plan, _, report = refinement_plan(parsed, MAINS)
+    assert report["ocr_prices"] == 0
+    assert plan == "full"
+
+
+def test_partial_refines_only_unreconciled_sections():
+    parsed = menu({"STARTERS": [("Soup of the Day", 6.5), ("Garlic Bread", 4.0)], "MAINS": [("Steak Frites", 28)]})
+    plan, ids, _ = refinement_plan(parsed, STARTERS + MAINS)
+    assert (plan, ids) == ("partial", [2])
+
+
+def test_partial_disabled_falls_back_to_full(monkeypatch):
+    monkeypatch.setattr(settings, "VISION_REFINE_PARTIAL", False)
+    parsed = menu({"STARTERS": [("Soup of the Day", 6.5)], "MAINS": [("Steak Frites", 28), ("Roast Chicken", 22)]})
+    assert refinement_plan(parsed, STARTERS + MAINS)[0] == "full"
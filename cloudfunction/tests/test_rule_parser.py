@@ -0,0 +1,69 @@
+import settings
+from langchain_pipeline import rule_based_result
+from reconciliation import chunk_confidence
+from rule_parser import rule_based_parse
+
+SALADS = [
+    "SALADS",
+    "House Salad 8.00",
+    "mixed greens, tomato, cucumber",
+    "Caesar Salad 9.50",
+    "romaine, parmesan, croutons",
+    "Greek Salad 10.00",
+    "Cobb Salad 12.00",
+]
+
+
+def lines(texts):
+    return [{"text": t} for t in texts]
+
+
+def test_parses_items_descriptions_and_sections():
+    result, unexplained = rule_based_parse(lines(SALADS))
+    data = result["data"]
+    assert unexplained == 0
+    assert [s["title"] for s in data["sub_category"]] == ["SALADS"]
+    assert [(i["title"], i["price"]) for i in data["items"]] == [
+        ("House Salad", 8.0), ("Caesar Salad", 9.5), ("Greek Salad", 10.0), ("Cobb Salad", 12.0),
+    ]
+    assert data["items"][0]["description"] == "mixed greens, tomato, cucumber"
+
+
+def test_lines_with_prices_are_not_descriptions():
+    for line in ("add grilled chicken 4.00, add shrimp 6.00", "Lemonade 3.00 / 4.50"):
+        result, unexplained = rule_based_parse(lines(SALADS + [line]))
+        assert unexplained == 1, line
+        assert all(line not in i["description"] for i in result["data"]["items"])
+
+
+def test_multi_price_and_size_lines_are_unexplained():
+    _, unexplained = rule_based_parse(lines(["DRINKS", "Lemonade 3.00 4.50", "LARGE 5.00", "Iced Tea 3.00"]))
+    assert unexplained == 2
+
+
+def test_chunk_confidence_of_a_complete_parse():
+    payload = lines(SALADS)
+    result, _ = rule_based_parse(payload)
+    assert chunk_confidence(payload, result) == {"schema": True, "price_coverage": 1.0, "count_agreement": 1.0, "score": 1.0}
+
+
+def test_chunk_confidence_counts_missing_prices():
+    payload = lines(SALADS + ["add grilled chicken 4.00, add shrimp 6.00"])
+    result, _ = rule_based_parse(lines(SALADS))
+    confidence = chunk_confidence(payload, result)
+    assert confidence["price_coverage"] == round(4 / 6, 3)
+    assert confidence["count_agreement"] == round(4 / 6, 3)
+
+
+def test_chunk_confidence_of_an_invalid_result_is_zero():
+    payload = lines(SALADS)
+    assert chunk_confidence(payload, {"data": {"items": [{"title": "x"}]}})["score"] == 0.0
+
+
+def test_rule_result_requires_every_price(monkeypatch):
+    monkeypatch.setattr(settings, "CHUNK_RULE_BASED", True)
+    monkeypatch.setattr(settings, "CHUNK_CONFIDENCE_THRESHOLD", 0.8)
+    assert rule_based_result(lines(SALADS)) is not None
+    # Eight salads and one add-on line: scores 0.8 on its own, but drops two prices
+    salads = ["SALADS"] + [f"Salad {n} {8 + n}.00" for n in range(8)]
+    assert rule_based_result(lines(salads + ["add grilled chicken 4.00, add shrimp 6.00"])) is None
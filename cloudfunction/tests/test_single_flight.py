@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import metrics
+from single_flight import SingleFlight, flight_key
+
+
+def run_together(flight, key, fn, callers=4):
+    """Call flight.do from several threads while the leader's fn is blocked; returns their outcomes."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def call(n):
+        try:
+            if n == 0:
+                return flight.do(key, leader_fn)
+            started.wait(5)
+            return flight.do(key, fn)
+        except Exception as e:
+            return e
+
+    # Followers count as coalesced once they hold the leader's future
+    coalesced = metrics.snapshot()["counters"].get(f"{flight.name}_coalesced", 0) + callers - 1
+    with ThreadPoolExecutor(callers) as pool:
+        futures = [pool.submit(call, n) for n in range(callers)]
+        while metrics.snapshot()["counters"].get(f"{flight.name}_coalesced", 0) < coalesced:
+            release.wait(0.01)
+        release.set()
+        return [f.result() for f in futures]
+
+
+def test_concurrent_calls_share_one_run():
+    calls = []
+    flight = SingleFlight("test")
+    outcomes = run_together(flight, "k", lambda: calls.append(1) or "menu")
+    assert calls == [1]
+    assert sorted(outcomes, key=lambda r: r[1]) == [("menu", False)] + [("menu", True)] * 3
+    assert flight._inflight == {}
+
+
+def test_exception_reaches_every_waiter():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise RuntimeError("parse failed")
+    outcomes = run_together(flight, "k", fail)
+    assert all(isinstance(e, RuntimeError) for e in outcomes)
+    # The key is free again after a failure
+    assert flight.do("k", lambda: "menu") == ("menu", False)
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight("test")
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
+    assert flight_key("menu.pdf", "text") != flight_key("menu.pdf", "other text")
+    assert flight_key("menu.pdf", "text") == flight_key("menu.pdf", "text")
+
+
+def test_leader_exception_is_reraised():
+    with pytest.raises(ValueError):
+        SingleFlight("test").do("k", lambda: int("x"))